@@ -1,6 +1,7 @@
 import codemd.keys as keys
 import logging
 import time
+import os
 
 def config_app(app):
     app.secret_key = keys.SECRET_KEY
@@ -14,6 +15,11 @@ def config_app(app):
     # app.config['MONGO_DBNAME'] = 'codemd'
     app.config['MONGO_URI'] = keys.MONGO_URI
 
+    # Private directory of the local caches (checkpoints, git mirrors), see
+    # utils.private_directory()
+    app.config['DATA_DIR'] = getattr(keys, 'DATA_DIR',
+                                     os.path.join(os.path.expanduser('~'), '.codemd'))
+
     # Setup logging
     timestr = time.strftime("%Y%m%d-%H%M%S")
     log_name = 'logs/codemd_log_{}.log'.format(timestr)
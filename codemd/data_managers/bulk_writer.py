@@ -0,0 +1,143 @@
+import logging
+import threading
+import Queue
+import time
+
+from pymongo.errors import BulkWriteError
+
+class BulkWriter(object):
+    """
+    Inserts the documents yielded by a generator into a collection in bounded
+    batches of unordered inserts, logging progress and throughput as it goes.
+
+    When threaded, a producer thread pulls documents out of the generator (ie
+    parses git history) and hands complete batches to the writing thread through
+    a bounded queue, so producing and writing documents overlap.
+
+    :param collection: The collection to insert into
+    :type collection: pymongo.collection.Collection
+    :param batch_size: Number of documents per insert_many call
+    :param write_concern: Optional write concern for the inserts
+    :type write_concern: pymongo.write_concern.WriteConcern
+    :param threaded: Whether to produce documents in a separate thread
+    :param progress_callback: Optional callable invoked with the total number of
+        documents written after each batch
+    """
+
+    # Maximum number of complete batches waiting to be written
+    QUEUE_SIZE = 4
+
+    # Sentinel marking the end of the produced batches
+    __DONE = object()
+
+    def __init__(self, collection, batch_size=1000, write_concern=None,
+                 threaded=True, progress_callback=None):
+        self.log = logging.getLogger('codemd.BulkWriter')
+        if write_concern is not None:
+            collection = collection.with_options(write_concern=write_concern)
+        self.collection = collection
+        self.batch_size = batch_size
+        self.threaded = threaded
+        self.progress_callback = progress_callback
+        self.written = 0
+
+    def write(self, doc_gen):
+        """
+        Inserts all the documents yielded by doc_gen
+
+        :return: The number of documents written
+        """
+        self.written = 0
+        start_time = time.time()
+        batches = self.__threaded_batches(doc_gen) if self.threaded else self.__batches(doc_gen)
+        for batch in batches:
+            self.__write_batch(batch)
+            elapsed = time.time() - start_time
+            self.log.debug("Wrote %s documents so far (%.1f docs/sec)", self.written,
+                           self.written / elapsed if elapsed > 0 else 0.0)
+            if self.progress_callback is not None:
+                self.progress_callback(self.written)
+
+        elapsed = time.time() - start_time
+        self.log.info("Finished writing %s documents in %.1f seconds (%.1f docs/sec)",
+                      self.written, elapsed, self.written / elapsed if elapsed > 0 else 0.0)
+        return self.written
+
+    def __write_batch(self, batch):
+        try:
+            result = self.collection.insert_many(batch, ordered=False)
+            self.written += len(result.inserted_ids)
+        except BulkWriteError as error:
+            self.written += error.details['nInserted']
+            self.log.error("!!! Error writing batch, %s documents were written in total. "
+                           + "Write errors: %s", self.written, error.details['writeErrors'][0:8])
+            raise
+
+    def __batches(self, doc_gen):
+        batch = []
+        for doc in doc_gen:
+            batch.append(doc)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if len(batch) > 0:
+            yield batch
+
+    def __threaded_batches(self, doc_gen):
+        """
+        Yields the batches built by a producer thread consuming doc_gen
+        """
+        batches_queue = Queue.Queue(maxsize=self.QUEUE_SIZE)
+        stop = threading.Event()
+
+        def put(item):
+            # Returns False if the writer stopped consuming batches
+            while not stop.is_set():
+                try:
+                    batches_queue.put(item, timeout=1)
+                    return True
+                except Queue.Full:
+                    continue
+            return False
+
+        def produce():
+            try:
+                for batch in self.__batches(doc_gen):
+                    if not put(batch):
+                        return
+                put(self.__DONE)
+            except Exception as error:
+                self.log.error("!!! Error producing documents: %s", error)
+                put(error)
+            finally:
+                self.__close(doc_gen)
+
+        producer = threading.Thread(target=produce, name='codemd-bulk-producer')
+        producer.daemon = True
+        producer.start()
+        try:
+            while True:
+                batch = batches_queue.get()
+                if batch is self.__DONE:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            # Unblock the producer if the writer stopped early, and release the
+            # resources of doc_gen (ie the git process) rather than leaving them
+            # to the garbage collector. If the producer is running doc_gen, it
+            # closes it itself as soon as it gets its next document.
+            stop.set()
+            self.__close(doc_gen)
+            producer.join()
+
+    def __close(self, doc_gen):
+        close = getattr(doc_gen, 'close', None)
+        if close is None:
+            return
+        try:
+            close()
+        except ValueError:
+            # The generator is executing in the other thread
+            pass
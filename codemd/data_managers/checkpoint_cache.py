@@ -0,0 +1,332 @@
+import logging
+import struct
+import base64
+import json
+import mmap
+import shutil
+import glob
+import os
+from collections import defaultdict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from codemd import app
+from codemd.utils import private_directory
+from codemd.data_managers.checkpoint_codec import CheckpointCodec
+
+class CheckpointCache(object):
+    """
+    Local, memory mapped store of checkpoint data, with one file per
+    (project, checkpoint date, module key).
+
+    Files hold the uncompressed payload of a checkpoint encoded by
+    CheckpointCodec: a JSON header describing the payload, followed by the raw
+    bytes of its typed arrays and string table. Loading a file maps it into
+    memory and wraps its arrays with numpy without copying them, so web workers
+    loading the same checkpoint share the OS page cache instead of each fetching
+    and decompressing it from mongo. Only numpy array fields (ie the couple
+    matrices of the temporal coupling module) are used in place: the other
+    fields are decoded from the mapped arrays into python objects, like when
+    decoding the checkpoint from mongo.
+
+    Files are never unpickled: the header is JSON, with the few python types it
+    doesn't represent tagged (see _to_json()). Module data holding any other
+    type isn't cached. The root directory is also private to the user running
+    codemd (see utils.private_directory()).
+
+    Files are named after the id of the first chunk document of the module's
+    checkpoint, so checkpoints rebuilt in mongo are never served stale from the
+    cache. The directories of removed checkpoints are deleted with them (see
+    remove()), and when the cache grows over MAX_SIZE bytes the least recently
+    used files are evicted (see evict()). Truncated or corrupt files are cache
+    misses.
+
+    The cache requires numpy, see CheckpointCache.available().
+
+    :param root: Directory holding the cached checkpoints. Defaults to the
+        DIRECTORY_NAME directory of the DATA_DIR of the app config
+    :param max_size: Maximum total size of the cached files in bytes. Defaults
+        to MAX_SIZE
+    """
+
+    DIRECTORY_NAME = 'checkpoints'
+
+    MAGIC = 'CODEMDCJ'
+
+    # Arrays are aligned on ALIGNMENT bytes in the files
+    ALIGNMENT = 8
+
+    HEADER_FORMAT = '<8sQ'
+
+    MAX_SIZE = 4 * 1024 ** 3
+
+    # Fraction of the maximum size the cache is reduced to when evicting, so
+    # evictions (and the scans they need) don't happen on every store
+    EVICTION_TARGET = 0.9
+
+    def __init__(self, root=None, max_size=None):
+        self.log = logging.getLogger('codemd.CheckpointCache')
+        if root is None:
+            root = os.path.join(app.config['DATA_DIR'], self.DIRECTORY_NAME)
+        self.root = private_directory(root)
+        self.max_size = max_size if max_size is not None else self.MAX_SIZE
+        # Running total of the size of the cached files, None until the cache
+        # is first scanned by evict()
+        self.size = None
+
+    @classmethod
+    def available(cls):
+        """
+        Checks if the cache can be used, ie if numpy is installed
+        """
+        return numpy is not None
+
+    def path(self, project_name, date, module_key, token):
+        """
+        Returns the path of the file for a module of a checkpoint, ie
+        <root>/<project name>/<date>/<module key>-<token>.cp
+        """
+        return os.path.join(self.root, project_name, str(date),
+                            "%s-%s.cp" % (module_key, token))
+
+    def load(self, project_name, date, module_key, token):
+        """
+        Loads the data of a module of a checkpoint from the cache
+
+        :param token: Identifies the saved version of the checkpoint (ie the id
+            of its first chunk in mongo)
+        :returns: The decoded module data, or None if it isn't cached
+        """
+        path = self.path(project_name, date, module_key, token)
+        try:
+            with open(path, 'rb') as cache_file:
+                mapped = mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ)
+            # Marks the file as recently used for evict()
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            # ValueError for empty files, which can't be mapped
+            return None
+
+        try:
+            return self.__decode(mapped)
+        except Exception as error:
+            self.log.error("!!! Invalid checkpoint cache file %s (%s), removing it",
+                           path, error)
+            self.__remove_file(path)
+            return None
+
+    def __decode(self, mapped):
+        header_size = struct.calcsize(self.HEADER_FORMAT)
+        magic, payload_size = struct.unpack(self.HEADER_FORMAT, mapped[0:header_size])
+        if magic != self.MAGIC or header_size + payload_size > len(mapped):
+            raise ValueError("invalid header")
+        payload = _from_json(json.loads(mapped[header_size:header_size + payload_size]))
+        arrays_start = self.__aligned(header_size + payload_size)
+        mapped_bytes = numpy.frombuffer(mapped, dtype=numpy.uint8)
+
+        def map_array((offset, size)):
+            if arrays_start + offset + size > len(mapped_bytes):
+                raise ValueError("truncated arrays")
+            return mapped_bytes[arrays_start + offset:arrays_start + offset + size]
+
+        CheckpointCodec.map_arrays(payload, map_array)
+        return CheckpointCodec.decode_payload(payload)
+
+    def store(self, project_name, date, module_key, token, data):
+        """
+        Saves the data of a module of a checkpoint in the cache, replacing the
+        other cached versions of it
+
+        :param data: The module data, encoded by CheckpointCodec.encode()
+        :returns: True if the data was cached, False if it holds values the
+            header can't represent
+        """
+        payload = CheckpointCodec.load_payload(data)
+        arrays = []
+        arrays_size = [0]
+
+        def add_array(array_data):
+            offset = arrays_size[0]
+            arrays.append((offset, array_data))
+            arrays_size[0] = self.__aligned(offset + len(array_data))
+            return (offset, len(array_data))
+
+        CheckpointCodec.map_arrays(payload, add_array)
+        try:
+            header = json.dumps(_to_json(payload), separators=(',', ':'))
+        except TypeError as error:
+            self.log.debug("Not caching module <%s> of checkpoint %s of project %s: %s",
+                           module_key, date, project_name, error)
+            return False
+
+        path = self.path(project_name, date, module_key, token)
+        directory = os.path.dirname(path)
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Created concurrently by another worker
+                if not os.path.isdir(directory):
+                    raise
+
+        # Write next to the final path so partial files are never loaded
+        tmp_path = "%s.%s.tmp" % (path, os.getpid())
+        with open(tmp_path, 'wb') as cache_file:
+            cache_file.write(struct.pack(self.HEADER_FORMAT, self.MAGIC, len(header)))
+            cache_file.write(header)
+            arrays_start = self.__aligned(cache_file.tell())
+            for offset, array_data in arrays:
+                cache_file.seek(arrays_start + offset)
+                cache_file.write(array_data)
+            size = cache_file.tell()
+        os.rename(tmp_path, path)
+        self.__add_size(size)
+        self.log.debug("Cached module <%s> of checkpoint %s of project %s at %s",
+                       module_key, date, project_name, path)
+
+        for stale_path in glob.glob(self.path(project_name, date, module_key, '*')):
+            if stale_path != path:
+                self.log.debug("Removing stale checkpoint cache file %s", stale_path)
+                self.__remove_file(stale_path)
+        self.evict(keep=path)
+        return True
+
+    def remove(self, project_name, dates):
+        """
+        Removes the cached files of the checkpoints of project_name at dates
+        """
+        for date in dates:
+            directory = os.path.join(self.root, project_name, str(date))
+            if os.path.isdir(directory):
+                self.log.debug("Removing cached checkpoint %s of project %s", date,
+                               project_name)
+                for _, size, path in self.__files(directory):
+                    self.__remove_file(path, size)
+                # Files removed concurrently by another worker are ignored
+                shutil.rmtree(directory, ignore_errors=True)
+
+    def evict(self, keep=None):
+        """
+        Removes the least recently used files when the total size of the cache
+        is over self.max_size, until it is under EVICTION_TARGET * self.max_size.
+        Files still mapped by a worker stay readable by it until they are
+        unmapped.
+
+        The total size is a running total of the files this cache stored and
+        removed, so the cache is only scanned when the total first goes over
+        the maximum size, which then sets it to the actual total. Files cached
+        by other processes meanwhile are counted from that scan on, so the cache
+        may exceed its maximum size by what they stored since their last scan.
+
+        :param keep: Path of a file which should never be evicted
+        """
+        if self.size is not None and self.size <= self.max_size:
+            return
+        files = self.__files(self.root)
+        self.size = sum(size for _, size, _ in files)
+
+        for _, size, path in sorted(files):
+            if self.size <= self.EVICTION_TARGET * self.max_size:
+                break
+            if path == keep:
+                continue
+            self.log.info("Evicting checkpoint cache file %s (%s bytes)", path, size)
+            self.__remove_file(path, size)
+
+    @staticmethod
+    def __files(directory):
+        """
+        Returns a list of (modification time, size, path) for the files under
+        directory
+        """
+        files = []
+        for dir_path, _, file_names in os.walk(directory):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                try:
+                    status = os.stat(path)
+                except OSError:
+                    continue
+                files.append((status.st_mtime, status.st_size, path))
+        return files
+
+    def __add_size(self, size):
+        if self.size is not None:
+            self.size += size
+
+    def __remove_file(self, path, size=None):
+        try:
+            if size is None:
+                size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            # Removed concurrently by another worker
+            return
+        self.__add_size(-size)
+
+    def __aligned(self, offset):
+        return (offset + self.ALIGNMENT - 1) // self.ALIGNMENT * self.ALIGNMENT
+
+
+# Default factories of the defaultdicts the header can hold
+_DEFAULT_FACTORIES = {'int': int, 'float': float, 'list': list}
+
+def _to_json(value):
+    """
+    Converts a payload to JSON values. The types JSON doesn't tell apart are
+    tagged with single entry objects: {"t": items} for tuples, {"d": [[key,
+    value], ...], "f": default factory} for dicts, {"u": text} for unicode
+    strings and {"b": base64} for non ascii byte strings.
+
+    :raises TypeError: If the payload holds a value of any other type
+    """
+    if value is None or isinstance(value, (bool, int, long, float)):
+        return value
+    if isinstance(value, str):
+        try:
+            value.decode('ascii')
+            return value
+        except UnicodeDecodeError:
+            return {'b': base64.b64encode(value)}
+    if isinstance(value, unicode):
+        return {'u': value}
+    if isinstance(value, list):
+        return [_to_json(item) for item in value]
+    if isinstance(value, tuple):
+        return {'t': [_to_json(item) for item in value]}
+    if isinstance(value, dict):
+        factory = None
+        if isinstance(value, defaultdict):
+            factory = getattr(value.default_factory, '__name__', None)
+            if _DEFAULT_FACTORIES.get(factory) is not value.default_factory:
+                raise TypeError("unsupported default factory %r" % value.default_factory)
+        return {'d': [[_to_json(k), _to_json(v)] for k, v in value.iteritems()],
+                'f': factory}
+    raise TypeError("unsupported type %s" % type(value).__name__)
+
+def _from_json(value):
+    """
+    Converts JSON values returned by _to_json() back to the payload
+    """
+    if isinstance(value, unicode):
+        # Untagged strings are ascii byte strings
+        return value.encode('ascii')
+    if isinstance(value, list):
+        return [_from_json(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if 'u' in value:
+        return value['u']
+    if 'b' in value:
+        return base64.b64decode(value['b'])
+    if 't' in value:
+        return tuple(_from_json(item) for item in value['t'])
+    items = ((_from_json(k), _from_json(v)) for k, v in value['d'])
+    if value['f'] is None:
+        return dict(items)
+    decoded = defaultdict(_DEFAULT_FACTORIES[value['f']])
+    decoded.update(items)
+    return decoded
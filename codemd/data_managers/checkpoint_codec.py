@@ -0,0 +1,437 @@
+import zlib
+import pickle
+from array import array
+from collections import defaultdict
+
+from codemd.metrics.circle_packing.records import Record, FileRecordStore, FileRecordStoreView
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class CheckpointCodec(object):
+    """
+    Encodes the persist_mappings() of circle packing modules into compact byte
+    strings for checkpoints, and decodes them back.
+
+    Rather than pickling dicts of tuples of strings, values are stored column
+    wise in typed arrays, with every string (file names, authors) stored once in
+    a shared string table and referenced by index:
+        - {(file1, file2): count} couples become 3 int arrays (file1, file2, count)
+        - {file: count} counters become an index array and a value array
+        - working_data ({file: {module_key: {field: value}}}) becomes one typed
+          column per (module_key, field). List and dict fields (ie bug dates,
+          top authors) are stored as offsets into flat value arrays. A
+          FileRecordStore (or a view of it) is encoded the same way, straight
+          from its records, and decodes to the dicts of its to_dicts()
+        - numpy arrays are stored as their raw bytes
+    Values of any other shape are pickled as they are.
+
+    The encoded payload is pickled and compressed with zlib. Its typed arrays
+    are byte strings, which may be replaced by any buffer of the same bytes
+    supporting view(typecode) (ie numpy arrays over a memory map) before
+    decoding it with decode_payload().
+    """
+
+    VERSION = 1
+
+    # zlib level, favouring speed since checkpoints are written during ingest
+    COMPRESSION_LEVEL = 1
+
+    # Separator of the strings in the string table
+    STRING_SEPARATOR = '\0'
+
+    INT_TYPE = 'l'
+    FLOAT_TYPE = 'd'
+    INDEX_TYPE = 'i'
+
+    @classmethod
+    def encode(cls, mappings):
+        """
+        :param mappings: The persist_mappings() of a module
+        :returns: The encoded mappings, as a byte string
+        """
+        strings = _StringTable()
+        fields = {}
+        for key, value in mappings.iteritems():
+            fields[key] = cls.__encode_value(value, strings)
+        payload = {'version': cls.VERSION, 'strings': strings.encode(), 'fields': fields}
+        return zlib.compress(pickle.dumps(payload, protocol=2), cls.COMPRESSION_LEVEL)
+
+    @classmethod
+    def decode(cls, data):
+        """
+        :param data: Mappings encoded with encode()
+        :returns: The decoded mappings
+        """
+        return cls.decode_payload(cls.load_payload(data))
+
+    @classmethod
+    def load_payload(cls, data):
+        """
+        :param data: Mappings encoded with encode()
+        :returns: The uncompressed payload of the encoded mappings
+        """
+        return pickle.loads(zlib.decompress(data))
+
+    @classmethod
+    def decode_payload(cls, payload):
+        """
+        :param payload: A payload returned by load_payload()
+        :returns: The decoded mappings
+        """
+        strings = _StringTable.decode(payload['strings'])
+        return dict((key, cls.__decode_value(value, strings))
+                    for key, value in payload['fields'].iteritems())
+
+    @classmethod
+    def map_arrays(cls, payload, function):
+        """
+        Replaces every typed array of payload, in place, by function(array).
+        The joined strings of the string table are mapped too.
+        """
+        def map_keys(encoded, keys):
+            for key in keys:
+                if encoded.get(key) is not None:
+                    encoded[key] = function(encoded[key])
+
+        map_keys(payload['strings'], ['joined', 'unicode'])
+        for encoded in payload['fields'].itervalues():
+            if encoded['kind'] == 'pairs':
+                map_keys(encoded, ['firsts', 'seconds', 'counts'])
+            elif encoded['kind'] in ('counter', 'ndarray'):
+                map_keys(encoded, ['keys', 'values'])
+            elif encoded['kind'] == 'records':
+                map_keys(encoded, ['names'])
+                for group in encoded['groups'].itervalues():
+                    if group['kind'] != 'fields':
+                        continue
+                    map_keys(group, ['present'])
+                    for column in group['columns'].itervalues():
+                        map_keys(column, ['missing'])
+                        if column['kind'] != 'objects':
+                            map_keys(column, ['nones', 'offsets', 'keys', 'values'])
+
+    @classmethod
+    def __encode_value(cls, value, strings):
+        if numpy is not None and isinstance(value, numpy.ndarray) and value.ndim == 1:
+            return {'kind': 'ndarray', 'dtype': value.dtype.str,
+                    'values': numpy.ascontiguousarray(value).tostring()}
+        if isinstance(value, FileRecordStoreView):
+            return cls.__encode_records(value.store, strings, value.exclude)
+        if isinstance(value, FileRecordStore):
+            return cls.__encode_records(value, strings)
+        if _is_plain_dict(value) and len(value) > 0:
+            keys = value.keys()
+            values = value.values()
+            if all(_is_pair(key) for key in keys) and all(_is_int(v) for v in values):
+                return cls.__encode_pairs(value, strings)
+            if all(_is_string(key) for key in keys):
+                if all(_is_number(v) for v in values):
+                    return cls.__encode_counter(value, strings)
+                if all(_is_plain_dict(v) and all(_is_string(k) for k in v)
+                       for v in values):
+                    return cls.__encode_records(value, strings)
+        return {'kind': 'object', 'value': value}
+
+    @classmethod
+    def __decode_value(cls, encoded, strings):
+        kind = encoded['kind']
+        if kind == 'pairs':
+            return cls.__decode_pairs(encoded, strings)
+        if kind == 'counter':
+            return cls.__decode_counter(encoded, strings)
+        if kind == 'records':
+            return cls.__decode_records(encoded, strings)
+        if kind == 'ndarray':
+            return _ndarray(encoded['dtype'], encoded['values'])
+        return encoded['value']
+
+    @classmethod
+    def __encode_pairs(cls, pairs, strings):
+        firsts, seconds = array(cls.INDEX_TYPE), array(cls.INDEX_TYPE)
+        counts = array(cls.INT_TYPE)
+        for (first, second), count in pairs.iteritems():
+            firsts.append(strings.index(first))
+            seconds.append(strings.index(second))
+            counts.append(count)
+        return {'kind': 'pairs', 'default': _default_factory(pairs),
+                'firsts': firsts.tostring(), 'seconds': seconds.tostring(),
+                'counts': counts.tostring()}
+
+    @classmethod
+    def __decode_pairs(cls, encoded, strings):
+        firsts = _values(cls.INDEX_TYPE, encoded['firsts'])
+        seconds = _values(cls.INDEX_TYPE, encoded['seconds'])
+        counts = _values(cls.INT_TYPE, encoded['counts'])
+        pairs = _new_dict(encoded['default'])
+        pairs.update(((strings[first], strings[second]), count)
+                     for first, second, count in zip(firsts, seconds, counts))
+        return pairs
+
+    @classmethod
+    def __encode_counter(cls, counter, strings):
+        typecode = cls.__typecode(counter.values())
+        return {'kind': 'counter', 'default': _default_factory(counter),
+                'typecode': typecode,
+                'keys': array(cls.INDEX_TYPE, [strings.index(k) for k in counter]).tostring(),
+                'values': array(typecode, counter.values()).tostring()}
+
+    @classmethod
+    def __decode_counter(cls, encoded, strings):
+        keys = _values(cls.INDEX_TYPE, encoded['keys'])
+        values = _values(encoded['typecode'], encoded['values'])
+        counter = _new_dict(encoded['default'])
+        counter.update((strings[key], value) for key, value in zip(keys, values))
+        return counter
+
+    @classmethod
+    def __encode_records(cls, records, strings, exclude=()):
+        """
+        Encodes a dict of records such as working_data, where each record is a
+        dict of sub-records (one per module key) holding the fields. Records
+        and sub-records may also be the Records of a FileRecordStore.
+
+        :param exclude: The module keys of the sub-records to leave out
+        """
+        names = records.keys()
+        encoded = {'kind': 'records',
+                   'names': array(cls.INDEX_TYPE, [strings.index(n) for n in names]).tostring(),
+                   'groups': {}}
+        group_keys = set()
+        for record in records.itervalues():
+            group_keys.update(record.keys())
+        group_keys.difference_update(exclude)
+        for group_key in group_keys:
+            sub_records = [records[name].get(group_key) for name in names]
+            present = [sub_record is not None for sub_record in sub_records]
+            if not all(_is_plain_dict(r) or isinstance(r, Record)
+                       for r in sub_records if r is not None):
+                encoded['groups'][group_key] = {'kind': 'object', 'value': sub_records}
+                continue
+            field_names = set()
+            for sub_record in sub_records:
+                if sub_record is not None:
+                    field_names.update(sub_record.keys())
+            columns = {}
+            for field in field_names:
+                columns[field] = cls.__encode_column(
+                    [r.get(field, _MISSING) if r is not None else _MISSING
+                     for r in sub_records], strings)
+            encoded['groups'][group_key] = {'kind': 'fields', 'columns': columns,
+                                            'present': array('b', present).tostring()}
+        return encoded
+
+    @classmethod
+    def __decode_records(cls, encoded, strings):
+        names = [strings[index] for index in _values(cls.INDEX_TYPE, encoded['names'])]
+        records = dict((name, {}) for name in names)
+        for group_key, group in encoded['groups'].iteritems():
+            if group['kind'] == 'object':
+                for name, sub_record in zip(names, group['value']):
+                    if sub_record is not None:
+                        records[name][group_key] = sub_record
+                continue
+            present = _values('b', group['present'])
+            sub_records = [{} if is_present else None for is_present in present]
+            for field, column in group['columns'].iteritems():
+                for sub_record, value in zip(sub_records,
+                                             cls.__decode_column(column, strings)):
+                    if sub_record is not None and value is not _MISSING:
+                        sub_record[field] = value
+            for name, sub_record in zip(names, sub_records):
+                if sub_record is not None:
+                    records[name][group_key] = sub_record
+        return records
+
+    @classmethod
+    def __encode_column(cls, values, strings):
+        """
+        Encodes the values of one field across all records. Missing values are
+        marked with _MISSING
+        """
+        missing = [value is _MISSING for value in values]
+        present_values = [value for value in values if value is not _MISSING]
+        encoded = {'missing': array('b', missing).tostring() if any(missing) else None}
+
+        if all(_is_number(v) for v in present_values):
+            typecode = cls.__typecode(present_values)
+            encoded.update(kind='numbers', typecode=typecode,
+                           values=array(typecode, present_values).tostring())
+        elif all(v is None or _is_number(v) for v in present_values):
+            nones = [v is None for v in present_values]
+            numbers = [v for v in present_values if v is not None]
+            typecode = cls.__typecode(numbers)
+            encoded.update(kind='optional_numbers', typecode=typecode,
+                           nones=array('b', nones).tostring(),
+                           values=array(typecode, numbers).tostring())
+        elif all(isinstance(v, (list, array)) and all(_is_number(x) for x in v)
+                 for v in present_values):
+            flat = [x for v in present_values for x in v]
+            typecode = cls.__typecode(flat)
+            encoded.update(kind='lists', typecode=typecode,
+                           offsets=_offsets(present_values).tostring(),
+                           values=array(typecode, flat).tostring())
+        elif all(_is_plain_dict(v) and all(_is_string(k) for k in v)
+                 and all(_is_number(x) for x in v.itervalues()) for v in present_values):
+            flat_values = [x for v in present_values for x in v.itervalues()]
+            typecode = cls.__typecode(flat_values)
+            defaults = set(_default_factory(v) for v in present_values)
+            if len(defaults) > 1:
+                encoded.update(kind='objects', values=present_values)
+            else:
+                keys = [strings.index(k) for v in present_values for k in v.iterkeys()]
+                encoded.update(kind='dicts', typecode=typecode,
+                               default=defaults.pop() if defaults else None,
+                               offsets=_offsets(present_values).tostring(),
+                               keys=array(cls.INDEX_TYPE, keys).tostring(),
+                               values=array(typecode, flat_values).tostring())
+        else:
+            encoded.update(kind='objects', values=present_values)
+        return encoded
+
+    @classmethod
+    def __decode_column(cls, encoded, strings):
+        kind = encoded['kind']
+        if kind == 'numbers':
+            values = _values(encoded['typecode'], encoded['values'])
+        elif kind == 'optional_numbers':
+            numbers = iter(_values(encoded['typecode'], encoded['values']))
+            values = [None if is_none else next(numbers)
+                      for is_none in _values('b', encoded['nones'])]
+        elif kind == 'lists':
+            flat = _values(encoded['typecode'], encoded['values'])
+            offsets = _values(cls.INT_TYPE, encoded['offsets'])
+            values = [flat[offsets[i]:offsets[i + 1]] for i in xrange(len(offsets) - 1)]
+        elif kind == 'dicts':
+            keys = [strings[k] for k in _values(cls.INDEX_TYPE, encoded['keys'])]
+            flat = _values(encoded['typecode'], encoded['values'])
+            offsets = _values(cls.INT_TYPE, encoded['offsets'])
+            values = []
+            for i in xrange(len(offsets) - 1):
+                value = _new_dict(encoded['default'])
+                value.update(zip(keys[offsets[i]:offsets[i + 1]],
+                                 flat[offsets[i]:offsets[i + 1]]))
+                values.append(value)
+        else:
+            values = encoded['values']
+
+        if encoded['missing'] is None:
+            return values
+        present_values = iter(values)
+        return [_MISSING if is_missing else next(present_values)
+                for is_missing in _values('b', encoded['missing'])]
+
+    @classmethod
+    def __typecode(cls, numbers):
+        if all(_is_int(n) for n in numbers):
+            return cls.INT_TYPE
+        return cls.FLOAT_TYPE
+
+
+class _StringTable(object):
+    """
+    Assigns an index to every distinct string of a checkpoint
+    """
+
+    def __init__(self, strings=None):
+        self.strings = strings if strings is not None else []
+        self.indices = {}
+
+    def index(self, string):
+        index = self.indices.get(string)
+        if index is None:
+            index = len(self.strings)
+            self.indices[string] = index
+            self.strings.append(string)
+        return index
+
+    def __getitem__(self, index):
+        return self.strings[index]
+
+    def encode(self):
+        # Strings are utf-8 encoded, with a flag keeping unicode and byte
+        # strings apart so they decode to their original type
+        is_unicode = array('b', [isinstance(s, unicode) for s in self.strings])
+        joined = CheckpointCodec.STRING_SEPARATOR.join(
+            s.encode('utf-8') if isinstance(s, unicode) else s for s in self.strings)
+        return {'count': len(self.strings), 'joined': joined,
+                'unicode': is_unicode.tostring()}
+
+    @classmethod
+    def decode(cls, encoded):
+        if encoded['count'] == 0:
+            return cls([])
+        joined = encoded['joined']
+        if not isinstance(joined, str):
+            joined = joined.tostring()
+        strings = joined.split(CheckpointCodec.STRING_SEPARATOR)
+        is_unicode = _values('b', encoded['unicode'])
+        return cls([s.decode('utf-8') if u else s for s, u in zip(strings, is_unicode)])
+
+
+# Marks fields missing from a record
+_MISSING = object()
+
+def _is_int(value):
+    return isinstance(value, (int, long)) and not isinstance(value, bool)
+
+def _is_number(value):
+    return _is_int(value) or isinstance(value, float)
+
+def _is_string(value):
+    return isinstance(value, basestring) and CheckpointCodec.STRING_SEPARATOR not in value
+
+def _is_pair(value):
+    return isinstance(value, tuple) and len(value) == 2 and all(_is_string(v) for v in value)
+
+def _is_plain_dict(value):
+    """
+    Checks if value is a dict or a defaultdict which can be rebuilt when decoding
+    """
+    if isinstance(value, defaultdict):
+        return _default_factory(value) is not None
+    return isinstance(value, dict)
+
+def _default_factory(value):
+    """
+    Returns the name of the default factory of value if it is a defaultdict
+    of a supported factory, or None
+    """
+    if isinstance(value, defaultdict) and value.default_factory in (int, float):
+        return value.default_factory.__name__
+    return None
+
+def _new_dict(default_factory):
+    if default_factory == 'int':
+        return defaultdict(int)
+    if default_factory == 'float':
+        return defaultdict(float)
+    return {}
+
+def _offsets(sequences):
+    offsets = array(CheckpointCodec.INT_TYPE, [0])
+    for sequence in sequences:
+        offsets.append(offsets[-1] + len(sequence))
+    return offsets
+
+def _values(typecode, data):
+    """
+    Returns the values of a typed array stored as a byte string, or as a buffer
+    supporting view(typecode), as a list
+    """
+    if isinstance(data, str):
+        values = array(typecode)
+        values.fromstring(data)
+        return values.tolist()
+    return data.view(typecode).tolist()
+
+def _ndarray(dtype, data):
+    """
+    Returns a numpy array over the bytes of a typed array stored as a byte
+    string, or as a buffer supporting view(dtype), without copying them
+    """
+    if isinstance(data, str):
+        return numpy.frombuffer(data, dtype=dtype)
+    return data.view(dtype)
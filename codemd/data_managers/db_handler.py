@@ -1,11 +1,18 @@
 import logging
 import pymongo
 import datetime
+import itertools
 
 from bson.binary import Binary
+from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError
 import pickle
 
 from codemd import mongo
+from codemd.data_managers.bulk_writer import BulkWriter
+from codemd.data_managers.checkpoint_codec import CheckpointCodec
+from codemd.data_managers.checkpoint_cache import CheckpointCache
+from codemd.mining.bug_classifier import BugClassifier
 
 import pdb
 
@@ -18,6 +25,33 @@ class DBHandler(object):
     """
 
     META_DATA_COL_NAME = 'meta-data'
+    STATUS_COL_NAME = 'project-status'
+
+    # Version of the layout of the stored project data, recorded in the project
+    # status by migrate_storage
+    STORAGE_VERSION = 1
+
+    # Kinds of ingest runs tracked in the project status
+    INITIAL_INGEST = 'initial'
+    UPDATE_INGEST = 'update'
+    RECLASSIFY_INGEST = 'reclassify'
+
+    # Number of documents per insert_many call when persisting commits
+    BULK_BATCH_SIZE = 1000
+
+    # Write concern for bulk inserts, None to use the client's default
+    BULK_WRITE_CONCERN = None
+
+    # Maximum number of bytes of encoded checkpoint data per document. Larger
+    # checkpoints are split into several chunk documents
+    CHECKPOINT_CHUNK_SIZE = 4 * 1024 * 1024
+
+    # Encoding of the checkpoints written by CheckpointCodec
+    CHECKPOINT_ENCODING = 'columnar'
+
+    # Load checkpoints through a local memory mapped cache (see CheckpointCache)
+    # when numpy is available
+    USE_CHECKPOINT_CACHE = True
 
     def __init__(self, project_name):
         """
@@ -27,47 +61,178 @@ class DBHandler(object):
         self.log = logging.getLogger('codemd.DBHandler')
         self.project_name = project_name
         self.collection = None # Collection /w github repo dump
+        self.mods_collection = None # Collection /w one row per file modification
         self.cp_collection = None # Collection /w precomputed circle packing data
+        self.ps_collection = None # Collection /w prefix sums of circle packing metrics
+        self.lc_collection = None # Collection /w the commits left to MinHash coupling
+        self.checkpoint_cache = None
+        if self.USE_CHECKPOINT_CACHE and CheckpointCache.available():
+            self.checkpoint_cache = CheckpointCache()
         self.__set_collections()
 
     def __set_collections(self):
         """
-        Sets internal collection attributes (self.collection and self.cp_collection)
-        to associated mongodb collections
+        Sets internal collection attributes (self.collection, self.mods_collection,
+        self.cp_collection, self.ps_collection and self.lc_collection) to associated mongodb
+        collections. Only binds them: their indexes are created, and data stored
+        by earlier versions migrated, by migrate_storage
         """
-        # Set self.collection
-        if DBHandler.project_exists(self.project_name):
-            self.log.debug("Found commits collection %s", self.project_name)
-            self.collection = mongo.db[self.project_name]
-        else:
-            self.log.info("Creating new commits collection for project %s",
-                           self.project_name)
-            self.collection = mongo.db[self.project_name]
-            self.collection.create_index([("date", pymongo.ASCENDING)])
-            self.collection.insert_one({'date_updated': datetime.datetime.now()})
-
-        # Set self.cp_collection
-        if DBHandler.project_exists(self.cp_collection_name()):
-            self.log.info("Found cp_data collection %s",self.cp_collection_name())
-            self.cp_collection = mongo.db[self.cp_collection_name()]
-        else:
-            self.log.info("DBHandler creating circle packing data collection under "
-                          + "name: %s", self.cp_collection_name())
-            self.cp_collection = mongo.db[self.cp_collection_name()]
-            self.cp_collection.create_index([("date", pymongo.ASCENDING)])
+        self.collection = mongo.db[self.project_name]
+        self.mods_collection = mongo.db[self.mods_collection_name()]
+        self.cp_collection = mongo.db[self.cp_collection_name()]
+        # Only holds the chunks of a few builds
+        self.ps_collection = mongo.db[self.ps_collection_name()]
+        self.lc_collection = mongo.db[self.lc_collection_name()]
+
+    def migrate_storage(self):
+        """
+        Creates the indexes of the project collections, and migrates the data of
+        projects stored by earlier versions to STORAGE_VERSION:
+            - commit messages are tokenized (see index_commit_messages)
+            - commits are unwound into the file modifications collection
+
+        Run by the ingest and reclassify jobs before their first stage, and by
+        the migration jobs of projects ingested before statuses were tracked
+        (see needs_migration), never while serving requests. Every migration
+        records its completion on the
+        date_updated marker, so an interrupted run resumes it, and the storage
+        version is recorded in the project status once all are done. Projects are
+        only ready (see project_ready) once their storage is migrated.
+        """
+        status = self.ingest_status(self.project_name) or {}
+        if status.get('storage_version', 0) >= self.STORAGE_VERSION:
+            return
+        self.log.info("Migrating storage of project %s to version %s",
+                      self.project_name, self.STORAGE_VERSION)
+
+        self.collection.create_index([("date", pymongo.ASCENDING)])
+        # Lets resumed ingests skip commits persisted before a crash
+        self.collection.create_index([("revision_id", pymongo.ASCENDING)],
+                                     unique=True, sparse=True)
+        self.collection.create_index([("ingest_head", pymongo.ASCENDING),
+                                      ("date", pymongo.ASCENDING)], sparse=True)
+        self.__create_token_indexes()
+        self.mods_collection.create_index([("date", pymongo.ASCENDING),
+                                           ("seq", pymongo.ASCENDING)])
+        self.mods_collection.create_index([("filename", pymongo.ASCENDING),
+                                           ("date", pymongo.ASCENDING)])
+        self.mods_collection.create_index([("seq", pymongo.ASCENDING)])
+        self.mods_collection.create_index([("revision_id", pymongo.ASCENDING)])
+        self.cp_collection.create_index([("date", pymongo.ASCENDING),
+                                         ("module_key", pymongo.ASCENDING),
+                                         ("n", pymongo.ASCENDING)])
+
+        marker = self.collection.find_one({'date_updated': {'$exists': True}})
+        has_commits = self.collection.find_one({'revision_id': {'$exists': True}},
+                                               {'_id': 1}) is not None
+        if marker is None:
+            # Commits stored by this version are tokenized at ingest
+            marker = {'date_updated': datetime.datetime.now(),
+                      'messages_indexed': not has_commits}
+            self.collection.insert_one(marker)
+
+        if not marker.get('messages_indexed', False):
+            # Projects mined before commit messages were tokenized at ingest
+            self.index_commit_messages()
+        if has_commits and 'mods_seq' not in marker:
+            # Projects mined before file modifications were stored separately
+            self.persist_file_modifications()
+            self.update_summary()
+
+        # Projects ingested before statuses were tracked are complete
+        mongo.db[self.STATUS_COL_NAME].update_one(
+            {'_id': self.project_name},
+            {'$set': {'storage_version': self.STORAGE_VERSION},
+             '$setOnInsert': {'ready': has_commits}}, upsert=True)
 
     @classmethod
     def project_exists(cls, project_name):
         """
-        Checks if a collection exists for the specified project_name
+        Checks if a collection exists for the specified project_name. Projects
+        with a status document exist, so listing the collections is only needed
+        for projects without one
 
         :param project_name: The name of the project
         :type project_name: str
 
         :returns: True or False
         """
+        if mongo.db[cls.STATUS_COL_NAME].find_one({'_id': project_name}, {'_id': 1}):
+            return True
         return project_name in mongo.db.collection_names()
 
+    @classmethod
+    def needs_migration(cls, project_name):
+        """
+        Checks if project_name was ingested before statuses were tracked, so its
+        storage must be migrated by a job (see jobs.migrate) before it is served
+
+        :returns: True or False
+        """
+        if mongo.db[cls.STATUS_COL_NAME].find_one({'_id': project_name}, {'_id': 1}):
+            return False
+        return mongo.db[project_name].find_one({'revision_id': {'$exists': True}},
+                                               {'_id': 1}) is not None
+
+    @classmethod
+    def unmigrated_projects(cls):
+        """
+        Returns the names of the projects which need a migration job, see
+        needs_migration
+        """
+        names = [project['short_name'] for project in
+                 mongo.db[cls.META_DATA_COL_NAME].find({}, {'short_name': 1})]
+        return [name for name in names if cls.needs_migration(name)]
+
+    @classmethod
+    def project_ready(cls, project_name):
+        """
+        Checks if every ingest stage has finished for the specified project_name,
+        and its storage was migrated (see migrate_storage), so its data is
+        complete and can be served
+
+        :returns: True or False
+        """
+        status = mongo.db[cls.STATUS_COL_NAME].find_one({'_id': project_name},
+                                                        {'ready': 1, 'storage_version': 1})
+        if status is None:
+            # Projects ingested before statuses were tracked must be migrated
+            # first, see needs_migration
+            return False
+        return (status.get('ready', False)
+                and status.get('storage_version', 0) >= cls.STORAGE_VERSION)
+
+    @classmethod
+    def project_summary(cls, project_name):
+        """
+        Returns the summary statistics of the project maintained at ingest, or None
+        if they were never computed. Ex:
+            {'first_date': 1262304000, 'last_date': 1514764800, 'commits': 1024,
+             'file_modifications': 4096, 'files': 512, 'authors': 32, 'seq': 4095}
+
+        'seq' is the last file modification the summary covers, see update_summary
+        """
+        status = mongo.db[cls.STATUS_COL_NAME].find_one({'_id': project_name},
+                                                        {'summary': 1})
+        if status is None:
+            return None
+        return status.get('summary')
+
+    @classmethod
+    def revision_date_range(cls, project_name):
+        """
+        Returns the dates of the first and last revisions in the project, read from
+        the project summary when available
+
+        :returns: A tuple (first date, last date), in unix epoch time
+        """
+        summary = DBHandler.project_summary(project_name)
+        if summary is not None:
+            return summary['first_date'], summary['last_date']
+        first_date = list(mongo.db[project_name].find(
+            {'revision_id': {'$exists': True}}).sort('date', 1).limit(1))[0]['date']
+        return first_date, DBHandler.last_revision(project_name)['date']
+
     @classmethod
     def projects_data(cls):
         """
@@ -75,6 +240,17 @@ class DBHandler(object):
         """
         return list(mongo.db['meta-data'].find())
 
+    @classmethod
+    def last_revision(cls, project_name):
+        """
+        Returns the revision_id and date of the last revision in the project
+
+        :returns: A dictionary with keys 'revision_id' and 'date'
+        """
+        return list(mongo.db[project_name].find(
+            {'revision_id': {'$exists': True}},
+            {'_id': 0, 'revision_id': 1, 'date': 1}).sort('date', -1).limit(1))[0]
+
     @classmethod
     def last_revision_date(cls, project_name):
         """
@@ -82,8 +258,7 @@ class DBHandler(object):
 
         :returns: Date of last revision, as an int in unix epoch time
         """
-        return list(mongo.db[project_name].find(
-            {'revision_id': {'$exists': True}}).sort('date', -1).limit(1))[0]['date']
+        return DBHandler.revision_date_range(project_name)[1]
 
     @classmethod
     def first_revision_date(cls, project_name):
@@ -92,74 +267,471 @@ class DBHandler(object):
 
         :returns: Date of first revision, as an int in unix epoch time
         """
-        return list(mongo.db[project_name].find(
-            {'revision_id': {'$exists': True}}).sort('date', 1).limit(1))[0]['date']
+        return DBHandler.revision_date_range(project_name)[0]
 
-    def persist_meta_data(self, full_name, description, image_url=""):
+    def persist_meta_data(self, full_name, description, git_url="", image_url=""):
         """
         TODO -- docstring
         """
-        mongo.db[self.META_DATA_COL_NAME].insert_one({'short_name': self.project_name,
-                                          'full_name': full_name,
-                                          'description': description,
-                                          'image_url': image_url})
+        mongo.db[self.META_DATA_COL_NAME].update_one({'short_name': self.project_name},
+                                         {'$set': {'full_name': full_name,
+                                                   'description': description,
+                                                   'git_url': git_url,
+                                                   'image_url': image_url}},
+                                         upsert=True)
+
+    @classmethod
+    def ingest_status(cls, project_name):
+        """
+        Returns the status document of the project, or None if it has none. Ex:
+            {'_id': <project name>, 'ready': False,
+             'pending': {'kind': 'initial', 'head_revision': ...,
+                         'stages_done': ['commits', ...]},
+             'summary': {...}}
+
+        'pending' describes the ingest run in progress (or interrupted), and is
+        removed once every stage of the run has finished. 'summary' holds the
+        statistics returned by project_summary.
+        """
+        return mongo.db[cls.STATUS_COL_NAME].find_one({'_id': project_name})
+
+    def start_ingest(self, kind, **values):
+        """
+        Records the start of an ingest run of the given kind (INITIAL_INGEST,
+        UPDATE_INGEST or RECLASSIFY_INGEST), with the values needed to resume it
+        (ie head_revision)
+
+        :returns: The pending run description
+        """
+        pending = dict(values, kind=kind, stages_done=[])
+        mongo.db[self.STATUS_COL_NAME].update_one(
+            {'_id': self.project_name},
+            {'$set': {'pending': pending, 'updated': datetime.datetime.now()},
+             '$setOnInsert': {'ready': False}}, upsert=True)
+        return pending
+
+    def update_pending_ingest(self, **values):
+        """
+        Sets values (ie since_date) on the pending ingest run
+        """
+        update = {'updated': datetime.datetime.now()}
+        for key, value in values.iteritems():
+            update['pending.' + key] = value
+        mongo.db[self.STATUS_COL_NAME].update_one({'_id': self.project_name},
+                                                  {'$set': update})
+
+    def mark_stage_done(self, stage):
+        """
+        Durably records that a stage of the pending ingest run has finished
+        """
+        self.log.info("Ingest stage <%s> done for project %s", stage, self.project_name)
+        mongo.db[self.STATUS_COL_NAME].update_one(
+            {'_id': self.project_name},
+            {'$addToSet': {'pending.stages_done': stage},
+             '$set': {'updated': datetime.datetime.now()}})
+
+    def mark_not_ready(self):
+        """
+        Stops serving the project until the pending run finishes (see
+        finish_ingest), ie before its checkpoints are removed and rebuilt
+        """
+        self.log.info("Marking project %s not ready", self.project_name)
+        mongo.db[self.STATUS_COL_NAME].update_one(
+            {'_id': self.project_name},
+            {'$set': {'ready': False, 'updated': datetime.datetime.now()}})
+
+    def finish_ingest(self):
+        """
+        Marks the project as ready once every stage of the pending run has finished
+        """
+        self.log.info("Ingest finished for project %s, marking it ready", self.project_name)
+        mongo.db[self.STATUS_COL_NAME].update_one(
+            {'_id': self.project_name},
+            {'$set': {'ready': True, 'updated': datetime.datetime.now()},
+             '$unset': {'pending': ''}}, upsert=True)
+
+    def update_summary(self):
+        """
+        Updates the summary statistics of the project (see project_summary) with
+        the file modifications written since it was last updated, ie by the
+        current ingest run, rather than recomputing them over the whole project.
+
+        The summary records the last seq it covers. The rows after it are read
+        through the seq index, and their files and authors are only counted if
+        no earlier row has them, which is checked through the filename and author
+        indexes. The delta is then applied with a single atomic update ($inc,
+        $min and $max) conditioned on the recorded seq, so it is never applied
+        twice. Summaries without a seq (ie computed by earlier versions) are
+        recomputed from every row.
+
+        :returns: The updated summary
+        """
+        status_collection = mongo.db[self.STATUS_COL_NAME]
+        summary = (status_collection.find_one({'_id': self.project_name},
+                                              {'summary': 1}) or {}).get('summary')
+        has_seq = summary is not None and 'seq' in summary
+        since_seq = summary['seq'] if has_seq else -1
+        marker = self.collection.find_one({'date_updated': {'$exists': True}}) or {}
+        last_seq = marker.get('mods_seq', -1)
+        if has_seq and since_seq >= last_seq:
+            return summary
+
+        mods = self.mods_collection
+        mods.create_index([("author", pymongo.ASCENDING)])
+        delta_query = {'seq': {'$gt': since_seq, '$lte': last_seq}}
+        totals = list(mods.aggregate([{'$match': delta_query},
+                                      {'$group': {'_id': None, 'count': {'$sum': 1},
+                                                  'first_date': {'$min': '$date'},
+                                                  'last_date': {'$max': '$date'}}}],
+                                     allowDiskUse=True))
+        totals = totals[0] if len(totals) > 0 else {'count': 0, 'first_date': None,
+                                                    'last_date': None}
+        delta = {'commits': len(self.__distinct_values(delta_query, 'revision_id')),
+                 'file_modifications': totals['count'],
+                 'files': self.__count_new_values(delta_query, since_seq, 'filename'),
+                 'authors': self.__count_new_values(delta_query, since_seq, 'author')}
+        self.log.info("Updating summary of project %s with rows %s to %s: %s",
+                      self.project_name, since_seq + 1, last_seq, delta)
+
+        if since_seq < 0:
+            delta.update(first_date=totals['first_date'], last_date=totals['last_date'],
+                         seq=last_seq)
+            query = {'_id': self.project_name,
+                     'summary.seq': since_seq if has_seq else {'$exists': False}}
+            update = {'$set': {'summary': delta, 'updated': datetime.datetime.now()}}
+        else:
+            query = {'_id': self.project_name, 'summary.seq': since_seq}
+            update = {'$inc': dict(('summary.' + key, value) for key, value in delta.iteritems()),
+                      '$set': {'summary.seq': last_seq, 'updated': datetime.datetime.now()}}
+            if totals['first_date'] is not None:
+                update['$min'] = {'summary.first_date': totals['first_date']}
+                update['$max'] = {'summary.last_date': totals['last_date']}
+        try:
+            result = status_collection.update_one(query, update, upsert=(since_seq < 0))
+            if result.matched_count == 0 and result.upserted_id is None:
+                self.log.info("Summary of project %s was already updated", self.project_name)
+        except DuplicateKeyError:
+            # The upsert lost against a concurrent update of the summary
+            self.log.info("Summary of project %s was already updated", self.project_name)
+        return DBHandler.project_summary(self.project_name)
+
+    def __distinct_values(self, query, field):
+        """
+        Returns the distinct values of field in the file modifications matching
+        query, without building the list in a single document like
+        collection.distinct() does
+        """
+        return [group['_id'] for group in self.mods_collection.aggregate(
+            [{"$match": query}, {"$group": {"_id": "$" + field}}], allowDiskUse=True)]
+
+    def __count_new_values(self, delta_query, since_seq, field):
+        """
+        Counts the distinct values of field in the file modifications matching
+        delta_query which no row up to since_seq has
+        """
+        values = self.__distinct_values(delta_query, field)
+        if since_seq < 0:
+            return len(values)
+        existing = 0
+        for i in xrange(0, len(values), self.BULK_BATCH_SIZE):
+            existing += len(self.mods_collection.distinct(
+                field, {field: {'$in': values[i:i + self.BULK_BATCH_SIZE]},
+                        'seq': {'$lte': since_seq}}))
+        return len(values) - existing
+
+    def stored_revision_dates(self):
+        """
+        Returns a dictionary mapping the revision_id of every stored commit to
+        its date
+        """
+        cursor = self.collection.find({'revision_id': {'$exists': True}},
+                                      {'_id': 0, 'revision_id': 1, 'date': 1})
+        return dict((doc['revision_id'], doc['date']) for doc in cursor)
+
+    def touch_date_updated(self, head_revision):
+        """
+        Sets the date_updated marker document of the project to the current time,
+        recording the branch head that the stored commits were mined up to
 
-    def persist_documents_from_gen(self, doc_gen):
+        :param head_revision: The revision id of the mined branch head
         """
-        Inserts the documents yielded by doc_gen into
+        self.collection.update_one({'date_updated': {'$exists': True}},
+                                   {'$set': {'date_updated': datetime.datetime.now(),
+                                             'head_revision': head_revision}},
+                                   upsert=True)
+
+    def head_revision(self):
+        """
+        Returns the revision id of the branch head the project was last mined up to,
+        or None if it was never recorded
+        """
+        marker = self.collection.find_one({'date_updated': {'$exists': True}})
+        if marker is None:
+            return None
+        return marker.get('head_revision')
+
+    def persist_documents_from_gen(self, doc_gen, batch_size=None, threaded=True,
+                                   progress_callback=None):
+        """
+        Inserts the documents yielded by doc_gen into the project collection, in
+        batches of unordered inserts (see BulkWriter)
+
+        :param batch_size: Number of documents per batch. Defaults to BULK_BATCH_SIZE
+        :param threaded: Whether to produce documents in a separate thread, so
+            producing and writing them overlap
+        :param progress_callback: Optional callable invoked with the total number
+            of documents written after each batch
+        :returns: The number of documents written
         """
         self.log.info("Starting insertion of documents into db for project %s...", \
                        self.project_name)
-        self.collection.insert_many(doc for doc in doc_gen)
+        if batch_size is None:
+            batch_size = self.BULK_BATCH_SIZE
+        writer = BulkWriter(self.collection, batch_size=batch_size,
+                            write_concern=self.BULK_WRITE_CONCERN, threaded=threaded,
+                            progress_callback=progress_callback)
+        written = writer.write(doc_gen)
         self.log.info("Finished inserting documents into db.")
+        return written
+
+    def persist_file_modifications(self, ingest_head=None, progress_callback=None):
+        """
+        Unwinds the commits stored by an ingest run into one row per modified
+        file in the file modifications collection, ie:
+            {'date', 'seq', 'revision_id', 'filename', 'insertions', 'deletions',
+             'author', 'bug'}
+
+        Commits are stamped at insertion with the head revision the run mined up
+        to ('ingest_head', see RepoAnalyser.persist_commits_data), so only the
+        commits of the run are read, through an index.
+
+        Rows are numbered by a project wide sequence number 'seq' in order of date,
+        which breaks ties between modifications on the same date. The last seq
+        written and ingest_head are recorded together on the date_updated marker
+        once all rows are written, so rows left behind by an interrupted run are
+        removed and written again, and a run already unwound is not unwound twice.
 
-    def fetch_commits(self):
-        """
-        Fetches all commits for the given collection, binning them by revision
-        id and appending file modification metricsl. This is for use in interactive
-        dashboard visualizations
-
-        :returns: A pymongo cursor to all commits for the given project
-        """
-        return self.collection.aggregate([
-                {"$match": {'revision_id': {'$exists': True}}},
-                {"$unwind": "$files_modified"},
-                {"$group": {
-                    "_id": "$revision_id",
-                    "date": {"$first": "$date"},
-                    "message": {"$first": "$message"},
-                    "author": {"$first": "$author"},
-                    "insertions": {"$sum": "$files_modified.insertions"},
-                    "deletions":  {"$sum": "$files_modified.deletions"}
-                }},
-                {"$sort": {"date": 1}},  # _id is the date at this point
-                {"$project": {"date": 1, "_id": 0, "insertions": 1,
-                               "deletions": 1, "author": 1, "message": 1}}
-            ])
+        :param ingest_head: The head revision of the ingest run whose commits are
+            unwound. If None, every stored commit is unwound, which is only valid
+            when no commit has rows yet (see migrate_storage)
+        :param progress_callback: Optional callable invoked with the total number
+            of rows written after each batch
+        :returns: The number of rows written
+        """
+        marker = self.collection.find_one({'date_updated': {'$exists': True}}) or {}
+        if ingest_head is not None and marker.get('mods_head') == ingest_head:
+            self.log.info("Commits of head %s are already unwound", ingest_head)
+            return 0
+        last_seq = marker.get('mods_seq', -1)
+        removed = self.mods_collection.delete_many({'seq': {'$gt': last_seq}}).deleted_count
+        if removed > 0:
+            self.log.info("Removed %s file modifications left by an interrupted run",
+                          removed)
+
+        if ingest_head is None:
+            query = {'revision_id': {'$exists': True}}
+        else:
+            self.collection.create_index([("ingest_head", pymongo.ASCENDING),
+                                          ("date", pymongo.ASCENDING)], sparse=True)
+            query = {'ingest_head': ingest_head}
+        commits = self.collection.find(query, {'_id': 0, 'revision_id': 1, 'date': 1,
+                                               'author': 1, 'bug': 1,
+                                               'files_modified': 1}).sort('date', 1)
+        seq = itertools.count(last_seq + 1)
+
+        def modifications():
+            for commit in commits:
+                for file_mod in commit['files_modified']:
+                    yield {'date': commit['date'], 'seq': next(seq),
+                           'revision_id': commit['revision_id'],
+                           'filename': file_mod['filename'],
+                           'insertions': file_mod['insertions'],
+                           'deletions': file_mod['deletions'],
+                           'author': commit['author'], 'bug': commit['bug']}
+
+        self.log.info("Unwinding commits of project %s into file modifications from "
+                      + "seq %s...", self.project_name, last_seq + 1)
+        writer = BulkWriter(self.mods_collection, batch_size=self.BULK_BATCH_SIZE,
+                            write_concern=self.BULK_WRITE_CONCERN,
+                            progress_callback=progress_callback)
+        written = writer.write(modifications())
+        self.collection.update_one({'date_updated': {'$exists': True}},
+                                   {'$set': {'mods_seq': last_seq + written,
+                                             'mods_head': ingest_head}},
+                                   upsert=True)
+        return written
+
+    def index_commit_messages(self):
+        """
+        Tokenizes the messages of the commits mined before messages were indexed
+        at ingest (see BugClassifier), and stores their 'bug' flag. The commit
+        message of their file modifications is replaced by the same flag.
+        Commits and rows are updated in batches of BULK_BATCH_SIZE, and the
+        migration is recorded on the date_updated marker once done, so an
+        interrupted run simply resumes it.
+        """
+        self.log.info("Indexing commit messages of project %s...", self.project_name)
+        self.__create_token_indexes()
+        self.mods_collection.create_index([("revision_id", pymongo.ASCENDING)])
+        classifier = self.bug_classifier()
+        bug_flags = {}
+        updates = []
+        for commit in self.collection.find({'revision_id': {'$exists': True}},
+                                           {'revision_id': 1, 'message': 1, 'bug': 1,
+                                            'tokens': 1}):
+            if 'tokens' not in commit:
+                first_token, tokens = classifier.tokenize(commit['message'])
+                commit['bug'] = classifier.is_bug_fix(first_token, tokens)
+                updates.append(pymongo.UpdateOne({'_id': commit['_id']},
+                                                 {'$set': {'first_token': first_token,
+                                                           'tokens': tokens,
+                                                           'bug': commit['bug']}}))
+            bug_flags[commit['revision_id']] = commit['bug']
+        self.__bulk_update(self.collection, updates)
+
+        rows = self.mods_collection.find({'message': {'$exists': True}}, {'revision_id': 1})
+        updates = (pymongo.UpdateOne({'_id': row['_id']},
+                                     {'$set': {'bug': bug_flags[row['revision_id']]},
+                                      '$unset': {'message': ''}})
+                   for row in rows)
+        self.__bulk_update(self.mods_collection, updates)
+
+        self.collection.update_one({'date_updated': {'$exists': True}},
+                                   {'$set': {'messages_indexed': True}}, upsert=True)
+        self.log.info("Finished indexing commit messages of project %s", self.project_name)
+
+    def bug_classifier(self):
+        """
+        Returns the BugClassifier of the project, or the default one if none was set
+        """
+        status = mongo.db[self.STATUS_COL_NAME].find_one({'_id': self.project_name},
+                                                         {'bug_classifier': 1})
+        if status is None:
+            return BugClassifier()
+        return BugClassifier.from_config(status.get('bug_classifier'))
+
+    def set_bug_classifier(self, classifier):
+        """
+        Sets the BugClassifier of the project. Stored bug flags are only updated
+        by reclassify_bug_fixes
+        """
+        mongo.db[self.STATUS_COL_NAME].update_one(
+            {'_id': self.project_name},
+            {'$set': {'bug_classifier': classifier.to_config(),
+                      'updated': datetime.datetime.now()}}, upsert=True)
+
+    def reclassify_bug_fixes(self, classifier):
+        """
+        Updates the 'bug' flag of the commits and file modifications whose
+        classification by classifier differs from the stored one. Bug fixes are
+        found with an indexed query on the message tokens, so no message is read.
+        File modifications are updated before their commits, so running it again
+        after an interruption finishes the update.
+
+        :returns: The earliest date (in unix epoch) of the commits whose flag
+            changed, or None if no flag changed
+        """
+        fields = {'_id': 0, 'revision_id': 1, 'date': 1}
+        bug_dates = dict((c['revision_id'], c['date'])
+                         for c in self.collection.find(classifier.query(), fields))
+        flagged_dates = dict((c['revision_id'], c['date'])
+                             for c in self.collection.find({'bug': True}, fields))
+        new_bugs = [r for r in bug_dates if r not in flagged_dates]
+        removed_bugs = [r for r in flagged_dates if r not in bug_dates]
+        self.log.info("Reclassifying bug fixes of project %s: %s new, %s removed",
+                      self.project_name, len(new_bugs), len(removed_bugs))
+
+        for flag, revisions in ((True, new_bugs), (False, removed_bugs)):
+            for i in xrange(0, len(revisions), self.BULK_BATCH_SIZE):
+                query = {'revision_id': {'$in': revisions[i:i + self.BULK_BATCH_SIZE]}}
+                self.mods_collection.update_many(query, {'$set': {'bug': flag}})
+                self.collection.update_many(query, {'$set': {'bug': flag}})
+
+        changed_dates = ([bug_dates[r] for r in new_bugs]
+                         + [flagged_dates[r] for r in removed_bugs])
+        if len(changed_dates) == 0:
+            return None
+        return min(changed_dates)
+
+    def __create_token_indexes(self):
+        self.collection.create_index([("first_token", pymongo.ASCENDING)], sparse=True)
+        # Multikey index, with an entry per distinct word of each message
+        self.collection.create_index([("tokens", pymongo.ASCENDING)], sparse=True)
+
+    def __bulk_update(self, collection, updates):
+        updates = iter(updates)
+        while True:
+            batch = list(itertools.islice(updates, self.BULK_BATCH_SIZE))
+            if len(batch) == 0:
+                return
+            collection.bulk_write(batch, ordered=False)
+
+    def fetch_commits(self, start_date=None):
+        """
+        Fetches all commits for the given collection sorted by date, summing the
+        insertions and deletions of their file modifications. This is for use in
+        interactive dashboard visualizations
+
+        :param start_date: If specified, only commits on or after this date
+        (in unix epoch) are fetched
+        :returns: A generator of commits with keys 'date', 'insertions',
+            'deletions', 'author' and 'bug'
+        """
+        match = {'revision_id': {'$exists': True}}
+        if start_date is not None:
+            match['date'] = {'$gte': start_date}
+        cursor = self.collection.find(match, {'_id': 0, 'date': 1, 'author': 1, 'bug': 1,
+                                              'files_modified.insertions': 1,
+                                              'files_modified.deletions': 1}).sort('date', 1)
+        for commit in cursor:
+            files_modified = commit.pop('files_modified')
+            commit['insertions'] = sum(f['insertions'] for f in files_modified)
+            commit['deletions'] = sum(f['deletions'] for f in files_modified)
+            yield commit
 
     def file_history(self, start_date=None, end_date=None):
         """
-        Fetches all file modifications in the given interval by unwinding commits
-        into individual file modifications.
+        Fetches all file modifications in the given interval, sorted by date. This
+        is a range scan on the (date, seq) index of the file modifications collection.
 
         :param start_date: The start date to begin fetching (in unix epoch)
         :param end_date: The end date to begin fetching (in unix epoch)
         """
-        if end_date is None:
-            end_date = DBHandler.last_revision_date(self.project_name)
-        if start_date is None:
-            start_date = DBHandler.first_revision_date(self.project_name)
         self.log.debug("Fetching file history from %s to %s", start_date, end_date)
-        return self.collection.aggregate([ \
-            { "$match" : {'revision_id': { '$exists': True },
-                          'date': { '$lte': end_date, "$gte": start_date }}},
-            { "$unwind": "$files_modified" },
-            { "$project":{"filename": "$files_modified.filename",
-                          "insertions": "$files_modified.insertions",
-                          "deletions": "$files_modified.deletions",
-                          "message": 1, "author": 1, "date": 1, "revision_id":1,
-                          "_id": 0 }},
-            { "$sort": {"date": 1} } ], allowDiskUse=True)
+        date_range = {}
+        if start_date is not None:
+            date_range['$gte'] = start_date
+        if end_date is not None:
+            date_range['$lte'] = end_date
+        query = {'date': date_range} if len(date_range) > 0 else {}
+        return self.mods_collection.find(query, {'_id': 0, 'seq': 0}).sort(
+            [('date', pymongo.ASCENDING), ('seq', pymongo.ASCENDING)])
+
+    def bug_fix_history(self, start_date=None, end_date=None):
+        """
+        Fetches the bug fixing file modifications in the given interval, sorted by
+        date, with keys 'date', 'filename' and 'bug'
+
+        :param start_date: The start date to begin fetching (in unix epoch)
+        :param end_date: The end date to begin fetching (in unix epoch)
+        """
+        query = {'bug': True}
+        if start_date is not None or end_date is not None:
+            query['date'] = {}
+        if start_date is not None:
+            query['date']['$gte'] = start_date
+        if end_date is not None:
+            query['date']['$lte'] = end_date
+        return self.mods_collection.find(query, {'_id': 0, 'date': 1, 'filename': 1,
+                                                 'bug': 1}).sort(
+            [('date', pymongo.ASCENDING), ('seq', pymongo.ASCENDING)])
+
+    def bug_flag_history(self):
+        """
+        Fetches the bug flag of every file modification, sorted like file_history()
+        """
+        return self.mods_collection.find({}, {'_id': 0, 'bug': 1}).sort(
+            [('date', pymongo.ASCENDING), ('seq', pymongo.ASCENDING)])
 
     def revision_count(self):
         """
@@ -173,71 +745,343 @@ class DBHandler(object):
         This will be equal to the number of entires in self.file_history
         If one commit changes 3 files, then this coutns as 3 modifications.
         """
-        return list(self.collection.aggregate([ \
-            { "$match" : {'revision_id': { '$exists': True }}},
-            {'$unwind':'$files_modified'},
-            {'$group':{'_id':'null', 'count':{'$sum':1}}}
-            ]))[0]['count']
+        summary = DBHandler.project_summary(self.project_name)
+        if summary is not None:
+            return summary['file_modifications']
+        return self.mods_collection.count()
+
+    def file_history_count_until(self, date):
+        """
+        Counts the file modifications on or before date, using the date index of
+        the file modifications collection. Returns 0 if date is None.
+        """
+        if date is None:
+            return 0
+        return self.mods_collection.count({'date': {'$lte': date}})
 
     def cp_collection_name(self):
         return self.project_name + "_" + "cp_data"
 
+    def mods_collection_name(self):
+        return self.project_name + "_" + "file_mods"
+
     def file_complexity_history(self, filename):
         """
-        Fetches all commits for a given file, sorted in ascending order by date
+        Fetches all modifications of a given file, sorted in ascending order by date
 
-        :returns: A pymongo cursor to all commits for the given project
+        :returns: A pymongo cursor to all modifications of the file
         """
-        file_string = "$" + filename
-        return self.collection.aggregate([ \
-            { "$match" : {'revision_id': { '$exists': True }}},
-            {  "$match" : {'filename' : file_string}},
-            { "$unwind": "$files_modified" },
-            { "$project":{"filename": "$files_modified.filename",
-                          "insertions": "$files_modified.insertions",
-                          "deletions": "$files_modified.deletions",
-                          "message": 1, "author": 1, "date": 1, "_id": 0 }},
-            { "$sort": {"date": 1} } ], allowDiskUse=True)
+        return self.mods_collection.find({'filename': filename}, {'_id': 0, 'seq': 0}).sort(
+            'date', pymongo.ASCENDING)
 
-    def persist_packing_data(self, date, module_key, data):
-        bson_data = Binary(pickle.dumps(data, protocol=2))
+    def persist_packing_data(self, date, module_key, data, index=None, level=None):
+        """
+        Saves the persist_mappings() data of a module for the checkpoint at date.
+        The data is encoded with CheckpointCodec and split GridFS style into
+        chunk documents of at most CHECKPOINT_CHUNK_SIZE bytes, so checkpoints
+        never exceed the maximum document size. Ex:
+            {'date': ..., 'module_key': ..., 'index': 8, 'level': 9, 'n': 0,
+             'num_chunks': 2, 'size': ..., 'encoding': 'columnar', 'data': <Binary>}
 
-        try:
-            self.cp_collection.insert_one({'date': date, 'module_key': module_key,
-                                           'data': bson_data})
-        except pymongo.errors.DocumentTooLarge as error:
-            self.log.error("!!!\n\nError persisting module_key <%s> at date %s!"
-                            + "Document was too large :(\n\n!!!",
-                            module_key, date)
-            self.log.error("Error message: %s", error.message)
+        :param date: The date of the checkpoint, in unix epoch time
+        :param module_key: The MODULE_KEY of the module
+        :param data: The persist_mappings() of the module
+        :param index: The index of the checkpoint in the checkpoint hierarchy
+        :param level: The level of the checkpoint in the checkpoint hierarchy
+        :returns: The number of bytes of the encoded data
+        """
+        self.log.debug("Saving data for module_key <%s> at date %s", module_key, date)
+        encoded = CheckpointCodec.encode(data)
+        self.__insert_chunks(self.cp_collection, {'date': date, 'module_key': module_key,
+                                                  'index': index, 'level': level}, encoded)
+        return len(encoded)
+
+    def replace_packing_data(self, date, module_key, data):
+        """
+        Replaces the persist_mappings() data of a module saved for the checkpoint
+        at date (see persist_packing_data), keeping its place in the checkpoint
+        hierarchy
+        """
+        self.log.debug("Replacing data for module_key <%s> at date %s", module_key, date)
+        checkpoint = self.cp_collection.find_one({'date': date}, {'index': 1, 'level': 1}) or {}
+        self.cp_collection.delete_many({'date': date, 'module_key': module_key})
+        self.persist_packing_data(date, module_key, data, index=checkpoint.get('index'),
+                                  level=checkpoint.get('level'))
+
+    def __insert_chunks(self, collection, fields, encoded):
+        """
+        Inserts encoded data split into chunk documents holding fields, in order
+        """
+        chunk_size = self.CHECKPOINT_CHUNK_SIZE
+        num_chunks = max(1, (len(encoded) + chunk_size - 1) / chunk_size)
+        self.log.debug("Saving %s bytes of encoded data in %s chunks", len(encoded), num_chunks)
+        chunks = [encoded[n * chunk_size:(n + 1) * chunk_size] for n in xrange(num_chunks)]
+        collection.insert_many([dict(fields, n=n, num_chunks=num_chunks, size=len(chunk),
+                                     encoding=self.CHECKPOINT_ENCODING, data=Binary(chunk))
+                                for n, chunk in enumerate(chunks)])
+
+    def ps_collection_name(self):
+        return self.project_name + "_" + "ps_data"
+
+    def persist_prefix_sums(self, data):
+        """
+        Saves the arrays of a PrefixSumEngine as a new build, encoded and chunked
+        like checkpoints, and removes the previous builds once it is saved
+
+        :param data: The data of the engine, a dictionary of arrays and values
+        """
+        build = str(ObjectId())
+        self.log.info("Saving prefix sums build %s for project %s", build, self.project_name)
+        self.__insert_chunks(self.ps_collection, {'build': build}, CheckpointCodec.encode(data))
+        self.ps_collection.delete_many({'build': {'$ne': build}})
+
+    def fetch_prefix_sums(self):
+        """
+        Fetches the data of the latest complete PrefixSumEngine build, through the
+        local checkpoint cache when enabled
+
+        :returns: The data of the engine, or None if none was saved
+        """
+        first_chunks = self.ps_collection.find({'n': 0}, {'data': 0}).sort(
+            '_id', pymongo.DESCENDING)
+        for first_chunk in first_chunks:
+            build = first_chunk['build']
+            if self.ps_collection.find({'build': build}).count() < first_chunk['num_chunks']:
+                # Build still being saved
+                continue
+            if self.checkpoint_cache is not None:
+                data = self.checkpoint_cache.load(self.project_name, 'prefix_sums',
+                                                  'prefix_sums', build)
+                if data is not None:
+                    return data
+            encoded = ''.join(str(chunk['data']) for chunk in self.ps_collection.find(
+                {'build': build}, {'_id': 0, 'data': 1}).sort('n', pymongo.ASCENDING))
+            if self.checkpoint_cache is None:
+                return CheckpointCodec.decode(encoded)
+            if self.checkpoint_cache.store(self.project_name, 'prefix_sums', 'prefix_sums',
+                                           build, encoded):
+                data = self.checkpoint_cache.load(self.project_name, 'prefix_sums',
+                                                  'prefix_sums', build)
+                if data is not None:
+                    return data
+            return CheckpointCodec.decode(encoded)
+        return None
+
+    def lc_collection_name(self):
+        return self.project_name + "_" + "large_commits"
+
+    def persist_large_commits(self, large_commits):
+        """
+        Saves the commits left to MinHash coupling (see
+        TemporalCouplingModule.USE_MINHASH), once each, so checkpoints don't
+        hold them. Saving a commit again replaces it, ie when checkpoints are
+        resumed. Ex:
+            {'revision_id': ..., 'date': ..., 'files': [<file name>, ...]}
+
+        :param large_commits: A dict of revision id : {'date', 'files'}
+        """
+        if len(large_commits) == 0:
+            return
+        self.lc_collection.create_index([("date", pymongo.ASCENDING)])
+        self.lc_collection.create_index([("revision_id", pymongo.ASCENDING)], unique=True)
+        self.__bulk_update(self.lc_collection, (
+            pymongo.ReplaceOne({'revision_id': revision_id},
+                               {'revision_id': revision_id, 'date': commit['date'],
+                                'files': commit['files']}, upsert=True)
+            for revision_id, commit in large_commits.iteritems()))
+
+    def large_commits(self, start_date, end_date):
+        """
+        Fetches the commits left to MinHash coupling between start_date and
+        end_date (in unix epoch), see persist_large_commits
+
+        :returns: A dict of revision id : {'date', 'files'}
+        """
+        return dict((commit['revision_id'], {'date': commit['date'], 'files': commit['files']})
+                    for commit in self.lc_collection.find(
+                        {'date': {'$gte': start_date, '$lte': end_date}}, {'_id': 0}))
+
+    def last_checkpoint_date(self):
+        """
+        Returns the date of the most recent checkpoint, or None if the project
+        has no checkpoints yet
+        """
+        checkpoints = list(self.cp_collection.find({}, {'date': 1}).sort(
+            'date', pymongo.DESCENDING).limit(1))
+        if len(checkpoints) == 0:
+            return None
+        return checkpoints[0]['date']
+
+    def checkpoint_dates(self, start_date=None):
+        """
+        Returns the dates of the checkpoints on or after start_date (in unix
+        epoch), in ascending order
+        """
+        query = {'n': 0}
+        if start_date is not None:
+            query['date'] = {'$gte': start_date}
+        return sorted(self.cp_collection.distinct('date', query))
+
+    def checkpoint_index(self, date):
+        """
+        Returns the index in the checkpoint hierarchy of the checkpoint at date.
+        Checkpoints saved before the hierarchy have index 0
+        """
+        checkpoint = self.cp_collection.find_one({'date': date}, {'index': 1})
+        if checkpoint is None or checkpoint.get('index') is None:
+            return 0
+        return checkpoint['index']
+
+    def checkpoint_sizes_by_level(self):
+        """
+        Returns a dictionary mapping each level of the checkpoint hierarchy to the
+        number of bytes of checkpoint data saved on it. Checkpoints saved before
+        the hierarchy are on level 0
+        """
+        levels = self.cp_collection.aggregate([
+            {"$group": {"_id": {"$ifNull": ["$level", 0]},
+                        "size": {"$sum": {"$ifNull": ["$size", 0]}}}}])
+        return dict((level['_id'], level['size']) for level in levels)
+
+    def remove_checkpoint_levels(self, level):
+        """
+        Removes all checkpoints on level or finer levels of the checkpoint hierarchy
+        """
+        deleted_count = self.__remove_checkpoint_documents({'level': {'$gte': level}})
+        self.log.info("Removed %s checkpoint documents on level %s or finer",
+                      deleted_count, level)
+
+    def checkpoint_level(self, default):
+        """
+        Returns the finest level of the checkpoint hierarchy kept for the project,
+        or default if no level was dropped
+        """
+        status = mongo.db[self.STATUS_COL_NAME].find_one({'_id': self.project_name},
+                                                         {'checkpoint_level': 1})
+        if status is None or status.get('checkpoint_level') is None:
+            return default
+        return status['checkpoint_level']
+
+    def set_checkpoint_level(self, level):
+        """
+        Sets the finest level of the checkpoint hierarchy kept for the project
+        """
+        mongo.db[self.STATUS_COL_NAME].update_one(
+            {'_id': self.project_name},
+            {'$set': {'checkpoint_level': level, 'updated': datetime.datetime.now()}},
+            upsert=True)
+
+    def remove_checkpoints(self, start_date):
+        """
+        Removes all checkpoints on or after start_date (in unix epoch)
+        """
+        deleted_count = self.__remove_checkpoint_documents({'date': {'$gte': start_date}})
+        self.log.info("Removed %s checkpoint documents on or after date %s",
+                      deleted_count, start_date)
+
+    def __remove_checkpoint_documents(self, query):
+        """
+        Removes the checkpoint documents matching query, and the cached files of
+        their checkpoints
+
+        :returns: The number of documents removed
+        """
+        dates = self.cp_collection.distinct('date', dict(query, n=0))
+        deleted_count = self.cp_collection.delete_many(query).deleted_count
+        if self.checkpoint_cache is not None:
+            self.checkpoint_cache.remove(self.project_name, dates)
+        return deleted_count
+
+    def remove_incomplete_checkpoints(self, num_modules):
+        """
+        Removes the most recent checkpoint if it holds data for fewer than
+        num_modules modules, ie when checkpoint building was interrupted while
+        saving it
+        """
+        last_date = self.last_checkpoint_date()
+        if last_date is None:
+            return
+        # A module is saved once all its chunks are
+        saved_modules = len([module for module in self.cp_collection.aggregate([
+            {"$match": {'date': last_date}},
+            {"$group": {"_id": "$module_key", "chunks": {"$sum": 1},
+                        "num_chunks": {"$max": {"$ifNull": ["$num_chunks", 1]}}}}])
+            if module['chunks'] >= module['num_chunks']])
+        if saved_modules < num_modules:
+            self.log.info("Checkpoint at date %s is incomplete (%s of %s modules), "
+                          + "removing it", last_date, saved_modules, num_modules)
+            self.cp_collection.delete_many({'date': last_date})
 
     def find_closest_checkpoint(self, date, before=True):
         """
         Fetches the closest checkpoint date that is before or equal to date
-        if before == True or after date if before == False
+        if before == True or after date if before == False. Returns None if
+        there is no such checkpoint.
         """
         if before:
             sort, comparison = pymongo.DESCENDING, "$lte"
         else:
             sort, comparison = pymongo.ASCENDING, "$gte"
-        return list(self.cp_collection.find( \
-            {'date': {comparison: date}}).sort('date', sort).limit(1))[0]['date']
+        checkpoints = list(self.cp_collection.find({'date': {comparison: date}},
+                                                   {'date': True}).sort('date', sort).limit(1))
+        return checkpoints[0]['date'] if len(checkpoints) > 0 else None
 
     def fetch_checkpoint_data(self, date):
         """
-        Fetches all checkpoint data at checkpoint <date>, unserializing data as
-        necessary.
+        Fetches all checkpoint data at checkpoint <date>, joining chunks and
+        decoding data as necessary. Modules are loaded from the local checkpoint
+        cache when enabled, which is populated from mongo on first use.
 
         :param date: The date of the checkpoint. Should be in unix epoch time
         :type date: int
-        :returns: A pymongo cursor the data for the closest checkpoint
-        :rtype: pymongo.cursor
-        """
-        # Fetch all checkpoints at date
-        checkpoints = self.cp_collection.find({'date': date}, {'_id': 0})
-        # Return a generator that unseralizes the data
-        for checkpoint in checkpoints:
-            self.log.debug("Unserializing data for module %s", checkpoint['module_key'])
-            checkpoint['data'] = pickle.loads(checkpoint['data'])
-            self.log.debug("Finished unserializing data for module %s", checkpoint['module_key'])
-            yield checkpoint
+        :returns: A generator of dictionaries with keys 'date', 'module_key' and
+            'data' for each module of the checkpoint
+        """
+        if self.checkpoint_cache is None:
+            return self.__fetch_checkpoint_data(date)
+        # The first chunk of each module identifies the saved version of its data
+        first_chunks = list(self.cp_collection.find({'date': date, 'n': 0},
+                                                    {'module_key': 1, 'encoding': 1}))
+        if (len(first_chunks) == 0 or
+            any(c.get('encoding') != self.CHECKPOINT_ENCODING for c in first_chunks)):
+            # Checkpoints saved before they were encoded are not cached
+            return self.__fetch_checkpoint_data(date)
+        return self.__fetch_cached_checkpoint_data(date, first_chunks)
+
+    def __fetch_cached_checkpoint_data(self, date, first_chunks):
+        for first_chunk in sorted(first_chunks, key=lambda c: c['module_key']):
+            module_key, token = first_chunk['module_key'], str(first_chunk['_id'])
+            data = self.checkpoint_cache.load(self.project_name, date, module_key, token)
+            if data is None:
+                self.log.debug("Caching data for module %s at checkpoint %s", module_key, date)
+                chunks = self.cp_collection.find({'date': date, 'module_key': module_key},
+                                                 {'_id': 0, 'data': 1}).sort('n', pymongo.ASCENDING)
+                encoded = ''.join(str(chunk['data']) for chunk in chunks)
+                if self.checkpoint_cache.store(self.project_name, date, module_key, token,
+                                               encoded):
+                    data = self.checkpoint_cache.load(self.project_name, date, module_key,
+                                                      token)
+                if data is None:
+                    # Not cacheable, or evicted by another worker meanwhile
+                    data = CheckpointCodec.decode(encoded)
+            yield {'date': date, 'module_key': module_key, 'data': data}
+
+    def __fetch_checkpoint_data(self, date):
+        """
+        Fetches and decodes all checkpoint data at checkpoint <date> from mongo
+        """
+        # Fetch all checkpoint chunks at date, grouped by module
+        chunks = self.cp_collection.find({'date': date}, {'_id': 0}).sort(
+            [('module_key', pymongo.ASCENDING), ('n', pymongo.ASCENDING)])
+        # Return a generator that joins and decodes the data
+        for module_key, module_chunks in itertools.groupby(chunks, lambda c: c['module_key']):
+            module_chunks = list(module_chunks)
+            self.log.debug("Decoding data for module %s", module_key)
+            data = ''.join(str(chunk['data']) for chunk in module_chunks)
+            if module_chunks[0].get('encoding') == self.CHECKPOINT_ENCODING:
+                data = CheckpointCodec.decode(data)
+            else:
+                # Checkpoints saved before they were encoded are pickled
+                data = pickle.loads(data)
+            self.log.debug("Finished decoding data for module %s", module_key)
+            yield {'date': date, 'module_key': module_key, 'data': data}
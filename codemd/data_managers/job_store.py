@@ -0,0 +1,139 @@
+import logging
+import datetime
+import pymongo
+
+from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from codemd import mongo
+
+class JobStore(object):
+    """
+    This class is responsible for persisting background ingest jobs in mongodb.
+
+    Each job is a document holding its parameters, state, current stage and
+    progress. While a job is queued or running it holds an 'active_key' equal to
+    its project name, which is uniquely indexed so that concurrent submissions
+    for the same project are deduplicated into a single job.
+    """
+
+    JOBS_COL_NAME = 'jobs'
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self):
+        self.log = logging.getLogger('codemd.JobStore')
+        self.collection = mongo.db[self.JOBS_COL_NAME]
+        self.collection.create_index([("active_key", pymongo.ASCENDING)],
+                                     unique=True, sparse=True)
+        self.collection.create_index([("state", pymongo.ASCENDING),
+                                      ("created", pymongo.ASCENDING)])
+
+    def submit(self, project_name, params):
+        """
+        Queues a new job for project_name, unless the project already has a queued
+        or running job.
+
+        :param params: A dictionary with the job parameters
+        :returns: A tuple (job, created) where created is False if an already
+            active job was returned instead
+        """
+        job = {'project_name': project_name, 'active_key': project_name,
+               'params': params, 'state': self.QUEUED, 'stage': None,
+               'progress': {}, 'error': None, 'created': datetime.datetime.now(),
+               'started': None, 'finished': None}
+        try:
+            self.collection.insert_one(job)
+            self.log.info("Queued job %s for project %s", job['_id'], project_name)
+            return job, True
+        except DuplicateKeyError:
+            active_job = self.find_active(project_name)
+            self.log.info("Project %s already has active job %s", project_name,
+                          active_job['_id'] if active_job is not None else None)
+            return active_job, False
+
+    def claim_next(self, worker_id):
+        """
+        Atomically marks the oldest queued job as running and returns it, or
+        returns None if no job is queued
+
+        :param worker_id: Identifies the process running the job
+        """
+        return self.collection.find_one_and_update(
+            {'state': self.QUEUED},
+            {'$set': {'state': self.RUNNING, 'worker_id': worker_id, 'worker_pid': None,
+                      'started': datetime.datetime.now()}},
+            sort=[('created', pymongo.ASCENDING)],
+            return_document=pymongo.ReturnDocument.AFTER)
+
+    def set_worker_pid(self, job_id, pid):
+        """
+        Records the pid of the worker process running a job, which may outlive
+        the web process that started it
+        """
+        self.collection.update_one({'_id': ObjectId(job_id), 'state': self.RUNNING},
+                                   {'$set': {'worker_pid': pid}})
+
+    def running_jobs(self):
+        """
+        Returns a list of all running jobs
+        """
+        return list(self.collection.find({'state': self.RUNNING}))
+
+    def requeue(self, job_id):
+        """
+        Puts a running job back in the queue, ie after the process running it died.
+        Ingests resume from their progress markers, so the job continues where it
+        stopped.
+        """
+        self.log.info("Requeueing job %s", job_id)
+        self.collection.update_one({'_id': ObjectId(job_id), 'state': self.RUNNING},
+                                   {'$set': {'state': self.QUEUED, 'worker_id': None,
+                                             'worker_pid': None}})
+
+    def update_progress(self, job_id, stage, **progress):
+        """
+        Sets the current stage of a job and its progress values (ie commits=1024)
+        """
+        update = {'stage': stage}
+        for key, value in progress.iteritems():
+            update['progress.' + key] = value
+        self.collection.update_one({'_id': ObjectId(job_id)}, {'$set': update})
+
+    def finish(self, job_id):
+        self.__close(job_id, self.DONE)
+
+    def fail(self, job_id, error):
+        self.__close(job_id, self.FAILED, error)
+
+    def find(self, job_id):
+        """
+        Returns the job with id job_id, or None if it doesn't exist
+        """
+        if not ObjectId.is_valid(job_id):
+            return None
+        return self.collection.find_one({'_id': ObjectId(job_id)})
+
+    def find_active(self, project_name):
+        """
+        Returns the queued or running job for project_name, if any
+        """
+        return self.collection.find_one({'active_key': project_name})
+
+    def find_latest(self, project_name):
+        """
+        Returns the most recently created job for project_name, if any
+        """
+        jobs = list(self.collection.find({'project_name': project_name}).sort(
+            'created', pymongo.DESCENDING).limit(1))
+        return jobs[0] if len(jobs) > 0 else None
+
+    def __close(self, job_id, state, error=None):
+        self.log.info("Job %s finished with state %s", job_id, state)
+        self.collection.update_one({'_id': ObjectId(job_id)},
+                                   {'$set': {'state': state, 'error': error,
+                                             'finished': datetime.datetime.now()},
+                                    '$unset': {'active_key': ''}})
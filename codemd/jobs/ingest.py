@@ -0,0 +1,135 @@
+import logging
+
+from codemd.mining.repo_analyser import RepoAnalyser
+from codemd.metrics.metrics_builder import MetricsBuilder
+from codemd.data_managers.db_handler import DBHandler
+from codemd.jobs.reclassify import reclassify_bugs
+
+log = logging.getLogger('codemd.ingest')
+
+def ingest_project(git_url, full_name, description, progress=None):
+    """
+    Mines the repository at git_url and precomputes its dashboard and circle
+    packing data. Projects which were already mined are updated incrementally
+    with the commits added since the last ingest.
+
+    Every stage durably records its completion in the project status, so an
+    interrupted ingest resumes from where it stopped when it is run again. The
+    project is only marked ready once every stage has finished. An updated
+    project keeps being served until its checkpoints are invalidated, and is not
+    ready from then until they are rebuilt. Data stored by
+    earlier versions is migrated first (see DBHandler.migrate_storage).
+
+    :param progress: Optional callable invoked as progress(stage, **values) when
+        the ingest moves to a new stage or makes progress within one
+    """
+    if progress is None:
+        progress = lambda stage, **values: None
+    project_name = RepoAnalyser.short_name(git_url)
+
+    def commits_progress(written):
+        progress('mining', commits=written)
+
+    def file_modifications_progress(written):
+        progress('file_modifications', file_modifications=written)
+
+    log.debug("url: %s\ninternal name: %s\nfull name: %s\ndesc: %s",
+              git_url, project_name, full_name, description)
+
+    progress('cloning')
+    repo = RepoAnalyser(git_url, full_name=full_name, description=description)
+
+    status = DBHandler.ingest_status(project_name)
+    pending = status.get('pending') if status is not None else None
+    if pending is not None and pending['kind'] == DBHandler.RECLASSIFY_INGEST:
+        log.info("Finishing interrupted reclassification of project %s first", project_name)
+        reclassify_bugs(project_name, pending['bug_classifier'], progress=progress)
+        pending = None
+    is_new = not DBHandler.project_exists(project_name)
+    db_handler = DBHandler(project_name)
+    progress('migrating')
+    db_handler.migrate_storage()
+
+    resumed = pending is not None
+    if resumed:
+        log.info("Resuming interrupted %s ingest of project %s (stages done: %s)",
+                 pending['kind'], project_name, pending['stages_done'])
+    elif is_new:
+        log.info("Data for project " + project_name + " not found. Fetching data...")
+        pending = db_handler.start_ingest(DBHandler.INITIAL_INGEST,
+                                          head_revision=repo.head_revision())
+    else:
+        since_revision = repo.last_mined_revision()
+        head_revision = repo.head_revision()
+        if since_revision == head_revision:
+            log.info("Data for git project %s is already up to date.", project_name)
+            return
+        log.info("Data for git project " + project_name + " found. Updating data...")
+        pending = db_handler.start_ingest(DBHandler.UPDATE_INGEST,
+                                          since_revision=since_revision,
+                                          head_revision=head_revision)
+
+    is_update = (pending['kind'] == DBHandler.UPDATE_INGEST)
+    stages_done = set(pending['stages_done'])
+
+    if 'commits' not in stages_done:
+        progress('mining', commits=0)
+        since_date = repo.persist_commits_data(since_revision=pending.get('since_revision'),
+                                               head_revision=pending['head_revision'],
+                                               resume=resumed,
+                                               progress_callback=commits_progress)
+        pending['since_date'] = since_date
+        db_handler.update_pending_ingest(since_date=since_date)
+        db_handler.mark_stage_done('commits')
+
+    if 'file_modifications' not in stages_done:
+        progress('file_modifications', file_modifications=0)
+        db_handler.persist_file_modifications(ingest_head=pending['head_revision'],
+                                              progress_callback=file_modifications_progress)
+        db_handler.update_summary()
+        db_handler.mark_stage_done('file_modifications')
+
+    since_date = pending.get('since_date')
+    if is_update and since_date is None:
+        log.info("No new commits with relevant files for project %s.", project_name)
+        db_handler.finish_ingest()
+        return
+
+    # Save viz/circle packing data for fast loading times
+    metrics = MetricsBuilder(project_name)
+    if 'dashboard' not in stages_done:
+        progress('dashboard')
+        if is_update:
+            log.debug("Updating dashboard data from date %s...", since_date)
+            metrics.update_commits(since_date)
+        else:
+            log.debug("Saving dashboard data...")
+            metrics.save_commits()
+        db_handler.mark_stage_done('dashboard')
+
+    if is_update and 'invalidate_checkpoints' not in stages_done:
+        log.debug("Invalidating checkpoints from date %s...", since_date)
+        db_handler.mark_not_ready()
+        db_handler.remove_checkpoints(since_date)
+        db_handler.mark_stage_done('invalidate_checkpoints')
+
+    if 'prefix_sums' not in stages_done:
+        log.debug("Saving prefix sums...")
+        progress('prefix_sums')
+        metrics.save_prefix_sums()
+        db_handler.mark_stage_done('prefix_sums')
+
+    if 'checkpoints' not in stages_done:
+        log.debug("Saving checkpoint data...")
+        progress('checkpoints')
+        metrics.resume_circle_packing_data()
+        db_handler.mark_stage_done('checkpoints')
+
+    if 'meta_data' not in stages_done:
+        log.debug("Persisting meta data.")
+        progress('meta_data')
+        repo.persist_meta_data()
+        db_handler.mark_stage_done('meta_data')
+
+    db_handler.finish_ingest()
+    log.debug("Done mining and precomputing project data.")
@@ -0,0 +1,238 @@
+import logging
+import multiprocessing
+import threading
+import socket
+import errno
+import os
+
+from codemd import app, mongo
+from codemd.mining.repo_analyser import RepoAnalyser
+from codemd.data_managers.job_store import JobStore
+from codemd.data_managers.db_handler import DBHandler
+from codemd.jobs.ingest import ingest_project
+from codemd.jobs.reclassify import reclassify_bugs
+from codemd.jobs.migrate import migrate_project
+
+class JobManager(object):
+    """
+    Runs ingest jobs in the background, entirely locally: jobs are queued in the
+    JobStore, and a dispatcher thread runs each one in a separate worker process,
+    with at most MAX_WORKERS jobs running at a time in this web process.
+
+    Use JobManager.instance() to get the manager of the current process, which
+    starts its dispatcher on first use. On startup the dispatcher requeues jobs
+    left running on this host whose worker process is dead, and their ingests
+    resume from their progress markers. It also queues a migration job for
+    every project ingested by an earlier version (see jobs.migrate), which isn't
+    served until it is migrated. Workers are not daemonic, so they keep
+    running when the web process that started them dies: a job is only
+    requeued once its own worker is gone, never while it is still ingesting.
+    """
+
+    # Maximum number of jobs running concurrently in worker processes
+    MAX_WORKERS = 2
+
+    # Seconds between checks for queued jobs and finished workers
+    POLL_INTERVAL = 2
+
+    # Kinds of jobs, stored in their params. Jobs without a kind are ingests
+    INGEST_JOB = 'ingest'
+    RECLASSIFY_JOB = 'reclassify'
+    MIGRATE_JOB = 'migrate'
+
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self):
+        self.log = logging.getLogger('codemd.JobManager')
+        self.store = JobStore()
+        self.worker_id = "%s:%s" % (socket.gethostname(), os.getpid())
+        self.workers = {} # job id : worker process
+        self.wakeup = threading.Event()
+        self.dispatcher = threading.Thread(target=self.__dispatch_loop,
+                                           name='codemd-job-dispatcher')
+        self.dispatcher.daemon = True
+        self.dispatcher.start()
+
+    @classmethod
+    def instance(cls):
+        """
+        Returns the JobManager of the current process, creating it if necessary
+        """
+        with cls.__instance_lock:
+            if cls.__instance is None:
+                cls.__instance = JobManager()
+            return cls.__instance
+
+    def submit_ingest(self, git_url, full_name, description):
+        """
+        Queues an ingest job for git_url. If the project already has a queued or
+        running job, that job is returned instead of queueing a new one.
+
+        :returns: A tuple (job, created)
+        """
+        project_name = RepoAnalyser.short_name(git_url)
+        job, created = self.store.submit(project_name, {'git_url': git_url,
+                                                        'full_name': full_name,
+                                                        'description': description})
+        self.wakeup.set()
+        return job, created
+
+    def submit_reclassify(self, project_name, classifier_config):
+        """
+        Queues a job setting the bug classifier of project_name and recomputing
+        its bug data (see reclassify_bugs). If the project already has a queued or
+        running job, that job is returned instead of queueing a new one.
+
+        :returns: A tuple (job, created)
+        """
+        job, created = self.store.submit(project_name,
+                                         {'kind': self.RECLASSIFY_JOB,
+                                          'bug_classifier': classifier_config})
+        self.wakeup.set()
+        return job, created
+
+    def submit_migration(self, project_name):
+        """
+        Queues a job migrating the storage of project_name (see migrate_project).
+        If the project already has a queued or running job, that job is returned
+        instead of queueing a new one.
+
+        :returns: A tuple (job, created)
+        """
+        job, created = self.store.submit(project_name, {'kind': self.MIGRATE_JOB})
+        self.wakeup.set()
+        return job, created
+
+    def __dispatch_loop(self):
+        with app.app_context():
+            self.__requeue_orphaned_jobs()
+            try:
+                self.__queue_migrations()
+            except Exception as error:
+                self.log.error("!!! Error queueing storage migrations: %s", error)
+            while True:
+                try:
+                    self.__reap_workers()
+                    self.__start_workers()
+                except Exception as error:
+                    self.log.error("!!! Error dispatching jobs: %s", error)
+                self.wakeup.wait(self.POLL_INTERVAL)
+                self.wakeup.clear()
+
+    def __requeue_orphaned_jobs(self):
+        """
+        Requeues the running jobs of this host whose worker process is dead, so
+        the interrupted ingests resume. Jobs whose worker never recorded its pid
+        are requeued if the web process which claimed them is dead.
+        """
+        host = socket.gethostname()
+        for job in self.store.running_jobs():
+            worker_host, _, web_pid = (job.get('worker_id') or '').rpartition(':')
+            if worker_host != host:
+                continue
+            pid = job.get('worker_pid')
+            if pid is None and web_pid.isdigit():
+                pid = int(web_pid)
+            if pid is None:
+                continue
+            if not is_process_alive(pid):
+                self.log.info("Job %s was orphaned by dead process %s", job['_id'], pid)
+                self.store.requeue(job['_id'])
+
+    def __queue_migrations(self):
+        """
+        Queues a migration job for every project which needs one, see
+        DBHandler.needs_migration
+        """
+        for project_name in DBHandler.unmigrated_projects():
+            job, created = self.store.submit(project_name, {'kind': self.MIGRATE_JOB})
+            if created:
+                self.log.info("Queued storage migration of project %s", project_name)
+
+    def __start_workers(self):
+        while len(self.workers) < self.MAX_WORKERS:
+            job = self.store.claim_next(self.worker_id)
+            if job is None:
+                return
+            job_id = str(job['_id'])
+            self.log.info("Starting worker process for job %s (project %s)",
+                          job_id, job['project_name'])
+            # Workers must not be daemonic since mining spawns its own processes
+            worker = multiprocessing.Process(target=run_job, args=(job_id,),
+                                             name='codemd-job-' + job_id)
+            worker.daemon = False
+            worker.start()
+            self.store.set_worker_pid(job_id, worker.pid)
+            self.workers[job_id] = worker
+
+    def __reap_workers(self):
+        for job_id, worker in self.workers.items():
+            if worker.is_alive():
+                continue
+            worker.join()
+            del self.workers[job_id]
+            job = self.store.find(job_id)
+            if job is not None and job['state'] == JobStore.RUNNING:
+                self.log.error("!!! Worker for job %s died with exit code %s",
+                               job_id, worker.exitcode)
+                self.store.fail(job_id, "Worker process exited with code %s"
+                                % worker.exitcode)
+
+
+def is_process_alive(pid):
+    """
+    Checks if a process with the given pid exists on this host
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError as error:
+        return error.errno == errno.EPERM
+    return True
+
+
+def open_mongo_client():
+    """
+    Replaces the MongoClient this worker process inherited from the web process
+    by a new one. Workers are forked while the web process holds a live client,
+    and MongoClient is not fork safe: its pooled sockets and monitor threads
+    belong to the parent, so sharing them could interleave both processes'
+    messages on the same connections. The inherited client is left untouched
+    (not closed), since its sockets are still used by the parent.
+    """
+    app.extensions['pymongo'].pop(mongo.config_prefix, None)
+    mongo.init_app(app, mongo.config_prefix)
+
+
+def run_job(job_id):
+    """
+    Worker process entry point, runs the ingest (or reclassify, or migration)
+    job with id job_id and records its progress and outcome in the JobStore
+    """
+    log = logging.getLogger('codemd.JobManager')
+    with app.app_context():
+        open_mongo_client()
+        store = JobStore()
+        # Recorded by the worker itself too, in case the web process died
+        # before recording it
+        store.set_worker_pid(job_id, os.getpid())
+        job = store.find(job_id)
+        params = job['params']
+
+        def progress(stage, **values):
+            store.update_progress(job_id, stage, **values)
+
+        try:
+            kind = params.get('kind', JobManager.INGEST_JOB)
+            if kind == JobManager.RECLASSIFY_JOB:
+                reclassify_bugs(job['project_name'], params['bug_classifier'],
+                                progress=progress)
+            elif kind == JobManager.MIGRATE_JOB:
+                migrate_project(job['project_name'], progress=progress)
+            else:
+                ingest_project(params['git_url'], params['full_name'], params['description'],
+                               progress=progress)
+            store.finish(job_id)
+        except Exception as error:
+            log.exception("!!! Job %s failed", job_id)
+            store.fail(job_id, str(error))
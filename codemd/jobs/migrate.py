@@ -0,0 +1,25 @@
+import logging
+
+from codemd.data_managers.db_handler import DBHandler
+
+log = logging.getLogger('codemd.migrate')
+
+def migrate_project(project_name, progress=None):
+    """
+    Migrates the storage of a project ingested by an earlier version (see
+    DBHandler.migrate_storage), so it is served again without re-mining it.
+
+    Queued by the JobManager for every such project when it starts, and by the
+    views when one of them is requested. Migrations record their progress like
+    ingests, so an interrupted run resumes when it is run again.
+
+    :param progress: Optional callable invoked as progress(stage) when the run
+        moves to a new stage
+    """
+    if progress is None:
+        progress = lambda stage, **values: None
+
+    log.info("Migrating storage of project %s", project_name)
+    progress('migrating')
+    DBHandler(project_name).migrate_storage()
+    log.debug("Done migrating storage of project %s.", project_name)
@@ -0,0 +1,90 @@
+import logging
+
+from codemd.mining.bug_classifier import BugClassifier
+from codemd.metrics.metrics_builder import MetricsBuilder
+from codemd.data_managers.db_handler import DBHandler
+
+log = logging.getLogger('codemd.reclassify')
+
+def reclassify_bugs(project_name, classifier_config, progress=None):
+    """
+    Sets the bug classifier of an already mined project, and recomputes its bug
+    flags, dashboard data, and the bug fixes of its prefix sums and checkpoints
+    from the stored message tokens, without re-walking the repository. Only the
+    data from the earliest commit whose flag changed onwards is recomputed, and
+    the data of the other circle packing modules is kept as is.
+
+    Like ingest_project, every stage durably records its completion in the
+    project status, so an interrupted run resumes from where it stopped when it
+    is run again. The project keeps being served in the meantime, except while
+    the bug records of its checkpoints are replaced.
+
+    :param classifier_config: The config of the new BugClassifier, see
+        BugClassifier.to_config()
+    :param progress: Optional callable invoked as progress(stage) when the run
+        moves to a new stage
+    """
+    if progress is None:
+        progress = lambda stage, **values: None
+
+    status = DBHandler.ingest_status(project_name)
+    pending = status.get('pending') if status is not None else None
+    db_handler = DBHandler(project_name)
+    progress('migrating')
+    db_handler.migrate_storage()
+
+    if pending is None:
+        log.info("Reclassifying bug fixes of project %s with %s", project_name,
+                 classifier_config)
+        pending = db_handler.start_ingest(DBHandler.RECLASSIFY_INGEST,
+                                          bug_classifier=classifier_config)
+    elif pending['kind'] != DBHandler.RECLASSIFY_INGEST:
+        raise ValueError("Project %s has a pending %s ingest, which must finish first"
+                         % (project_name, pending['kind']))
+    else:
+        log.info("Resuming interrupted reclassification of project %s (stages done: %s)",
+                 project_name, pending['stages_done'])
+    stages_done = set(pending['stages_done'])
+
+    if 'bug_flags' not in stages_done:
+        progress('bug_flags')
+        classifier = BugClassifier.from_config(pending['bug_classifier'])
+        db_handler.set_bug_classifier(classifier)
+        since_date = db_handler.reclassify_bug_fixes(classifier)
+        pending['since_date'] = since_date
+        db_handler.update_pending_ingest(since_date=since_date)
+        db_handler.mark_stage_done('bug_flags')
+
+    since_date = pending.get('since_date')
+    if since_date is None:
+        log.info("No bug flags changed for project %s.", project_name)
+        db_handler.finish_ingest()
+        return
+
+    metrics = MetricsBuilder(project_name)
+    if 'dashboard' not in stages_done:
+        log.debug("Updating dashboard data from date %s...", since_date)
+        progress('dashboard')
+        metrics.update_commits(since_date)
+        db_handler.mark_stage_done('dashboard')
+
+    if 'prefix_sums' not in stages_done:
+        log.debug("Reclassifying prefix sums...")
+        progress('prefix_sums')
+        metrics.reclassify_prefix_sums()
+        db_handler.mark_stage_done('prefix_sums')
+
+    if 'checkpoints' not in stages_done:
+        log.debug("Reclassifying checkpoint data from date %s...", since_date)
+        progress('checkpoints')
+        db_handler.mark_not_ready()
+        if 'invalidate_checkpoints' in stages_done:
+            # Runs started before only bug records were recomputed removed the
+            # checkpoints from since_date, which are rebuilt instead
+            metrics.resume_circle_packing_data()
+        else:
+            metrics.reclassify_circle_packing_data(since_date)
+        db_handler.mark_stage_done('checkpoints')
+
+    db_handler.finish_ingest()
+    log.debug("Done reclassifying bug fixes of project %s.", project_name)
@@ -0,0 +1,554 @@
+import logging
+import hashlib
+import struct
+import heapq
+import math
+from array import array
+from itertools import combinations
+
+try:
+    import numpy
+    import scipy.sparse
+except ImportError:
+    numpy = None
+
+class SparseCouplingEngine(object):
+    """
+    Counts the mutual revisions of couples of files with sparse matrices rather
+    than enumerating the pairs of files of every commit.
+
+    File names are interned to integer ids, and commits added with add_commit()
+    are buffered as the entries of a commit by file incidence matrix A. The
+    number of mutual revisions of every couple of files is then the upper
+    triangle of the sparse product A.T * A, so the cost of a commit grows with
+    the number of distinct couples it adds rather than with the number of pairs
+    enumerated in python. This keeps large commits affordable, ie when raising
+    TemporalCouplingModule.MAX_COMMIT_SIZE.
+
+    fold() accumulates the products in a sparse upper triangular matrix of file
+    ids, self.couples, so couples are never held as tuples of file names: they
+    are subtracted, persisted and scored as arrays of ids and counts.
+
+    The engine requires numpy and scipy, see available().
+
+    :param file_names: The names of the files of the couples, by file id
+    :param firsts: The file ids of the first files of the couples
+    :param seconds: The file ids of the second files of the couples
+    :param counts: The numbers of mutual revisions of the couples
+    """
+
+    def __init__(self, file_names=None, firsts=None, seconds=None, counts=None):
+        self.log = logging.getLogger('codemd.SparseCouplingEngine')
+        self.file_names = list(file_names) if file_names is not None else []
+        self.file_ids = dict((name, file_id) for file_id, name in enumerate(self.file_names))
+        self.couples = self.__matrix([], [], [])
+        if counts is not None and len(counts) > 0:
+            self.couples = self.__matrix(firsts, seconds, counts)
+        self.commit_rows = array('l')
+        self.file_columns = array('l')
+        self.num_commits = 0
+
+    @classmethod
+    def available(cls):
+        """
+        Checks if the engine can be used, ie if numpy and scipy are installed
+        """
+        return numpy is not None
+
+    @classmethod
+    def from_mappings(cls, data):
+        """
+        Builds an engine from the state returned by mappings()
+        """
+        file_names = [None] * len(data['file_ids'])
+        for file_name, file_id in data['file_ids'].iteritems():
+            file_names[file_id] = file_name
+        return cls(file_names, data['firsts'], data['seconds'], data['counts'])
+
+    def mappings(self):
+        """
+        Returns the state of the engine, to be persisted in checkpoints
+        """
+        self.fold()
+        firsts, seconds, counts = self.couple_arrays()
+        return {'file_ids': self.file_ids, 'firsts': firsts, 'seconds': seconds,
+                'counts': counts}
+
+    def file_id(self, file_name):
+        """
+        Returns the id of file_name, interning it if necessary
+        """
+        file_id = self.file_ids.get(file_name)
+        if file_id is None:
+            file_id = self.file_ids[file_name] = len(self.file_names)
+            self.file_names.append(file_name)
+        return file_id
+
+    def add_commit(self, file_names):
+        """
+        Buffers a commit in the incidence matrix
+
+        :param file_names: The names of the files modified by the commit
+        """
+        for file_name in file_names:
+            self.commit_rows.append(self.num_commits)
+            self.file_columns.append(self.file_id(file_name))
+        self.num_commits += 1
+
+    def add_couples(self, couples):
+        """
+        Adds counts of mutual revisions to couples
+
+        :param couples: A dict of (file1, file2) : # of mutual revisions
+        """
+        if len(couples) == 0:
+            return
+        firsts = [self.file_id(first) for first, _ in couples.iterkeys()]
+        seconds = [self.file_id(second) for _, second in couples.iterkeys()]
+        self.couples = (self.__resized(self.couples)
+                        + self.__matrix(firsts, seconds, couples.values()))
+
+    def fold(self):
+        """
+        Counts the mutual revisions of the buffered commits into self.couples
+        and clears the buffer
+        """
+        if self.num_commits == 0:
+            return
+        co_changes = self.__co_changes()
+        self.couples = self.__resized(self.couples) + co_changes
+        self.log.debug("Folded %s commits into %s couples", self.num_commits, co_changes.nnz)
+        self.__clear_buffer()
+
+    def fold_couples(self, add_couple):
+        """
+        Counts the mutual revisions of the buffered commits and clears the
+        buffer, without accumulating them in self.couples
+
+        :param add_couple: Called with ((file1, file2), # of mutual revisions)
+            for every couple of the buffered commits, where file1 < file2
+        """
+        if self.num_commits == 0:
+            return
+        co_changes = self.__co_changes().tocoo()
+        file_names = self.file_names
+        for first, second, count in zip(co_changes.row.tolist(), co_changes.col.tolist(),
+                                        co_changes.data.tolist()):
+            first, second = file_names[first], file_names[second]
+            if second < first:
+                first, second = second, first
+            add_couple((first, second), count)
+        self.__clear_buffer()
+
+    def subtract(self, other):
+        """
+        Subtracts the couples of other from the couples of this engine, where
+        other counted a subset of the revisions of this engine
+        """
+        self.fold()
+        other.fold()
+        if other.couples.nnz == 0:
+            return self
+        # Map the file ids of other to the ids of the same files in this engine
+        file_ids = numpy.array([self.file_id(name) for name in other.file_names],
+                               dtype=numpy.int_)
+        other_couples = other.couples.tocoo()
+        self.couples = (self.__resized(self.couples)
+                        - self.__matrix(file_ids[other_couples.row],
+                                        file_ids[other_couples.col], other_couples.data))
+        self.couples.eliminate_zeros()
+        return self
+
+    def couple_arrays(self):
+        """
+        Returns the file ids of the first and second files of the couples and
+        their numbers of mutual revisions, as three numpy arrays, where first
+        ids are lower than second ids
+        """
+        couples = self.couples.tocoo()
+        return couples.row, couples.col, couples.data
+
+    def __co_changes(self):
+        """
+        Returns the numbers of mutual revisions of the couples of the buffered
+        commits, as a sparse upper triangular matrix of file ids
+        """
+        rows = numpy.frombuffer(self.commit_rows, dtype=numpy.int_)
+        columns = numpy.frombuffer(self.file_columns, dtype=numpy.int_)
+        incidence = scipy.sparse.csr_matrix(
+            (numpy.ones(len(rows), dtype=numpy.int_), (rows, columns)),
+            shape=(self.num_commits, len(self.file_names)))
+        # A file listed twice in a commit is still one revision
+        incidence.data[:] = 1
+        return scipy.sparse.triu(incidence.T.dot(incidence), k=1).tocsr()
+
+    def __clear_buffer(self):
+        self.commit_rows = array('l')
+        self.file_columns = array('l')
+        self.num_commits = 0
+
+    def __matrix(self, firsts, seconds, counts):
+        """
+        Returns the upper triangular matrix of the couples of files with ids
+        firsts and seconds (in any order)
+        """
+        firsts = numpy.asarray(firsts, dtype=numpy.int_)
+        seconds = numpy.asarray(seconds, dtype=numpy.int_)
+        size = len(self.file_names)
+        return scipy.sparse.csr_matrix(
+            (numpy.asarray(counts, dtype=numpy.int_),
+             (numpy.minimum(firsts, seconds), numpy.maximum(firsts, seconds))),
+            shape=(size, size))
+
+    def __resized(self, couples):
+        """
+        Returns couples with rows and columns for every interned file
+        """
+        size = len(self.file_names)
+        if couples.shape == (size, size):
+            return couples
+        couples = couples.tocoo()
+        return scipy.sparse.csr_matrix((couples.data, (couples.row, couples.col)),
+                                       shape=(size, size))
+
+    @staticmethod
+    def score_couples(counts, first_revisions, second_revisions, weights=None):
+        """
+        Vectorized temporal coupling score of couples of files, see
+        TemporalCouplingModule.post_process_data()
+
+        :param counts: The numbers of mutual revisions of the couples
+        :param first_revisions: The numbers of revisions of the first files
+        :param second_revisions: The numbers of revisions of the second files
+        :param weights: Optional factors applied to the scores
+        :returns: A tuple of lists (scores, average revisions)
+        """
+        counts = numpy.asarray(counts, dtype=numpy.float64)
+        total_revisions = (numpy.asarray(first_revisions, dtype=numpy.float64)
+                           + numpy.asarray(second_revisions, dtype=numpy.float64))
+        avg_revisions = total_revisions / 2.0
+        scores = counts / avg_revisions * numpy.log(total_revisions)
+        if weights is not None:
+            scores *= numpy.asarray(weights, dtype=numpy.float64)
+        return scores.tolist(), avg_revisions.tolist()
+
+
+class CoupleSketch(object):
+    """
+    Bounded memory estimate of the number of mutual revisions of couples of
+    files: a Count-Min sketch of DEPTH rows of WIDTH counters, plus the
+    candidate heavy hitters, ie up to 2 * NUM_CANDIDATES couples with the
+    highest estimates.
+
+    Estimates never underestimate, and overestimate by at most
+    e / WIDTH * total (see error_bound()) with probability 1 - exp(-DEPTH).
+    WIDTH is the smallest power of 2 bounding the overestimate by
+    ERROR_RATE * total. Any couple counted more often than the
+    NUM_CANDIDATES-th candidate is a candidate.
+
+    Counters are 32 bit integers, widened to 64 bit only once the total no
+    longer fits, so a sketch takes DEPTH * WIDTH * 4 bytes (512 KB by default)
+    in memory and in every checkpoint.
+
+    Sketches are linear, so they merge and subtract exactly like the counts
+    they estimate, and the estimates of a difference keep the error bound of
+    its total. Candidates are not linear: when subtracting the sketch of an
+    earlier checkpoint from a later one, only the candidates of the later one
+    are kept, and those were selected by their estimates over the whole
+    history up to the later checkpoint rather than over the interval between
+    the checkpoints. So the candidates of a difference are only guaranteed to
+    hold the couples counted in the interval more often than the
+    NUM_CANDIDATES-th candidate of the later sketch; a couple frequent in the
+    interval but not in the whole history may be missing from them, although
+    estimate() still counts it.
+
+    The sketch requires numpy, see available().
+
+    :param counts: The flattened counters, ie as persisted by mappings()
+    :param candidates: A dict of (file1, file2) : estimate
+    :param total: The number of mutual revisions counted
+    """
+
+    # Maximum overestimate of the counts, as a fraction of the total count
+    ERROR_RATE = 1e-4
+
+    # Counters per row. Estimates overestimate by at most e / WIDTH * total.
+    # A power of 2, so sketches of other widths can be folded to it
+    WIDTH = 2 ** int(math.ceil(math.log(math.e / ERROR_RATE, 2)))
+
+    # Number of rows, ie independent hashes (at most 4). Error bounds hold with
+    # probability 1 - exp(-DEPTH)
+    DEPTH = 4
+
+    # Number of heavy hitters tracked. Up to twice as many are kept between
+    # prunings
+    NUM_CANDIDATES = 2 ** 16
+
+    def __init__(self, counts=None, candidates=None, total=0):
+        self.log = logging.getLogger('codemd.CoupleSketch')
+        self.total = total
+        if counts is None:
+            self.counts = numpy.zeros((self.DEPTH, self.WIDTH), dtype=self.__dtype())
+        else:
+            # Copy since loaded counts may be read only views of cached checkpoints
+            counts = numpy.array(counts, dtype=numpy.int64).reshape(self.DEPTH, -1)
+            if counts.shape[1] != self.WIDTH:
+                counts = self.__fold(counts)
+            self.counts = counts.astype(self.__dtype())
+        self.candidates = candidates if candidates is not None else {}
+        self.rows = numpy.arange(self.DEPTH)
+
+    @classmethod
+    def available(cls):
+        """
+        Checks if the sketch can be used, ie if numpy is installed
+        """
+        return numpy is not None
+
+    def add(self, couple, count=1):
+        """
+        Counts count mutual revisions of couple
+        """
+        columns = self.__columns(couple)
+        self.total += count
+        self.__widen()
+        self.counts[self.rows, columns] += count
+        self.candidates[couple] = int(self.counts[self.rows, columns].min())
+        if len(self.candidates) > 2 * self.NUM_CANDIDATES:
+            self.__prune()
+
+    def estimate(self, couple):
+        """
+        Returns the estimated number of mutual revisions of couple
+        """
+        return int(self.counts[self.rows, self.__columns(couple)].min())
+
+    def merge(self, other):
+        """
+        Adds the counts of other to this sketch
+        """
+        self.total += other.total
+        self.__widen()
+        self.counts += other.counts
+        self.candidates.update(other.candidates)
+        self.refresh()
+        return self
+
+    def subtract(self, other):
+        """
+        Subtracts the counts of other from this sketch, where other counted a
+        subset of the revisions of this sketch. The candidates of this sketch
+        are kept, with their estimates updated (see the class docstring for
+        what they hold)
+        """
+        self.counts -= other.counts
+        self.total -= other.total
+        self.refresh()
+        return self
+
+    def refresh(self):
+        """
+        Updates the estimates of the candidates, dropping the ones that are no
+        longer counted and the lowest ones above 2 * NUM_CANDIDATES
+        """
+        for couple in self.candidates.keys():
+            estimate = self.estimate(couple)
+            if estimate > 0:
+                self.candidates[couple] = estimate
+            else:
+                del self.candidates[couple]
+        if len(self.candidates) > 2 * self.NUM_CANDIDATES:
+            self.__prune()
+
+    def error_bound(self):
+        """
+        Returns the maximum overestimate of any count, with probability
+        1 - exp(-DEPTH)
+        """
+        return math.e / self.WIDTH * self.total
+
+    def mappings(self):
+        """
+        Returns the state of the sketch, to be persisted in checkpoints
+        """
+        return {'counts': self.counts.ravel(), 'candidates': self.candidates,
+                'total': self.total}
+
+    def __dtype(self):
+        if self.total > numpy.iinfo(numpy.int32).max:
+            return numpy.int64
+        return numpy.int32
+
+    def __widen(self):
+        """
+        Widens the counters to 64 bit once the total no longer fits in 32 bit
+        """
+        if self.counts.dtype != self.__dtype():
+            self.counts = self.counts.astype(numpy.int64)
+
+    def __fold(self, counts):
+        """
+        Returns counts of a sketch of another width folded to WIDTH, ie for
+        checkpoints saved with another WIDTH. Columns are hashes modulo the
+        width, so the columns of a wider sketch map to WIDTH exactly.
+        """
+        width = counts.shape[1]
+        if width < self.WIDTH or width % self.WIDTH != 0:
+            raise ValueError("Can't fold a couple sketch of width %s to width %s"
+                             % (width, self.WIDTH))
+        self.log.info("Folding couple sketch of width %s to width %s", width, self.WIDTH)
+        return counts.reshape(self.DEPTH, width // self.WIDTH, self.WIDTH).sum(axis=1)
+
+    def __prune(self):
+        """
+        Keeps the NUM_CANDIDATES candidates with the highest estimates
+        """
+        kept = heapq.nlargest(self.NUM_CANDIDATES, self.candidates.iteritems(),
+                              key=lambda (couple, estimate): estimate)
+        self.candidates.clear()
+        self.candidates.update(kept)
+        self.log.debug("Pruned candidate couples to %s", len(kept))
+
+    def __columns(self, couple):
+        key = '\0'.join(name.encode('utf-8') if isinstance(name, unicode) else name
+                        for name in couple)
+        hashes = struct.unpack('<4I', hashlib.md5(key).digest())
+        return numpy.array(hashes[0:self.DEPTH]) % self.WIDTH
+
+
+class MinHashCoupling(object):
+    """
+    Finds the couples of files modified together in many commits without
+    enumerating the pairs of files of every commit, for commits too large for
+    pairwise counting.
+
+    Every file gets a MinHash signature of its set of commits, made of
+    NUM_BANDS * ROWS_PER_BAND hashes. Files whose signatures agree on all the
+    rows of a band fall in the same LSH bucket and become candidate couples, so
+    a couple with a Jaccard similarity s is found with probability
+    1 - (1 - s ^ ROWS_PER_BAND) ^ NUM_BANDS (ie about 0.64 for s = 0.5 and 0.9998
+    for s = 0.8 with the default values). The mutual commits of the candidates
+    are then counted exactly.
+
+    Signatures are computed over the commits of the interval being loaded, so
+    they are computed again for every interval: the minimum hashes of a file
+    can't be subtracted like the counts of checkpoints.
+
+    Requires numpy, see available().
+
+    :param commits: An iterable of lists of file names, one per commit
+    """
+
+    NUM_BANDS = 16
+
+    ROWS_PER_BAND = 4
+
+    # Buckets with more files than this are skipped, since all their pairs
+    # would be candidates
+    MAX_BUCKET_SIZE = 256
+
+    # Number of signature hashes computed at once, to bound memory use
+    HASH_BATCH_SIZE = 2 ** 16
+
+    PRIME = 2 ** 31 - 1
+
+    SEED = 1
+
+    def __init__(self, commits):
+        self.log = logging.getLogger('codemd.MinHashCoupling')
+        self.file_names = []
+        file_ids = {}
+        commit_ids, files = array('l'), array('l')
+        for commit_id, file_names in enumerate(commits):
+            for file_name in set(file_names):
+                file_id = file_ids.get(file_name)
+                if file_id is None:
+                    file_id = file_ids[file_name] = len(self.file_names)
+                    self.file_names.append(file_name)
+                commit_ids.append(commit_id)
+                files.append(file_id)
+
+        # Commits of every file, sorted, in CSR layout
+        files = numpy.frombuffer(files, dtype=numpy.int_)
+        order = numpy.argsort(files, kind='mergesort')
+        self.file_commits = numpy.frombuffer(commit_ids, dtype=numpy.int_)[order]
+        self.file_offsets = numpy.append(0, numpy.cumsum(
+            numpy.bincount(files, minlength=len(self.file_names))))
+
+    @classmethod
+    def available(cls):
+        """
+        Checks if MinHash coupling can be used, ie if numpy is installed
+        """
+        return numpy is not None
+
+    def couples(self):
+        """
+        Returns a dict of (file1, file2) : # of mutual commits for the candidate
+        couples, where file1 < file2
+        """
+        if len(self.file_names) < 2:
+            return {}
+        couples = {}
+        candidates = self.__candidates(self.__signatures())
+        for first, second in candidates:
+            count = len(numpy.intersect1d(self.__commits_of(first), self.__commits_of(second),
+                                          assume_unique=True))
+            first, second = self.file_names[first], self.file_names[second]
+            if second < first:
+                first, second = second, first
+            couples[(first, second)] = count
+        self.log.info("Counted mutual commits of %s candidate couples of %s files",
+                      len(candidates), len(self.file_names))
+        return couples
+
+    def __commits_of(self, file_id):
+        return self.file_commits[self.file_offsets[file_id]:self.file_offsets[file_id + 1]]
+
+    def __signatures(self):
+        """
+        Returns the MinHash signatures of the files, as an array with one row per
+        file
+        """
+        num_hashes = self.NUM_BANDS * self.ROWS_PER_BAND
+        random_state = numpy.random.RandomState(self.SEED)
+        multipliers = random_state.randint(1, self.PRIME, num_hashes).astype(numpy.int64)
+        increments = random_state.randint(0, self.PRIME, num_hashes).astype(numpy.int64)
+
+        signatures = numpy.empty((len(self.file_names), num_hashes), dtype=numpy.int64)
+        starts = self.file_offsets[:-1]
+        batch_files = max(1, self.HASH_BATCH_SIZE * len(self.file_names)
+                          // max(1, len(self.file_commits)))
+        for first_file in xrange(0, len(self.file_names), batch_files):
+            last_file = min(first_file + batch_files, len(self.file_names))
+            lo, hi = self.file_offsets[first_file], self.file_offsets[last_file]
+            commits = self.file_commits[lo:hi].astype(numpy.int64)
+            hashes = (commits[:, None] * multipliers + increments) % self.PRIME
+            signatures[first_file:last_file] = numpy.minimum.reduceat(
+                hashes, starts[first_file:last_file] - lo, axis=0)
+        return signatures
+
+    def __candidates(self, signatures):
+        """
+        Returns the set of (file id, file id) couples sharing an LSH bucket
+        """
+        candidates = set()
+        skipped_buckets = 0
+        for band in xrange(self.NUM_BANDS):
+            rows = numpy.ascontiguousarray(
+                signatures[:, band * self.ROWS_PER_BAND:(band + 1) * self.ROWS_PER_BAND])
+            keys = rows.view(numpy.dtype((numpy.void, rows.dtype.itemsize * rows.shape[1])))
+            _, buckets = numpy.unique(keys.ravel(), return_inverse=True)
+            order = numpy.argsort(buckets, kind='mergesort')
+            bounds = numpy.flatnonzero(numpy.diff(buckets[order])) + 1
+            for bucket in numpy.split(order, bounds):
+                if len(bucket) < 2:
+                    continue
+                if len(bucket) > self.MAX_BUCKET_SIZE:
+                    skipped_buckets += 1
+                    continue
+                candidates.update(combinations(sorted(bucket.tolist()), 2))
+        if skipped_buckets > 0:
+            self.log.warning("Skipped %s LSH buckets of more than %s files",
+                             skipped_buckets, self.MAX_BUCKET_SIZE)
+        return candidates
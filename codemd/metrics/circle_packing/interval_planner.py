@@ -0,0 +1,112 @@
+import logging
+
+class IntervalPlan(object):
+    """
+    A way of computing the module data of an interval [start, end] from the
+    checkpoints of a project, as the difference of two cumulative states:
+        - the upper state, with all file modifications up to end, loaded from
+          upper_checkpoint and replaying the file modifications after it
+        - the lower state, with all file modifications before start, loaded from
+          lower_checkpoint and either replaying the file modifications after it
+          (FORWARD), or subtracting the file modifications from start to it,
+          replayed in blank modules (BACKWARD)
+
+    A checkpoint of None stands for blank modules, ie the state before the first
+    file modification of the project.
+    """
+
+    FORWARD = 'forward'
+    BACKWARD = 'backward'
+
+    def __init__(self, upper_checkpoint, upper_rows, lower_checkpoint, lower_rows,
+                 lower_direction, cost):
+        self.upper_checkpoint = upper_checkpoint
+        self.upper_rows = upper_rows
+        self.lower_checkpoint = lower_checkpoint
+        self.lower_rows = lower_rows
+        self.lower_direction = lower_direction
+        self.cost = cost
+
+    def has_lower(self):
+        """
+        Checks if the plan needs to subtract a lower state at all, ie if there
+        are file modifications before the start of the interval
+        """
+        return self.lower_checkpoint is not None or self.lower_rows > 0
+
+    def __str__(self):
+        return ("upper: checkpoint %s + %s rows forward, lower: checkpoint %s %s %s rows "
+                + "%s (cost: %s)") % (self.upper_checkpoint, self.upper_rows,
+                                      self.lower_checkpoint,
+                                      '+' if self.lower_direction == self.FORWARD else '-',
+                                      self.lower_rows, self.lower_direction, self.cost)
+
+
+class IntervalPlanner(object):
+    """
+    Chooses the cheapest IntervalPlan for loading an interval from checkpoints.
+
+    The cost of a plan is the number of file modifications it replays plus
+    CHECKPOINT_LOAD_COST for each checkpoint it loads. File modifications are
+    counted with the date index of the file modifications collection, so
+    planning takes a handful of count queries whatever the length of the
+    history. Only the checkpoints closest to the interval edges are candidates,
+    since any other checkpoint on the same side of an edge replays more rows.
+
+    :param db_handler: The DBHandler of the project
+    """
+
+    # Estimated cost of loading a checkpoint, in replayed file modifications
+    CHECKPOINT_LOAD_COST = 4096
+
+    def __init__(self, db_handler):
+        self.log = logging.getLogger('codemd.IntervalPlanner')
+        self.db_handler = db_handler
+        self.counts = {}
+
+    def plan(self, start, end):
+        """
+        Returns the cheapest IntervalPlan for the interval [start, end]
+        """
+        plans = []
+        last_before_end = self.db_handler.find_closest_checkpoint(end, before=True)
+        last_before_start = self.db_handler.find_closest_checkpoint(start - 1, before=True)
+        first_after_start = self.db_handler.find_closest_checkpoint(start, before=False)
+
+        upper_candidates = [None]
+        if last_before_end is not None:
+            upper_candidates.append(last_before_end)
+
+        lower_candidates = [(None, IntervalPlan.FORWARD)]
+        if last_before_start is not None:
+            lower_candidates.append((last_before_start, IntervalPlan.FORWARD))
+        # The upper state has to hold every file of the lower state, so backward
+        # plans only use checkpoints within the interval
+        if first_after_start is not None and first_after_start <= end:
+            lower_candidates.append((first_after_start, IntervalPlan.BACKWARD))
+
+        for upper_checkpoint in upper_candidates:
+            upper_rows = self.__count_until(end) - self.__count_until(upper_checkpoint)
+            for lower_checkpoint, direction in lower_candidates:
+                if direction == IntervalPlan.FORWARD:
+                    lower_rows = self.__count_until(start - 1) - self.__count_until(lower_checkpoint)
+                else:
+                    lower_rows = self.__count_until(lower_checkpoint) - self.__count_until(start - 1)
+                cost = (upper_rows + lower_rows
+                        + self.__load_cost(upper_checkpoint) + self.__load_cost(lower_checkpoint))
+                plans.append(IntervalPlan(upper_checkpoint, upper_rows, lower_checkpoint,
+                                          lower_rows, direction, cost))
+
+        for plan in plans:
+            self.log.debug("Candidate plan for interval [%s, %s]: %s", start, end, plan)
+        best_plan = min(plans, key=lambda plan: plan.cost)
+        self.log.info("Chose plan for interval [%s, %s]: %s", start, end, best_plan)
+        return best_plan
+
+    def __load_cost(self, checkpoint):
+        return self.CHECKPOINT_LOAD_COST if checkpoint is not None else 0
+
+    def __count_until(self, date):
+        if date not in self.counts:
+            self.counts[date] = self.db_handler.file_history_count_until(date)
+        return self.counts[date]
@@ -35,56 +35,61 @@ class CirclePackingMetrics(object):
         """
         # TODO -- move this behavior to CirclePackingMetrics
         if self.intervals is None:
-            start = DBHandler.first_revision_date(self.project_name)
-            end = DBHandler.last_revision_date(self.project_name)
+            start, end = DBHandler.revision_date_range(self.project_name)
             self.intervals = [[start, end]]
             return
         if ((len(self.intervals) > 1) and (self.intervals[1] == [None, None])):
             self.intervals.pop()
-        if self.intervals[0][0] is None:
-            self.intervals[0][0] = DBHandler.first_revision_date(self.project_name)
-        if self.intervals[-1][1] is None:
-            self.intervals[-1][1] = DBHandler.last_revision_date(self.project_name)
+        if self.intervals[0][0] is None or self.intervals[-1][1] is None:
+            start, end = DBHandler.revision_date_range(self.project_name)
+            if self.intervals[0][0] is None:
+                self.intervals[0][0] = start
+            if self.intervals[-1][1] is None:
+                self.intervals[-1][1] = end
 
     def create_checkpoints(self):
         self.log.info("Creating circle packing checkpoints for project %s", self.project_name)
         self.metrics_store.persist_checkpoints()
 
+    def update_checkpoints(self, since_date):
+        self.log.info("Extending circle packing checkpoints for project %s from date %s",
+                      self.project_name, since_date)
+        self.metrics_store.extend_checkpoints(since_date)
+
+    def resume_checkpoints(self):
+        self.log.info("Resuming circle packing checkpoints for project %s", self.project_name)
+        self.metrics_store.resume_checkpoints()
+
+    def reclassify_checkpoints(self, since_date):
+        self.log.info("Reclassifying bug fixes of circle packing checkpoints for project %s "
+                      + "from date %s", self.project_name, since_date)
+        self.metrics_store.reclassify_checkpoints(since_date)
+
+    def reclassify_prefix_sums(self):
+        self.log.info("Reclassifying bug fixes of prefix sums for project %s", self.project_name)
+        self.metrics_store.reclassify_prefix_sums()
+
+    def create_prefix_sums(self):
+        self.log.info("Creating prefix sums for project %s", self.project_name)
+        self.metrics_store.persist_prefix_sums()
+
     def compute_file_hierarchy(self):
         # NOTE -- this logic won't fly with multiple intervals.
-        self.log.info("Loading checkpoint module data differentials for interval: %s...",
-                       self.intervals)
-        if self.metrics_store.load_interval():
-            self.log.info("Processing remaining files not caught in checkpoint differntial interval...")
-            self.log.debug("Processing first chunk...")
-            for f in self.metrics_store.gen_first_missing_files():
-                self.__feed_file(f, only_scoped=True)
-            self.log.debug("Processing last chunk...")
-            for f in self.metrics_store.gen_second_missing_files():
-                self.__feed_file(f)
-        else:
-            self.log.info("No checkpoints found in intervals, processing data " +
-                          "from first available checkpoint to interval start...")
-            for f in self.metrics_store.gen_first_missing_files():
-                self.__feed_file(f)
-            self.log.debug("Done processing from checkpoint to interval start")
-            self.log.debug("Processing entire interval: %s", self.intervals[0])
-            for f in self.metrics_store.gen_second_missing_files():
-                self.__feed_file(f)
-
-        self.log.info("Done processing remaining files. Starting post processing...")
+        if self.metrics_store.load_prefix_sums_interval():
+            self.log.info("Loaded module data for interval %s from prefix sums. "
+                          + "Starting post processing...", self.intervals)
+            self.__post_process_data()
+            self.log.info("Done with post processing")
+            return self.completedData
+
+        self.log.info("Loading checkpoint module data for interval: %s...", self.intervals)
+        self.metrics_store.load_interval()
+
+        self.log.info("Done loading checkpoint data. Starting post processing...")
         self.__post_process_data()
         self.log.info("Done with post processing")
         return self.completedData
 
-    def __feed_file(self, f, only_scoped=False):
-        for mod in self.modules:
-            if only_scoped:
-                if mod.is_scoped:
-                    mod.process_file(f)
-            else:
-                mod.process_file(f)
-
     def __post_process_data(self):
         """
         Invoked when we finish up an interval
@@ -93,4 +98,4 @@ class CirclePackingMetrics(object):
             mod.post_process_data()
         self.log.debug("Popping off interval: %s", self.intervals[0])
         self.intervals.pop(0)
-        self.completedData.append(self.working_data.copy())
+        self.completedData.append(self.working_data.to_dicts())
@@ -1,38 +1,226 @@
 import logging
 import itertools
+import sys
+from collections import defaultdict
 from codemd.data_managers.db_handler import DBHandler
 
 from codemd.metrics.circle_packing.modules.file_info import FileInfoModule
 from codemd.metrics.circle_packing.modules.bugs import BugModule
 from codemd.metrics.circle_packing.modules.knowledge_map import KnowledgeMapModule
 from codemd.metrics.circle_packing.modules.temporal_coupling import TemporalCouplingModule
+from codemd.metrics.circle_packing.prefix_sums import PrefixSumEngine
+from codemd.metrics.circle_packing.interval_planner import IntervalPlanner, IntervalPlan
+from codemd.metrics.circle_packing.records import FileRecordStore
 
 import pdb
 
 class CirclePackingMetricsStore(object):
+    """
+    Persists circle packing checkpoints and loads module data for intervals
+    from them.
 
-    MAX_CHECKPOINTS = 24
+    Checkpoints form a hierarchy: checkpoint number i (saved every
+    CHECKPOINT_SPACING file modifications) belongs to level
+    MAX_CHECKPOINT_LEVEL - (number of trailing zero bits of i), so every level
+    halves the spacing of the level above it. Checkpoints are full snapshots of
+    the module states. While checkpoints are saved, the finest levels are
+    dropped as soon as more than MAX_CHECKPOINTS checkpoints, or more than
+    MAX_CHECKPOINT_BYTES bytes of checkpoint data, would be kept, and the
+    checkpoints of dropped levels are not saved anymore.
+
+    With the count alone, the finest level kept only depends on the number of
+    file modifications n of the project, so the spacing s of the kept
+    checkpoints widens deterministically with history:
+        s = CHECKPOINT_SPACING * 2^k < max(CHECKPOINT_SPACING, 2n / MAX_CHECKPOINTS)
+    for the smallest k keeping at most MAX_CHECKPOINTS checkpoints, which holds
+    as long as n < CHECKPOINT_SPACING * 2^MAX_CHECKPOINT_LEVEL * MAX_CHECKPOINTS.
+    Projects with snapshots of b bytes on average reach the byte budget first
+    when MAX_CHECKPOINT_BYTES / b < MAX_CHECKPOINTS, and s is then below
+    2n * b / MAX_CHECKPOINT_BYTES instead.
+
+    Each bound of an interval is loaded from the nearest checkpoint by replaying
+    at most s file modifications (plus those of the day a checkpoint is
+    deferred to), so the worst case replay of an interval is O(max(
+    CHECKPOINT_SPACING, n / MAX_CHECKPOINTS)): constant for short histories, but
+    linear in n for long ones. At most MAX_CHECKPOINTS + 1 snapshots are stored
+    at any time, and about MAX_CHECKPOINTS / 2 more are written every time the
+    spacing doubles, ie O(MAX_CHECKPOINTS * log(n / (CHECKPOINT_SPACING *
+    MAX_CHECKPOINTS))) snapshots are written while building the checkpoints.
+    """
+
+    # Number of file modifications between checkpoints of the finest level
+    CHECKPOINT_SPACING = 8192
+
+    # Number of levels below the coarsest level (level 0)
+    MAX_CHECKPOINT_LEVEL = 12
+
+    # Maximum number of checkpoints kept per project
+    MAX_CHECKPOINTS = 256
+
+    # Maximum number of bytes of encoded checkpoint data kept per project
+    MAX_CHECKPOINT_BYTES = 2 * 1024 ** 3
+
+    # Load intervals from the prefix sums of the project instead of replaying
+    # file modifications from checkpoints, when they are available
+    USE_PREFIX_SUMS = True
+
+    # Scope of the modules holding cumulative states while loading an interval
+    # from checkpoints
+    UNSCOPED_INTERVALS = [[-sys.maxint - 1, sys.maxint]]
 
     def __init__(self, metrics):
         self.log = logging.getLogger('codemd.CirclePackingMetricsStore')
         self.metrics = metrics
         self.db_handler = DBHandler(metrics.project_name)
         self.intervals = metrics.intervals
-        self.first_checkpoint = None
-        self.last_checkpoint = None
+        self.checkpoint_index = 0
+        self.checkpoint_level = None
+        # Level : number of bytes of the checkpoints saved on it
+        self.checkpoint_bytes = defaultdict(int)
         self.reset_modules()
 
     def persist_checkpoints(self):
         total_mods = self.db_handler.file_history_count()
-        chunk_size = total_mods/self.MAX_CHECKPOINTS
-        finished_day = None
-        total_count, count, chunks_processed = 0, 0, 0
+        self.checkpoint_level = self.db_handler.checkpoint_level(self.MAX_CHECKPOINT_LEVEL)
 
         self.log.info("Starting persisting cricle packing data with\n"
-                        + "MAX_CHECKPOINTS: %s\nchunk_size: %s\ntotal_mods: %s",
-                        self.MAX_CHECKPOINTS, chunk_size, total_mods)
+                        + "CHECKPOINT_SPACING: %s\nfinest level: %s\ntotal_mods: %s",
+                        self.CHECKPOINT_SPACING, self.checkpoint_level, total_mods)
+
+        self.checkpoint_index = 0
+        self.checkpoint_bytes = defaultdict(int, self.db_handler.checkpoint_sizes_by_level())
+        self.__persist_file_history(self.db_handler.file_history(), self.CHECKPOINT_SPACING,
+                                    save_first=True)
+
+        self.log.info("Finished persisting circle packing data.")
+
+    def extend_checkpoints(self, since_date):
+        """
+        Incrementally extends the checkpoints of a project after new commits were
+        added. Checkpoints on or after since_date are invalidated, and the file
+        history is replayed on top of the latest remaining checkpoint rather than
+        from the beginning of the project.
+
+        :param since_date: The earliest date (in unix epoch) of the new commits
+        """
+        self.db_handler.remove_checkpoints(since_date)
+        self.resume_checkpoints()
+
+    def resume_checkpoints(self):
+        """
+        Persists the checkpoints missing after the latest complete checkpoint, ie
+        after checkpoint building was interrupted. The saved checkpoints act as
+        durable progress markers: a partially saved checkpoint is removed, and the
+        file history is replayed on top of the latest complete one.
+        """
+        self.db_handler.remove_incomplete_checkpoints(len(self.metrics.modules))
+        resume_date = self.db_handler.last_checkpoint_date()
+        if resume_date is None:
+            self.log.info("No checkpoints found, persisting all checkpoints from scratch...")
+            self.persist_checkpoints()
+            return
+
+        self.checkpoint_level = self.db_handler.checkpoint_level(self.MAX_CHECKPOINT_LEVEL)
+        self.log.info("Extending circle packing checkpoints from checkpoint %s with "
+                      + "finest level: %s", resume_date, self.checkpoint_level)
+
+        self.checkpoint_index = self.db_handler.checkpoint_index(resume_date) + 1
+        self.checkpoint_bytes = defaultdict(int, self.db_handler.checkpoint_sizes_by_level())
+        self.metrics.modules = self.__create_modules(
+            self.db_handler.fetch_checkpoint_data(resume_date))
+        self.__persist_file_history(self.db_handler.file_history(start_date=resume_date + 1),
+                                    self.CHECKPOINT_SPACING)
+
+        self.log.info("Finished extending circle packing data.")
+
+    def reclassify_checkpoints(self, since_date):
+        """
+        Recomputes the bug records of the checkpoints on or after since_date from
+        the stored bug flags, ie after the bug classifier of the project changed.
+        The bug records of the latest checkpoint before since_date are still
+        valid, so only the bug fixes following it are replayed, and the data of
+        the other modules is left as is.
+
+        :param since_date: The earliest date (in unix epoch) of the commits whose
+            bug flag changed
+        """
+        dates = self.db_handler.checkpoint_dates(start_date=since_date)
+        if len(dates) == 0:
+            self.log.info("No checkpoints on or after date %s to reclassify", since_date)
+            return
+        base_date = self.db_handler.find_closest_checkpoint(since_date - 1, before=True)
+        bug_module = [mod for mod in self.__checkpoint_modules(base_date)
+                      if isinstance(mod, BugModule)][0]
+        self.log.info("Recomputing bug records of %s checkpoints from checkpoint %s",
+                      len(dates), base_date)
+
+        start_date = base_date + 1 if base_date is not None else None
+        for date in dates:
+            for f in self.db_handler.bug_fix_history(start_date=start_date, end_date=date):
+                bug_module.process_file(f)
+            self.db_handler.replace_packing_data(date, bug_module.MODULE_KEY,
+                                                 bug_module.persist_mappings())
+            start_date = date + 1
+
+        self.log.info("Finished recomputing bug records of checkpoints.")
+
+    def checkpoint_level_of(self, index):
+        """
+        Returns the level of the checkpoint with the given index in the hierarchy
+        """
+        if index == 0:
+            return 0
+        trailing_zeros = 0
+        while index % 2 == 0 and trailing_zeros < self.MAX_CHECKPOINT_LEVEL:
+            index /= 2
+            trailing_zeros += 1
+        return self.MAX_CHECKPOINT_LEVEL - trailing_zeros
+
+    def __widen_spacing(self):
+        """
+        Drops the finest checkpoint levels until at most MAX_CHECKPOINTS
+        checkpoints and MAX_CHECKPOINT_BYTES bytes are kept. Checkpoints 0 to
+        checkpoint_index - 1 exist, and those on level l or coarser are the
+        multiples of 2^(MAX_CHECKPOINT_LEVEL - l)
+        """
+        last_index = self.checkpoint_index - 1
+        level = self.checkpoint_level
 
-        for f in self.db_handler.file_history():
+        def kept_bytes(level):
+            return sum(size for l, size in self.checkpoint_bytes.iteritems() if l <= level)
+
+        while level > 0 and (
+                last_index // 2 ** (self.MAX_CHECKPOINT_LEVEL - level) + 1 > self.MAX_CHECKPOINTS
+                or kept_bytes(level) > self.MAX_CHECKPOINT_BYTES):
+            level -= 1
+        if level == self.checkpoint_level:
+            return
+        self.log.info("Checkpoint %s reached, dropping levels finer than %s to keep "
+                      + "at most %s checkpoints and %s bytes (%s bytes kept)", last_index,
+                      level, self.MAX_CHECKPOINTS, self.MAX_CHECKPOINT_BYTES, kept_bytes(level))
+        self.db_handler.remove_checkpoint_levels(level + 1)
+        for l in [l for l in self.checkpoint_bytes if l > level]:
+            del self.checkpoint_bytes[l]
+        self.checkpoint_level = level
+        self.db_handler.set_checkpoint_level(level)
+
+    def __persist_file_history(self, file_history, chunk_size, save_first=False):
+        """
+        Feeds file_history through self.metrics.modules, saving a checkpoint every
+        chunk_size file modifications (on day boundaries) and after the last one.
+
+        :param file_history: A cursor to file modifications sorted by date
+        :param chunk_size: Number of file modifications between checkpoints
+        :param save_first: If True, saves a checkpoint at the end of the first date
+        """
+        finished_day, first_day, f = None, None, None
+        total_count, count, chunks_processed = 0, 0, 0
+
+        for f in file_history:
+            if first_day is not None and first_day != f['date']:
+                self.log.debug("Storing first checkpoint at date %s", first_day)
+                self.__save_checkpoint(first_day)
+                first_day = None
             if count >= chunk_size:
                 if finished_day is None:
                     finished_day = f['date']
@@ -42,129 +230,190 @@ class CirclePackingMetricsStore(object):
                     self.log.debug("Complete chunk,"
                                     + "\n\tchunks_processed = %s\n\toverflow = %s",
                                     chunks_processed, count - 1)
-                    self.__save_checkpoint(finished_day)
+                    self.__save_checkpoint(finished_day, skip_fine_levels=True)
                     finished_day = None
             for mod in self.metrics.modules:
                 mod.process_file(f)
 
-            if total_count == 0:
-                self.log.debug("Storing first blank checkpoint at date %s", f['date'])
-                self.__save_checkpoint(f['date'])
+            if save_first and total_count == 0:
+                first_day = f['date']
 
             count += 1
             total_count += 1
             if total_count % 512 == 0:
                 self.log.debug("Total files processed so far: %s", total_count)
 
+        if f is None:
+            self.log.info("No file modifications to process.")
+            return
+
         self.log.debug("Storing last checkpoint at date: %s", f['date'])
         self.__save_checkpoint(f['date'])
 
-        self.log.info("Finished persisting circle packing data.")
+    def persist_prefix_sums(self):
+        """
+        Builds and saves the prefix sums of the whole file history of the project
+        """
+        if not PrefixSumEngine.available():
+            self.log.info("numpy is not installed, skipping prefix sums.")
+            return
+        engine = PrefixSumEngine.from_file_history(self.db_handler.file_history())
+        self.db_handler.persist_prefix_sums(engine.data)
 
-    def load_interval(self):
+    def reclassify_prefix_sums(self):
+        """
+        Updates the bug fixes of the saved prefix sums of the project from the
+        stored bug flags, ie after the bug classifier of the project changed,
+        without rebuilding the arrays of the other modules
         """
-        Loads circle packing data at:
-            - the first checkpoint AFTER the start of the interval
-            - the first checkpoint BEFORE the end of the interval
+        if not PrefixSumEngine.available():
+            self.log.info("numpy is not installed, skipping prefix sums.")
+            return
+        data = self.db_handler.fetch_prefix_sums()
+        if data is None:
+            self.log.info("No prefix sums found for project %s, building them...",
+                          self.metrics.project_name)
+            self.persist_prefix_sums()
+            return
+        engine = PrefixSumEngine(data)
+        bug_flags = [f['bug'] for f in self.db_handler.bug_flag_history()]
+        if len(bug_flags) != engine.num_rows:
+            self.log.info("Prefix sums of project %s are out of date, rebuilding them...",
+                          self.metrics.project_name)
+            self.persist_prefix_sums()
+            return
+        self.db_handler.persist_prefix_sums(engine.reclassify(bug_flags).data)
 
-        If no checkpoint data is found in the interval, this method returns false.
-        Otherwise, it returns true.
+    def load_prefix_sums_interval(self):
+        """
+        Sets self.metrics.modules to their state over the interval, computed from
+        the prefix sums of the project.
 
+        Returns False if prefix sums can't be used, ie if they weren't saved.
         """
-        start, end = self.intervals[0][0], self.intervals[0][1]
-        self.first_checkpoint = self.db_handler.find_closest_checkpoint(start, before=False)
-        self.last_checkpoint = self.db_handler.find_closest_checkpoint(end, before=True)
-        self.log.debug("Found first checkpoint %s and second checkpoint %s for interval: %s",
-                        self.first_checkpoint, self.last_checkpoint, self.intervals)
-
-        if self.first_checkpoint < self.last_checkpoint:
-            self.log.debug("Creating modules from first checkpoint data...")
-            first_modules = self.__create_modules(self.db_handler.fetch_checkpoint_data(self.first_checkpoint))
-            self.log.debug("Creating modules from second checkpoint data...")
-            last_modules = self.__create_modules(self.db_handler.fetch_checkpoint_data(self.last_checkpoint))
-
-            self.log.debug("Setting self.metrics.modules to difference of last and second checkpoint data...")
-            self.metrics.modules = []
-            for last_mod, first_mod in itertools.izip(last_modules, first_modules):
-                self.metrics.modules.append(last_mod.subtract_module(first_mod))
-
-            # Hack to set working data after loading - TODO find a clean solution
-            self.metrics.working_data = self.metrics.modules[0].working_data
-
-            self.log.debug("Finished loading checkpoint data between interval %s and %s ",
-                            self.first_checkpoint, self.last_checkpoint)
-            return True
-        else:
-            self.first_checkpoint = self.last_checkpoint
-            self.last_checkpoint = None
-            self.log.debug("No checkpoint data found in interval. Loading first available" +
-                           "checkpoint outside of interval at date %s", self.first_checkpoint)
-            self.log.debug("Creating modules from first closest checkpoint...")
-            self.metrics.modules = self.__create_modules(self.db_handler.fetch_checkpoint_data(self.first_checkpoint))
-            self.log.debug("Finished creating modules from first closest checkpoint %s", self.first_checkpoint)
-            self.metrics.working_data = self.metrics.modules[0].working_data
+        if not (self.USE_PREFIX_SUMS and PrefixSumEngine.available()):
+            return False
+        data = self.db_handler.fetch_prefix_sums()
+        if data is None:
+            self.log.debug("No prefix sums found for project %s", self.metrics.project_name)
+            return False
+        engine = PrefixSumEngine(data)
+        if not engine.is_compatible():
+            self.log.info("Prefix sums of project %s were built with other module settings",
+                          self.metrics.project_name)
             return False
 
-    def gen_first_missing_files(self):
+        self.reset_modules()
+        engine.load_modules(self.metrics.modules, self.intervals[0])
+        self.metrics.working_data = self.metrics.modules[0].working_data
+        return True
+
+    def load_interval(self):
+        """
+        Sets self.metrics.modules to their state over the interval, computed from
+        checkpoints following the cheapest plan found by IntervalPlanner: the
+        state before the interval start is subtracted from the state at the
+        interval end, each one loaded from a checkpoint and completed by
+        replaying file modifications forward or backward.
+        """
+        start, end = self.intervals[0][0], self.intervals[0][1]
+        plan = IntervalPlanner(self.db_handler).plan(start, end)
+
+        self.log.debug("Loading upper state of interval %s...", self.intervals[0])
+        modules = self.__replay(plan.upper_checkpoint, end)
+        if plan.has_lower():
+            self.log.debug("Loading lower state of interval %s...", self.intervals[0])
+            if plan.lower_direction == IntervalPlan.FORWARD:
+                lower_modules = self.__replay(plan.lower_checkpoint, start - 1)
+            else:
+                lower_modules = self.__subtract_modules(
+                    self.__checkpoint_modules(plan.lower_checkpoint),
+                    self.__replay(None, plan.lower_checkpoint, start_date=start))
+            modules = self.__subtract_modules(modules, lower_modules)
+
+        # Scope the modules to the interval again for post processing
+        for mod in modules:
+            mod.intervals = self.intervals
+            if isinstance(mod, TemporalCouplingModule) and mod.large_commits is not None:
+                # Stored once rather than in checkpoints, see __save_checkpoint
+                mod.large_commits = self.db_handler.large_commits(start, end)
+        self.metrics.modules = modules
+        # Hack to set working data after loading - TODO find a clean solution
+        self.metrics.working_data = modules[0].working_data
+        self.log.debug("Finished loading checkpoint data for interval %s", self.intervals[0])
+
+    def __checkpoint_modules(self, checkpoint_date):
         """
-        Returns a generator to the first chunk of file not caught between the
-        checkpoint interval (ie all files from interval start to first checkpoint)
+        Returns unscoped modules loaded from the checkpoint at checkpoint_date, or
+        blank ones if checkpoint_date is None
         """
-        if self.last_checkpoint is not None:
-            # Subtract one from first_checkpoint date because all the data on the
-            # specific date was loaded during the load_interval process
-            return self.db_handler.file_history(start_date = self.intervals[0][0],
-                                                end_date = self.first_checkpoint - 1)
-        else:
-            return self.db_handler.file_history(start_date = self.first_checkpoint + 1,
-                                                end_date = self.intervals[0][0])
+        if checkpoint_date is None:
+            return self.__blank_modules(self.UNSCOPED_INTERVALS)
+        return self.__create_modules(self.db_handler.fetch_checkpoint_data(checkpoint_date),
+                                     self.UNSCOPED_INTERVALS)
 
-    def gen_second_missing_files(self):
+    def __replay(self, checkpoint_date, end_date, start_date=None):
         """
-        Returns a generator to the second chunk of file not caught between the
-        checkpoint interval (ie all files from second checkpoint to interval end)
+        Returns unscoped modules loaded from the checkpoint at checkpoint_date
+        after processing the file modifications following it up to end_date
+
+        :param start_date: The date of the first file modification to process
+            when checkpoint_date is None
         """
-        if self.last_checkpoint is not None:
-            # Add one to last_checkpoint date because all the data on the
-            # specific date was loaded during the load_interval process
-            return self.db_handler.file_history(start_date = self.last_checkpoint + 1,
-                                                end_date = self.intervals[0][1])
-        else:
-            return self.db_handler.file_history(start_date = self.intervals[0][0] + 1,
-                                                end_date = self.intervals[0][1])
+        modules = self.__checkpoint_modules(checkpoint_date)
+        if checkpoint_date is not None:
+            start_date = checkpoint_date + 1
+        for f in self.db_handler.file_history(start_date=start_date, end_date=end_date):
+            for mod in modules:
+                mod.process_file(f)
+        for mod in modules:
+            mod.flush()
+        return modules
+
+    def __subtract_modules(self, modules, other_modules):
+        return [mod.subtract_module(other_mod)
+                for mod, other_mod in itertools.izip(modules, other_modules)]
 
     def reset_modules(self):
         # Reset modules data so they are fresh to recompute the next interval
         self.log.debug("Resetting modules...")
         self.metrics.modules = self.__blank_modules()
 
-    def __blank_modules(self):
-        working_data = {}
-        return [FileInfoModule(working_data, self.intervals),
-                        BugModule(working_data, self.intervals),
-                        TemporalCouplingModule(working_data, self.intervals),
-                        KnowledgeMapModule(working_data, self.intervals)]
+    def __blank_modules(self, intervals=None):
+        if intervals is None:
+            intervals = self.intervals
+        working_data = FileRecordStore()
+        return [FileInfoModule(working_data, intervals),
+                        BugModule(working_data, intervals),
+                        TemporalCouplingModule(working_data, intervals),
+                        KnowledgeMapModule(working_data, intervals)]
 
-    def __create_modules(self, checkpoint_data_gen):
+    def __create_modules(self, checkpoint_data_gen, intervals=None):
         """
         Instantiates a new instance of each module in self.metrics.modules and populates
         each one with the data from the checkpoint_data
 
         :param checkpoint_data_gen: A generator to a list of checkpoint data caches
         :type checkpoint_data_gen: pymongo.cursor.Cursor
+        :param intervals: The intervals the new modules are scoped to. Defaults
+            to self.intervals
         :return: A new module for each in self.metrics.modules loaded with the checkpoint data
         :rtype: list
         """
-        new_modules = self.__blank_modules()
+        new_modules = self.__blank_modules(intervals)
 
-        for data in checkpoint_data_gen:
+        # The working data is loaded first, as other modules add their records to it
+        checkpoint_data = sorted(checkpoint_data_gen,
+                                 key=lambda data: data['module_key'] != FileInfoModule.MODULE_KEY)
+        for data in checkpoint_data:
             self.log.debug("Creating module <%s> from checkpoint data at date %s",
                             data['module_key'], data['date'])
 
             # Hack to set working data for all modules
             if data['module_key'] == FileInfoModule.MODULE_KEY:
                 self.log.debug("Setting working_data for all modules...")
-                working_data = data['data']['working_data']
+                working_data = FileRecordStore.from_dicts(data['data']['working_data'])
+                data['data']['working_data'] = working_data
                 for mod in new_modules:
                     mod.working_data = working_data
 
@@ -173,8 +422,32 @@ class CirclePackingMetricsStore(object):
 
         return new_modules
 
-    def __save_checkpoint(self, checkpoint_date):
-        self.log.debug("Saving circle packing checkpoint at date %s", checkpoint_date)
+    def __save_checkpoint(self, checkpoint_date, skip_fine_levels=False):
+        """
+        Saves the next checkpoint of the hierarchy at checkpoint_date
+
+        :param skip_fine_levels: If True, the checkpoint is only saved if its level
+            is not finer than self.checkpoint_level
+        """
+        index = self.checkpoint_index
+        level = self.checkpoint_level_of(index)
+        self.checkpoint_index += 1
+        if skip_fine_levels and level > self.checkpoint_level:
+            return
+        self.log.debug("Saving circle packing checkpoint %s (level %s) at date %s",
+                       index, level, checkpoint_date)
+        # Checkpoints are saved between commits, so buffered commits are complete
+        for mod in self.metrics.modules:
+            mod.flush()
+            if isinstance(mod, TemporalCouplingModule) and mod.large_commits:
+                # Large commits are only needed by intervals, so each one is
+                # stored once instead of in every later checkpoint
+                self.db_handler.persist_large_commits(mod.large_commits)
+                mod.large_commits.clear()
         for mod in self.metrics.modules:
-            self.db_handler.persist_packing_data(checkpoint_date, mod.MODULE_KEY,
-                                                mod.persist_mappings())
+            self.checkpoint_bytes[level] += self.db_handler.persist_packing_data(
+                checkpoint_date, mod.MODULE_KEY, mod.persist_mappings(), index=index,
+                level=level)
+        # Levels are dropped while saving, so checkpoints of the levels too fine
+        # for the history so far aren't saved
+        self.__widen_spacing()
@@ -1,16 +1,15 @@
 import logging
 from abc import ABCMeta, abstractmethod, abstractproperty
-import copy
 
 class CirclePackingModule:
     """
     Abstract class for processing files to build metrics for circle packing viz
 
-    :param working_data: A dictionary of dictionaries containing file info. Ex:
+    :param working_data: A FileRecordStore shared by all modules, holding a
+        FileRecord per file with one record per module. Ex:
         "file_name" : {
-            "loc": ...,
-            "bug_score": ...,
-            "creation_date": ...,
+            "file_info": {"loc": ..., "creation_date": ..., ...},
+            "bug_info": {"score": ..., ...},
             ....
         }
 
@@ -24,7 +23,7 @@ class CirclePackingModule:
         pass
 
     @abstractproperty
-    def DEFAULT_DATA(self):
+    def RECORD_CLASS(self):
         pass
 
     @abstractmethod
@@ -43,6 +42,13 @@ class CirclePackingModule:
     def post_process_data(self):
         pass
 
+    def flush(self):
+        """
+        Processes the data buffered by process_file, ie before the module is
+        subtracted from another one
+        """
+        pass
+
     def persist_mappings(self):
         return {}
 
@@ -67,26 +73,20 @@ class CirclePackingModule:
         current_scope = current_file['date']
         return ((current_scope >= start_scope) and (current_scope <= end_scope))
 
-    def get_or_create_key(self, file_name, key=None, default_data=None):
+    def get_or_create_key(self, file_name):
         """
-        Utility method to either create a key for a specific module in working_data
-        or return it if it already exists.
+        Utility method to either create the record of this module for a file in
+        working_data or return it if it already exists.
 
         :param file_name: The filename to lookup in self.working_data
-        :param key: The key name to return or create
-                    (ie self.working_data[file_name][key])
-        :param defaultData: A dictionary containing the default values for key
-                            (ie self.working_data[file_name][key] = defaultData)
 
-        :return self.working_data[file_name][key] (which is a dictionary)
+        :return self.working_data[file_name][self.MODULE_KEY] (a new
+            RECORD_CLASS record if it didn't exist)
         """
-        if key is None:
-            key = self.MODULE_KEY
-        if default_data is None:
-            default_data = self.DEFAULT_DATA
-
-        if file_name not in self.working_data.keys():
-            self.working_data[file_name] = {}
-        if key not in self.working_data[file_name]:
-            self.working_data[file_name][key] = copy.deepcopy(default_data)
-        return self.working_data[file_name][key]
+        file_record = self.working_data.get_or_create(file_name)
+        try:
+            return getattr(file_record, self.MODULE_KEY)
+        except AttributeError:
+            record = self.RECORD_CLASS()
+            setattr(file_record, self.MODULE_KEY, record)
+            return record
@@ -1,17 +1,22 @@
 from codemd.metrics.circle_packing.modules.base import CirclePackingModule
-import re
+from codemd.metrics.circle_packing.records import BugRecord
+from array import array
 import math
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 import pdb
 
 class BugModule(CirclePackingModule):
 
     MODULE_KEY = 'bug_info'
-    DEFAULT_DATA = {'count': 0, 'score': 0, 'opacity': 0, 'bugs': []}
+    RECORD_CLASS = BugRecord
 
     def __init__(self, working_data, intervals):
         CirclePackingModule.__init__(self, working_data, intervals)
-        self.regex = re.compile(r'\b(fix(es|ed)?|close(s|d)?)\b')
 
     def process_file(self, current_file):
         """
@@ -24,7 +29,8 @@ class BugModule(CirclePackingModule):
         if not self.is_file_in_scope(current_file):
             return
 
-        if self.__is_bug(current_file['message']):
+        # Bug fixes are classified at ingest, see BugClassifier
+        if current_file['bug']:
             bug_info['count'] += 1
             bug_info['bugs'].append(current_file['date'])
 
@@ -34,36 +40,89 @@ class BugModule(CirclePackingModule):
         self.log.debug("Computing bug scores...")
         # Add score to each file. Scoring function based on research from Chris
         # Lewis and Rong Ou at Google
+        bug_infos = [self.get_or_create_key(file_name) for file_name in self.working_data]
+        if numpy is not None:
+            scores = self.__vectorized_scores(bug_infos)
+        else:
+            scores = self.__scores(bug_infos)
+
         max_score = 0
+        for bug_info, score in zip(bug_infos, scores):
+            bug_info['score'] += score
+            if bug_info['score'] > max_score:
+                max_score = bug_info['score']
+            # Remove bug dates once we are done using it for computations
+            del bug_info['bugs']
+
+        # Set opacity by normalizing bug scores
+        if max_score != 0:
+            for bug_info in bug_infos:
+                bug_info['opacity'] = bug_info['score']/max_score
+
+        self.log.info("Finished post processing for BugInfoModule")
+
+    def __scores(self, bug_infos):
+        """
+        Returns the bug score of each of bug_infos, one fix date at a time
+        """
         end_date = self.intervals[0][1]
         start_date = self.intervals[0][0]
         time_delta = end_date - start_date
-        for file_name in self.working_data:
-            bug_info = self.get_or_create_key(file_name)
+        scores = []
+        for bug_info in bug_infos:
+            score = 0
             for fix_date in bug_info['bugs']:
                 if time_delta <= 0:
                     norm_time = 1.0
                 else:
                     norm_time = 1 - (float(end_date - fix_date) / (time_delta))
-                bug_info['score'] += 1 / (1 + math.exp(-12 * norm_time + 12))
-                if bug_info['score'] > max_score:
-                    max_score = bug_info['score']
-            # Remove bugs list once we are done using it for computations
-            del bug_info['bugs']
+                score += 1 / (1 + math.exp(-12 * norm_time + 12))
+            scores.append(score)
+        return scores
 
-        # Set opacity by normalizing bug scores
-        if max_score != 0:
-            for file_name in self.working_data:
-                bug_info = self.get_or_create_key(file_name)
-                bug_info['opacity'] = bug_info['score']/max_score
-
-        self.log.info("Finished post processing for BugInfoModule")
-
-    def __is_bug(self, message):
+    def __vectorized_scores(self, bug_infos):
         """
-        DOCSTRING
+        Returns the bug score of each of bug_infos, scoring the fix dates of all
+        files in a single pass with numpy
         """
-        return self.regex.match(message) != None
+        end_date = self.intervals[0][1]
+        start_date = self.intervals[0][0]
+        time_delta = end_date - start_date
+
+        all_dates = array(BugRecord.DATE_TYPE)
+        lengths = []
+        for bug_info in bug_infos:
+            all_dates.extend(bug_info['bugs'])
+            lengths.append(len(bug_info['bugs']))
+        fix_dates = numpy.frombuffer(all_dates.tostring(),
+                                     dtype=numpy.dtype(BugRecord.DATE_TYPE))
+
+        if time_delta <= 0:
+            norm_times = numpy.ones(len(fix_dates))
+        else:
+            norm_times = 1 - (end_date - fix_dates) / float(time_delta)
+        fix_scores = 1 / (1 + numpy.exp(-12 * norm_times + 12))
+        owners = numpy.repeat(numpy.arange(len(bug_infos)), lengths)
+        return numpy.bincount(owners, weights=fix_scores, minlength=len(bug_infos)).tolist()
+
+    def persist_mappings(self):
+        # Only the files with bug fixes, in the shape of working_data
+        return {'bug_records': dict(
+            (file_name, {self.MODULE_KEY: record[self.MODULE_KEY].to_dict()})
+            for file_name, record in self.working_data.iteritems()
+            if self.MODULE_KEY in record and record[self.MODULE_KEY]['count'] != 0)}
+
+    def load_data(self, data):
+        if 'bug_records' not in data:
+            # Checkpoints saved before bug records were stored on their own hold
+            # them in the working_data of FileInfoModule
+            return
+        for record in self.working_data.itervalues():
+            if self.MODULE_KEY in record:
+                del record[self.MODULE_KEY]
+        for file_name, bug_record in data['bug_records'].iteritems():
+            self.working_data.get_or_create(file_name)[self.MODULE_KEY] = \
+                self.RECORD_CLASS.from_dict(bug_record[self.MODULE_KEY])
 
     def subtract_module(self, other):
         self.log.debug("Subtracting bugs module data...")
@@ -78,12 +137,37 @@ class BugModule(CirclePackingModule):
             # Subtract bug counts
             data['count'] -= other_data['count']
             # Subtract all the bug dates
-            for other_bug in other_data['bugs']:
-                # Sanity check TODO -- delete
-                if other_bug not in data['bugs']:
-                    self.log.error("!!! other bug date %s was not in module's own bugs!",
-                                    other_bug)
-                    continue
-                data['bugs'].remove(other_bug)
+            self.__subtract_dates(data['bugs'], other_data['bugs'])
         self.log.debug("Finished subtracting bugs module data")
         return self
+
+    def __subtract_dates(self, dates, other_dates):
+        """
+        Removes other_dates from dates, both sorted in ascending order.
+
+        The subtracted module holds the bugs either before or after some date,
+        so other_dates is a prefix or a suffix of dates and is removed with a
+        slice. Any other sub-sequence falls back to a merge of both arrays.
+        """
+        num_dates = len(other_dates)
+        if num_dates == 0:
+            return
+        if dates[:num_dates] == other_dates:
+            del dates[:num_dates]
+            return
+        if dates[len(dates) - num_dates:] == other_dates:
+            del dates[len(dates) - num_dates:]
+            return
+
+        remaining = array(dates.typecode)
+        i = 0
+        for date in dates:
+            if i < num_dates and other_dates[i] == date:
+                i += 1
+            else:
+                remaining.append(date)
+        # Sanity check TODO -- delete
+        if i < num_dates:
+            self.log.error("!!! other bug dates %s were not in module's own bugs!",
+                           other_dates[i:].tolist())
+        dates[:] = remaining
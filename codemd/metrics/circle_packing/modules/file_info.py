@@ -1,4 +1,6 @@
 from codemd.metrics.circle_packing.modules.base import CirclePackingModule
+from codemd.metrics.circle_packing.modules.bugs import BugModule
+from codemd.metrics.circle_packing.records import FileInfoRecord
 
 class FileInfoModule(CirclePackingModule):
     """
@@ -11,8 +13,8 @@ class FileInfoModule(CirclePackingModule):
 
     MODULE_KEY = 'file_info'
 
-    # Default data for module specific data in working_data
-    DEFAULT_DATA = {'creation_date': None, 'loc': 0, 'total_revisions': 0}
+    # Record of module specific data in working_data
+    RECORD_CLASS = FileInfoRecord
 
      # Minimum number of lines to be considered in circle packing
     LOC_THRESHOLD = 8
@@ -22,10 +24,9 @@ class FileInfoModule(CirclePackingModule):
         self.is_scoped = False
 
     def process_file(self, current_file):
-        default_data = self.DEFAULT_DATA
-        default_data['creation_date'] = current_file['date']
-
-        f = self.get_or_create_key(current_file['filename'], default_data = default_data)
+        f = self.get_or_create_key(current_file['filename'])
+        if f['creation_date'] is None:
+            f['creation_date'] = current_file['date']
         f['loc'] += current_file['insertions'] - current_file['deletions']
         f['total_revisions'] += 1
         f['last_modified'] = current_file['date']
@@ -48,8 +49,11 @@ class FileInfoModule(CirclePackingModule):
 
     def persist_mappings(self):
         # All this modules data is stored in working_data
-        # Also note this module will act as the storer for working_data
-        return  {'working_data': self.working_data}
+        # Also note this module will act as the storer for working_data, except
+        # for the bug records, which BugModule stores so they can be recomputed
+        # on their own (see CirclePackingMetricsStore.reclassify_checkpoints).
+        # The records are encoded as they are, see FileRecordStore.view
+        return  {'working_data': self.working_data.view(exclude=[BugModule.MODULE_KEY])}
 
     def subtract_module(self, other):
         # This module is not scoped to the temporal interval, thus there is no
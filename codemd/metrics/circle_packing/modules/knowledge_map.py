@@ -1,4 +1,5 @@
 from codemd.metrics.circle_packing.modules.base import CirclePackingModule
+from codemd.metrics.circle_packing.records import KnowledgeRecord
 from collections import defaultdict
 
 import pdb
@@ -9,8 +10,7 @@ class KnowledgeMapModule(CirclePackingModule):
     """
 
     MODULE_KEY = "knowledge_info"
-    DEFAULT_DATA = {"author": None, "color": None,
-                    "top_authors": defaultdict(int)}
+    RECORD_CLASS = KnowledgeRecord
 
     # Optimally distinct colors of maximum contrast based on research by Kenneth Kelly
     AUTHOR_COLORS = ['#BE0032', '#F3C300', '#F38400',
@@ -23,11 +23,16 @@ class KnowledgeMapModule(CirclePackingModule):
     def __init__(self, working_data, intervals):
         CirclePackingModule.__init__(self, working_data, intervals)
         self.is_scoped = False
+        # Author names, so the top authors of every file share one string per
+        # author rather than the copy of the modification they were read from
+        self.authors = {}
 
     def process_file(self, current_file):
         knowledge_info = self.get_or_create_key(current_file['filename'])
         num_changes = current_file['insertions'] + current_file['deletions']
-        knowledge_info['top_authors'][current_file['author']] += num_changes
+        top_authors = knowledge_info['top_authors']
+        author = self.authors.setdefault(current_file['author'], current_file['author'])
+        top_authors[author] = top_authors.get(author, 0) + num_changes
 
     def post_process_data(self):
         authors_key = {}
@@ -72,7 +77,8 @@ class KnowledgeMapModule(CirclePackingModule):
         for file_name in self.working_data:
             data = self.get_or_create_key(file_name)
             other_data = other.get_or_create_key(file_name)
-            for author in other_data['top_authors']:
-                data['top_authors'][author] -= other_data['top_authors'][author]
+            top_authors = data['top_authors']
+            for author, churn in other_data['top_authors'].iteritems():
+                top_authors[author] = top_authors.get(author, 0) - churn
         self.log.debug("Finished subtracting knowledge map module data")
         return self
@@ -1,13 +1,20 @@
 from codemd.metrics.circle_packing.modules.base import CirclePackingModule
+from codemd.metrics.circle_packing.records import CouplingRecord
+from codemd.metrics.circle_packing.coupling import SparseCouplingEngine, CoupleSketch, MinHashCoupling
 from collections import defaultdict
 from itertools import combinations
+from operator import itemgetter
+import heapq
 import math
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 import pdb
 import sys
 
-import copy
-
 class TemporalCouplingModule(CirclePackingModule):
     """
     Responsible for handling temporal coupling metrics.
@@ -17,9 +24,7 @@ class TemporalCouplingModule(CirclePackingModule):
 
     MODULE_KEY = 'tc_info'
 
-    DEFAULT_DATA = {'score': 0, 'percent': 0, 'color_opacity': 0,
-                    'coupled_module': None, 'num_revisions': 0,
-                    'num_mutual_revisions': 0, 'color': None}
+    RECORD_CLASS = CouplingRecord
 
     # Module will only report the NUM_TOP_COUPLES highest entries scored by the
     # temporal coupling algorithm
@@ -28,6 +33,27 @@ class TemporalCouplingModule(CirclePackingModule):
     # Ignore commits with more than MAX_COMMIT_SIZE files changed
     MAX_COMMIT_SIZE = 8
 
+    # Count mutual revisions and score couples with SparseCouplingEngine when
+    # numpy and scipy are installed. Enumerating the pairs of every commit in
+    # python is what makes large values of MAX_COMMIT_SIZE prohibitive. Without
+    # a couple sketch, the couples are then kept in the engine as a sparse
+    # matrix of file ids rather than in working_couples.
+    USE_SPARSE_ENGINE = True
+
+    # Estimate mutual revisions with a CoupleSketch of fixed size instead of
+    # counting every couple exactly, when numpy is installed. Only the couples
+    # with the highest counts are then scored.
+    USE_COUPLE_SKETCH = False
+
+    # Keep commits of MAX_COMMIT_SIZE to MINHASH_MAX_COMMIT_SIZE files instead
+    # of ignoring them, and find the couples they contain with MinHashCoupling
+    # when numpy is installed
+    USE_MINHASH = False
+
+    # Ignore commits with more than MINHASH_MAX_COMMIT_SIZE files changed when
+    # USE_MINHASH is set
+    MINHASH_MAX_COMMIT_SIZE = 4096
+
     # Colors to use for cliques
     CLIQUE_COLORS = ['#e31a1c',  '#6a3d9a', '#33a02c', '#0082c8', '#ffe119',
                      '#df57d9', '#6e4c19', '#dbc488', '#000000']
@@ -53,38 +79,19 @@ class TemporalCouplingModule(CirclePackingModule):
         self.working_rev_counts = defaultdict(int) # (file) : # of revisions
         self.commits_buffer = {'commits': [], 'revision_id':None}
         self.num_ignored_commits = 0
-
-    @property
-    def shrunk_working_couples(self):
-        MAX_SIZE = 300000
-        self.log.debug("Building space optimized working_couples with "
-                        + "max size: %s...", MAX_SIZE)
-
-        threshold = 1
-        original_size = len(self.working_couples.keys())
-        shrunk_data = copy.deepcopy(self.working_couples)
-
-        while len(shrunk_data.keys()) >= MAX_SIZE:
-            self.log.debug("data with number of keys <%s> too big, trimming down "
-                            + "with threshold: %s", len(shrunk_data.keys()), threshold)
-            drop_count = 0
-            for couple in shrunk_data.keys():
-                value = shrunk_data[couple]
-                if value <= threshold:
-                    del shrunk_data[couple]
-                    drop_count += 1
-            self.log.debug("Removed %s couples", drop_count)
-            threshold += 1
-
-        self.log.debug("Finished building space optimzed storage with %s keys (%s dropped)",
-                        len(shrunk_data.keys()), original_size - len(shrunk_data.keys()))
-        return shrunk_data
-
-    @shrunk_working_couples.setter
-    def shrunk_working_couples(self, value):
-        self.log.debug("Setting shrunk_working_couples")
-        self.working_couples = value
-
+        self.coupling_engine = None
+        if self.USE_SPARSE_ENGINE and SparseCouplingEngine.available():
+            self.coupling_engine = SparseCouplingEngine()
+        self.couple_sketch = None
+        if self.USE_COUPLE_SKETCH and CoupleSketch.available():
+            self.couple_sketch = CoupleSketch()
+            # The candidate couples and their estimates stand for the couples
+            self.working_couples = self.couple_sketch.candidates
+        # revision id : {'date', 'files'}, for commits left to MinHash. They are
+        # not persisted in checkpoints but stored once by CirclePackingMetricsStore
+        self.large_commits = None
+        if self.USE_MINHASH and MinHashCoupling.available():
+            self.large_commits = {}
 
     def process_file(self, current_file):
         # Set default temporal coupling data
@@ -106,6 +113,7 @@ class TemporalCouplingModule(CirclePackingModule):
 
         # Even if we have a full batch, still need to add a new one
         self.commits_buffer['revision_id'] = current_file['revision_id']
+        self.commits_buffer['date'] = current_file['date']
         self.commits_buffer['commits'].append(current_file['filename'])
 
     def post_process_data(self):
@@ -114,17 +122,62 @@ class TemporalCouplingModule(CirclePackingModule):
         """
         self.log.info("Starting post processing for TemporalModule...")
         # Process batch of files (last commit)
-        self.__process_commits_buffer()
+        self.flush()
         self.log.info("Number of ignored commits: %s", self.num_ignored_commits)
+        if self.large_commits:
+            self.log.info("Finding couples in %s large commits...", len(self.large_commits))
+            couples = MinHashCoupling(commit['files']
+                                      for commit in self.large_commits.itervalues()).couples()
+            if self.__has_couple_matrix():
+                self.coupling_engine.add_couples(couples)
+            else:
+                for couple, count in couples.iteritems():
+                    self.__add_couple(couple, count)
+        if self.couple_sketch is not None:
+            self.couple_sketch.refresh()
+            self.log.info("Estimated mutual revisions of %s candidate couples within %s",
+                          len(self.working_couples), self.couple_sketch.error_bound())
+
+        if self.__has_couple_matrix():
+            scored_couples = self.__score_couple_matrix()
+        elif self.coupling_engine is not None:
+            scored_couples = self.__score_couples_vectorized()
+        else:
+            scored_couples = self.__score_couples()
+
+        self.__augment_working_data(scored_couples)
+
+        self.log.info("Finished post processing for TemporalModule.")
 
-        couples = {}
+    def flush(self):
+        if self.commits_buffer['revision_id'] is not None:
+            self.__process_commits_buffer()
+        if self.__has_couple_matrix():
+            self.coupling_engine.fold()
+        elif self.coupling_engine is not None:
+            self.coupling_engine.fold_couples(self.__add_couple)
+
+    def __has_couple_matrix(self):
+        """
+        Checks if the couples are kept in the matrix of self.coupling_engine
+        rather than in self.working_couples
+        """
+        return self.coupling_engine is not None and self.couple_sketch is None
+
+    def __score_couples(self):
+        """
+        Scores all couples that aren't filtered out
+
+        :return: An unsorted list of (score, couple, # of mutual revisions,
+            average # of revisions) tuples
+        """
+        scored_couples = []
         for pair, count in self.working_couples.iteritems():
             mod1, mod2 = pair[0], pair[1]
             # Ignore files if necessary
             if self.__should_filter_files(mod1, mod2):
                 continue
 
-            module_distance = self.__module_distance(mod1, mod2) + 1
             avg_pair_revs = (self.working_rev_counts[mod1] + self.working_rev_counts[mod2]) / 2.0
 
             if avg_pair_revs == 0:
@@ -134,167 +187,234 @@ class TemporalCouplingModule(CirclePackingModule):
             score = count/avg_pair_revs * math.log((self.working_rev_counts[mod1]
                     + self.working_rev_counts[mod2]))
             if (self.USE_MODULE_DISTANCE):
-                score *= (module_distance/12.0)
-
-            couples[pair] = {'score': score, 'total_mutual_revs' : count,
-                             'avg_revs': avg_pair_revs,
-                             'module_distance': module_distance,
-                             'percent_coupled': count/avg_pair_revs,
-                             mod1: self.working_rev_counts[mod1],
-                             mod2: self.working_rev_counts[mod2]}
+                score *= ((self.__module_distance(mod1, mod2) + 1)/12.0)
 
-        self.log.info("Sorting couples...")
-        sorted_result = sorted(couples.iteritems(), # TODO -- implement partial sorting
-                               key=lambda (k,v): v['score'], reverse=True)
-        self.log.info("Finished sorting couples.")
+            scored_couples.append((score, pair, count, avg_pair_revs))
+        return scored_couples
 
-        self.__augment_working_data(sorted_result)
-
-        self.log.info("Finished post processing for TemporalModule.")
-
-        # FOR DEBUGGING
-        # self.log.debug("Top %s temporal coupling results: %s",
-        #                 self.NUM_TOP_COUPLES,
-        #                 json.dumps(sorted_result[0:self.NUM_TOP_COUPLES], indent=2))
-        # self.log.info("Sorted results: %s", sorted_result[0:self.NUM_TOP_COUPLES])
-        # self.log.debug("all couples: %s", json.dumps(sorted_result, indent=2))
+    def __score_couples_vectorized(self):
+        """
+        Same as __score_couples, with the scores computed by SparseCouplingEngine
+        """
+        pairs, counts = [], []
+        for pair, count in self.working_couples.iteritems():
+            # Ignore files if necessary
+            if not self.__should_filter_files(pair[0], pair[1]):
+                pairs.append(pair)
+                counts.append(count)
+        if len(pairs) == 0:
+            return []
+
+        self.log.info("Scoring %s couples...", len(pairs))
+        rev_counts = self.working_rev_counts
+        weights = None
+        if self.USE_MODULE_DISTANCE:
+            weights = [(self.__module_distance(mod1, mod2) + 1)/12.0 for mod1, mod2 in pairs]
+        scores, avg_revs = SparseCouplingEngine.score_couples(
+            counts, [rev_counts[mod1] for mod1, _ in pairs],
+            [rev_counts[mod2] for _, mod2 in pairs], weights=weights)
+        self.log.info("Finished scoring couples.")
+        return zip(scores, pairs, counts, avg_revs)
+
+    def __score_couple_matrix(self):
+        """
+        Same as __score_couples, for the couples of the matrix of
+        SparseCouplingEngine. Scores are computed over the arrays of file ids,
+        and only the couples which can change working_data are converted to
+        file names: the NUM_TOP_COUPLES highest scored ones, and the highest
+        scored one of every file (see __augment_working_data).
+        """
+        engine = self.coupling_engine
+        firsts, seconds, counts = engine.couple_arrays()
+        if len(counts) == 0:
+            return []
+
+        # Filters on single files are applied to the file ids, before scoring
+        valid_files = numpy.array([self.__is_valid_file(name) for name in engine.file_names],
+                                  dtype=bool)
+        valid = valid_files[firsts] & valid_files[seconds]
+        firsts, seconds, counts = firsts[valid], seconds[valid], counts[valid]
+        if len(counts) == 0:
+            return []
+
+        self.log.info("Scoring %s couples...", len(counts))
+        rev_counts = numpy.array([self.working_rev_counts.get(name, 0)
+                                  for name in engine.file_names])
+        file_names = engine.file_names
+        weights = None
+        if self.USE_MODULE_DISTANCE:
+            weights = [(self.__module_distance(file_names[first], file_names[second]) + 1)/12.0
+                       for first, second in zip(firsts.tolist(), seconds.tolist())]
+        scores, avg_revs = SparseCouplingEngine.score_couples(
+            counts, rev_counts[firsts], rev_counts[seconds], weights=weights)
+        scores, avg_revs = numpy.array(scores), numpy.array(avg_revs)
+
+        # Only the candidate couples are converted to file names and checked
+        # against the filters on pairs of files. Filtered candidates are
+        # dropped, which can make other couples candidates, until every
+        # candidate passes the filters.
+        alive = numpy.ones(len(counts), dtype=bool)
+        checked = numpy.zeros(len(counts), dtype=bool)
+        while True:
+            candidates = self.__candidate_couples(scores, firsts, seconds, alive,
+                                                  len(file_names))
+            unchecked = candidates[~checked[candidates]]
+            if len(unchecked) == 0:
+                break
+            for couple, first, second in zip(unchecked.tolist(), firsts[unchecked].tolist(),
+                                             seconds[unchecked].tolist()):
+                if self.__should_filter_files(*sorted((file_names[first],
+                                                       file_names[second]))):
+                    alive[couple] = False
+            checked[unchecked] = True
+
+        # Same order as a stable sort by decreasing score
+        candidates = candidates[numpy.lexsort((candidates, -scores[candidates]))]
+        scored_couples = [(scores[couple], tuple(sorted((file_names[first], file_names[second]))),
+                           int(counts[couple]), avg_revs[couple])
+                          for couple, first, second in zip(candidates.tolist(),
+                                                           firsts[candidates].tolist(),
+                                                           seconds[candidates].tolist())]
+        self.log.info("Finished scoring couples.")
+        return scored_couples
+
+    def __candidate_couples(self, scores, firsts, seconds, alive, num_files):
+        """
+        Finds the couples of the matrix that can change working_data: the
+        NUM_TOP_COUPLES highest scored ones, and the highest scored one of every
+        file. Ties are broken by the lowest couple index, as a stable sort by
+        decreasing score would.
+
+        :param scores: Array of the scores of the couples
+        :param firsts: Array of the first file ids of the couples
+        :param seconds: Array of the second file ids of the couples
+        :param alive: Boolean array of the couples to consider
+        :param num_files: Number of file ids
+        :return: Sorted array of the indices of the candidate couples
+        """
+        couples = numpy.flatnonzero(alive)
+        alive_scores = scores[couples]
+
+        top = couples
+        if len(couples) > self.NUM_TOP_COUPLES:
+            threshold = numpy.partition(alive_scores,
+                                        len(couples) - self.NUM_TOP_COUPLES)[-self.NUM_TOP_COUPLES]
+            above = couples[alive_scores > threshold]
+            ties = couples[alive_scores == threshold]
+            top = numpy.concatenate((above, ties[:self.NUM_TOP_COUPLES - len(above)]))
+
+        best_scores = numpy.full(num_files, -numpy.inf)
+        best_couples = numpy.full(num_files, len(scores), dtype=numpy.int64)
+        for files in (firsts[couples], seconds[couples]):
+            numpy.maximum.at(best_scores, files, alive_scores)
+        for files in (firsts[couples], seconds[couples]):
+            is_best = alive_scores == best_scores[files]
+            numpy.minimum.at(best_couples, files[is_best], couples[is_best])
+        best = best_couples[best_couples < len(scores)]
+
+        return numpy.union1d(top, best)
 
     def __process_commits_buffer(self):
         """
         Process current files batch in commits buffer
         """
-        if len(self.commits_buffer['commits']) >= self.MAX_COMMIT_SIZE:
-            self.num_ignored_commits += 1
+        commit_size = len(self.commits_buffer['commits'])
+        if commit_size >= self.MAX_COMMIT_SIZE:
+            if self.large_commits is not None and commit_size <= self.MINHASH_MAX_COMMIT_SIZE:
+                self.large_commits[self.commits_buffer['revision_id']] = {
+                    'date': self.commits_buffer['date'], 'files': self.commits_buffer['commits']}
+            else:
+                self.num_ignored_commits += 1
             self.commits_buffer = {'commits': [], 'revision_id':None}
             return
 
         if self.commits_buffer['revision_id'] is not None:
+            if self.coupling_engine is not None:
+                self.coupling_engine.add_commit(self.commits_buffer['commits'])
+                self.commits_buffer = {'commits': [], 'revision_id':None}
+                return
             for pair in combinations(self.commits_buffer['commits'], 2):
                 ordered_pair = sorted(pair)
                 ordered_tuple = (ordered_pair[0], ordered_pair[1])
-                self.working_couples[ordered_tuple] += 1
+                self.__add_couple(ordered_tuple, 1)
 
             self.commits_buffer = {'commits': [], 'revision_id':None}
         else:
             self.log.warning("!!! __process_commits_buffer called on empty commits_buffer")
 
-    def __augment_working_data(self, sorted_couples):
+    def __add_couple(self, couple, count):
+        if self.couple_sketch is not None:
+            self.couple_sketch.add(couple, count)
+        else:
+            self.working_couples[couple] += count
+
+    def __augment_working_data(self, scored_couples):
         """
         Adds temporal coupling data to self.working_data, including a unique color
         parameter for each clique (in an undirected graph, where modules are
         vertices, and 2 coupled modules indicates an edge).
 
-        :param couples: A list of tuples, where first element is a length 2 tuple
-        containing the coupled modules, and the second element is a dictionary
-        containing information about the couple
+        :param scored_couples: A list of (score, couple, # of mutual revisions,
+            average # of revisions) tuples, as returned by __score_couples
         """
         self.log.info("Starting to augment working data with temporal coupling info...")
+        if len(scored_couples) == 0:
+            self.log.info("No couples to augment working data with")
+            return
 
         # Only use top NUM_TOP_COUPLES for circle packing coloring
-        couples = sorted_couples[0:self.NUM_TOP_COUPLES]
-        other_couples = sorted_couples[self.NUM_TOP_COUPLES:]
-        max_score = couples[0][1]['score'] # For normalizing scores to set as opacity values
+        couples = heapq.nlargest(self.NUM_TOP_COUPLES, scored_couples, key=itemgetter(0))
+        max_score = couples[0][0] # For normalizing scores to set as opacity values
 
         def add_temporal_data(couple, color):
             """
             Helper method to add temporal coupling information to self.working_data
             """
-            data = couple[1]
-            for mod in couple[0]:
+            score, pair, count, avg_revs = couple
+            for mod in pair:
                 # Only update data if score is higher than current value
                 tc_info = self.get_or_create_key(mod)
-                if tc_info['score'] < data['score']:
-                    coupled_module = [x for x in couple[0] if x is not mod][0]
-                    tc_info['score'] = data['score']
-                    tc_info['opacity'] = data['score']/max_score
-                    tc_info['coupled_module'] = coupled_module
-                    tc_info['num_revisions'] = data[mod]
-                    tc_info['num_mutual_revisions'] = data['total_mutual_revs']
+                if tc_info['score'] < score:
+                    tc_info['score'] = score
+                    tc_info['opacity'] = score/max_score
+                    tc_info['coupled_module'] = pair[1] if mod == pair[0] else pair[0]
+                    tc_info['num_revisions'] = self.working_rev_counts[mod]
+                    tc_info['num_mutual_revisions'] = count
                     tc_info['color'] = color
-                    tc_info['percent'] = data['percent_coupled']
+                    tc_info['percent'] = count/avg_revs
 
-        def adj_list_from_couples(couples):
-            """
-            Helper method to build an adjacency list from couples
-            """
-            adj_list = defaultdict(set)
-            for coup in couples:
-                mod1, mod2= coup[0][0], coup[0][1]
-                adj_list[mod1].add(mod2)
-                adj_list[mod2].add(mod1)
-            return adj_list
-
-        def cliques_from_adj_list(adj_list):
-            """
-            Helper method to detect cliques from and adjacency list.
+        # Cliques are the connected components of the top couples, tracked with
+        # a union-find structure
+        parents = {}
 
-            :return A list of sets, where each set contains a distinct clique
-            """
-            cliques = [] # list of sets
-            for vertex, neighbors in adj_list.iteritems():
-                # If we already know about this guy, skip him
-                vertex_exists = False
-                for c in cliques:
-                    if vertex in c:
-                        vertex_exists = True
-                        break
-                if vertex_exists:
-                    continue
-                # Iterative DFS
-                stack = list(neighbors)
-                clique = set([vertex])
-                while len(stack) > 0:
-                    current = stack.pop()
-                    clique.add(current)
-                    stack += [v for v in adj_list[current] if v not in clique]
-                cliques.append(clique)
-            return cliques
-
-        # Determine cliques for appropriate coloring in circle packing
-        cliques = cliques_from_adj_list(adj_list_from_couples(couples))
-
-        colors = {} # dict where keys are colors and vals are sets containing modules
-        for c in self.CLIQUE_COLORS:
-            colors[c] = set()
+        def find(vertex):
+            parents.setdefault(vertex, vertex)
+            while parents[vertex] != vertex:
+                parents[vertex] = parents[parents[vertex]]
+                vertex = parents[vertex]
+            return vertex
+
+        for couple in couples:
+            mod1, mod2 = couple[1]
+            parents[find(mod1)] = find(mod2)
 
         # Limit number of cliques to number of clique colors by only picking
         # highest scoring couples
-        for coup in couples:
-            mod1, mod2 = coup[0][0], coup[0][1]
-            clique_found = False
-            for c in colors:
-                if mod1 in colors[c]:
-                    clique_found = True
-                    add_temporal_data(coup, c)
-                    break
-            if not clique_found:
-                empty_color = None
-                for c in self.CLIQUE_COLORS:
-                    if len(colors[c]) == 0:
-                        empty_color = c
-                        break
-                if empty_color is not None:
-                    clique = None
-                    for c in cliques:
-                        if mod1 in c:
-                            clique = c
-                    if clique is None:
-                        self.log.error("!!! Clique not found for node %s!!!\n Cliques: %s", mod1, cliques)
-                    else:
-                        # self.log.debug("Assigning color %s to clique: %s", empty_color, clique)
-                        add_temporal_data(coup, empty_color)
-                        for v in clique:
-                            colors[empty_color].add(v)
+        clique_colors = {} # clique root : color
+        free_colors = list(reversed(self.CLIQUE_COLORS))
+        for couple in couples:
+            clique = find(couple[1][0])
+            if clique not in clique_colors:
+                if len(free_colors) == 0:
+                    continue
+                clique_colors[clique] = free_colors.pop()
+            add_temporal_data(couple, clique_colors[clique])
 
         # Add data for remaining (non colored) couples
-        for coup in other_couples:
-            add_temporal_data(coup, None)
-
-        # DEBUGGING
-        # for c in colors:
-        #     self.log.debug("%s", c)
-        #     for obj in colors[c]:
-        #         self.log.debug("\t%s", obj)
+        top_pairs = set(couple[1] for couple in couples)
+        for couple in scored_couples:
+            if couple[1] not in top_pairs:
+                add_temporal_data(couple, None)
 
         self.log.info("Finished augmenting working data with temporal coupling info")
 
@@ -338,6 +458,16 @@ class TemporalCouplingModule(CirclePackingModule):
             if getattr(self, func_name)(file1, file2): return True
         return False
 
+    def __is_valid_file(self, file_name):
+        """
+        Checks if the couples of file_name can pass __should_filter_files, ie
+        if no filter ignores file_name by itself
+        """
+        if file_name not in self.working_data:
+            return False
+        return not (self.MODULE_FILTERS['__is_unit_test'] and
+                    self.__is_unit_test(file_name, file_name))
+
     def __is_unit_test(self, file1, file2):
         """
         Checks if the string 'test' exists in the file path
@@ -367,21 +497,98 @@ class TemporalCouplingModule(CirclePackingModule):
                or (f1_ext == 'c' and f2_ext == 'h')))
 
     def persist_mappings(self):
-        return {'working_couples': self.shrunk_working_couples,
-                'working_rev_counts': self.working_rev_counts,
-                'num_ignored_commits': self.num_ignored_commits }
+        mappings = {'working_couples': self.working_couples,
+                    'working_rev_counts': self.working_rev_counts,
+                    'num_ignored_commits': self.num_ignored_commits }
+        if self.__has_couple_matrix():
+            del mappings['working_couples']
+            matrix = self.coupling_engine.mappings()
+            mappings['couple_file_ids'] = matrix['file_ids']
+            mappings['couple_firsts'] = matrix['firsts']
+            mappings['couple_seconds'] = matrix['seconds']
+            mappings['couple_counts'] = matrix['counts']
+        if self.couple_sketch is not None:
+            sketch = self.couple_sketch.mappings()
+            mappings['couple_sketch_counts'] = sketch['counts']
+            mappings['couple_sketch_total'] = sketch['total']
+        return mappings
+
+    def load_data(self, data):
+        # Checkpoints saved before they were chunked hold trimmed couples
+        if 'shrunk_working_couples' in data:
+            data['working_couples'] = data.pop('shrunk_working_couples')
+        if 'couple_counts' in data and not self.__has_couple_matrix():
+            data['working_couples'] = self.__couples_from_matrix(data)
+        if 'couple_sketch_counts' in data and self.couple_sketch is None:
+            self.log.warning("Loading estimated couples from a checkpoint saved with "
+                             + "a couple sketch")
+        self.working_rev_counts = data['working_rev_counts']
+        self.num_ignored_commits = data['num_ignored_commits']
+
+        if self.__has_couple_matrix():
+            self.__load_couple_matrix(data)
+            self.working_couples = defaultdict(int)
+            return
+        self.working_couples = data['working_couples']
+        if self.couple_sketch is not None:
+            if 'couple_sketch_counts' in data:
+                self.couple_sketch = CoupleSketch(data['couple_sketch_counts'],
+                                                  self.working_couples,
+                                                  data['couple_sketch_total'])
+            else:
+                self.log.info("Building couple sketch from exact checkpoint couples...")
+                self.couple_sketch = CoupleSketch()
+                for couple, count in self.working_couples.iteritems():
+                    self.couple_sketch.add(couple, count)
+            self.working_couples = self.couple_sketch.candidates
+        elif 'couple_sketch_counts' in data:
+            self.working_couples = defaultdict(int, self.working_couples)
+
+    def __load_couple_matrix(self, data):
+        if 'couple_counts' in data:
+            self.coupling_engine = SparseCouplingEngine.from_mappings(
+                {'file_ids': data.pop('couple_file_ids'), 'firsts': data.pop('couple_firsts'),
+                 'seconds': data.pop('couple_seconds'), 'counts': data.pop('couple_counts')})
+        else:
+            # Checkpoints saved before couples were kept in a matrix
+            self.coupling_engine = SparseCouplingEngine()
+            self.coupling_engine.add_couples(data['working_couples'])
+
+    @staticmethod
+    def __couples_from_matrix(data):
+        file_names = dict((file_id, name) for name, file_id
+                          in data.pop('couple_file_ids').iteritems())
+        couples = defaultdict(int)
+        for first, second, count in zip(data.pop('couple_firsts').tolist(),
+                                        data.pop('couple_seconds').tolist(),
+                                        data.pop('couple_counts').tolist()):
+            couples[tuple(sorted((file_names[first], file_names[second])))] = count
+        return couples
 
     def subtract_module(self, other):
         self.log.debug("Subtracting temporal coupling module data...")
+        self.flush()
+        other.flush()
         self.num_ignored_commits -= other.num_ignored_commits
-        for couple in other.working_couples:
-            if couple in self.working_couples:
-                self.working_couples[couple] -= other.working_couples[couple]
-                if self.working_couples[couple] == 0:
-                    del self.working_couples[couple]
+        if self.couple_sketch is not None:
+            self.couple_sketch.subtract(other.couple_sketch)
+        elif self.__has_couple_matrix():
+            self.coupling_engine.subtract(other.coupling_engine)
+        else:
+            self.__subtract_couples(other)
+        if self.large_commits is not None:
+            for revision_id in other.large_commits:
+                self.large_commits.pop(revision_id, None)
         for file_name in other.working_rev_counts:
             self.working_rev_counts[file_name] -= other.working_rev_counts[file_name]
             if self.working_rev_counts[file_name] == 0:
                 del self.working_rev_counts[file_name]
         self.log.debug("Finished subtracting temporal coupling module data")
         return self
+
+    def __subtract_couples(self, other):
+        for couple in other.working_couples:
+            if couple in self.working_couples:
+                self.working_couples[couple] -= other.working_couples[couple]
+                if self.working_couples[couple] == 0:
+                    del self.working_couples[couple]
@@ -0,0 +1,308 @@
+import logging
+from collections import defaultdict
+from itertools import combinations
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from codemd.metrics.circle_packing.modules.file_info import FileInfoModule
+from codemd.metrics.circle_packing.modules.bugs import BugModule
+from codemd.metrics.circle_packing.modules.knowledge_map import KnowledgeMapModule
+from codemd.metrics.circle_packing.modules.temporal_coupling import TemporalCouplingModule
+from codemd.metrics.circle_packing.coupling import SparseCouplingEngine
+from codemd.metrics.circle_packing.records import (FileInfoRecord, BugRecord, CouplingRecord,
+                                                   KnowledgeRecord)
+
+class PrefixSumEngine(object):
+    """
+    Computes the state of the circle packing modules for any interval from
+    cumulative arrays, without replaying file modifications.
+
+    File modifications are ranked by (date, seq). Every additive metric is then
+    stored in CSR layout: the rows of each segment (a file, a (file, author)
+    pair, or a couple of files) are stored contiguously in rank order, next to
+    the cumulative sums of their values. Segment rows are keyed by
+    segment * num_rows + rank, so the number of rows of every segment before a
+    given rank is found with one vectorized searchsorted over all segments.
+
+    An interval [start, end] maps to the ranks [lo, hi) with two binary searches
+    on the sorted dates, and its metrics are differences of the cumulative sums
+    at lo and hi:
+        - file info (loc, revisions, creation and last modified dates) covers
+          the whole history up to the interval end, like FileInfoModule
+        - bug dates, temporal coupling revision counts, couples and ignored
+          commits cover the interval, like the scoped modules
+        - author churn covers the interval, for every author of the file up to
+          the interval end
+
+    The module states built by load_modules() feed the modules' usual
+    post_process_data(). The engine requires numpy, see available().
+
+    :param data: The arrays built by from_file_history(), ie as loaded from the db
+    """
+
+    def __init__(self, data):
+        self.log = logging.getLogger('codemd.PrefixSumEngine')
+        self.data = data
+        self.num_rows = data['num_rows']
+        self.file_names = data['file_names']
+        self.author_names = data['author_names']
+
+    @classmethod
+    def available(cls):
+        """
+        Checks if the engine can be used, ie if numpy is installed
+        """
+        return numpy is not None
+
+    def is_compatible(self):
+        """
+        Checks if the engine was built with the current module settings
+        """
+        # Commits left to MinHash are ignored by the engine
+        return (self.data['max_commit_size'] == TemporalCouplingModule.MAX_COMMIT_SIZE
+                and not TemporalCouplingModule.USE_MINHASH)
+
+    @classmethod
+    def from_file_history(cls, file_history):
+        """
+        Builds the engine arrays from the file modifications of a project
+
+        :param file_history: File modifications sorted by (date, seq), ie
+            DBHandler.file_history()
+        """
+        log = logging.getLogger('codemd.PrefixSumEngine')
+        file_ids, author_ids = {}, {}
+        dates, files, authors, loc_deltas, churns, bugs = [], [], [], [], [], []
+        commits = [] # (first rank, last rank + 1) of each commit
+        last_revision = None
+        for rank, f in enumerate(file_history):
+            dates.append(f['date'])
+            files.append(file_ids.setdefault(f['filename'], len(file_ids)))
+            authors.append(author_ids.setdefault(f['author'], len(author_ids)))
+            loc_deltas.append(f['insertions'] - f['deletions'])
+            churns.append(f['insertions'] + f['deletions'])
+            bugs.append(f['bug'])
+            if f['revision_id'] != last_revision:
+                commits.append([rank, rank])
+                last_revision = f['revision_id']
+            commits[-1][1] = rank + 1
+        num_rows = len(dates)
+        log.info("Building prefix sums for %s file modifications of %s files...",
+                 num_rows, len(file_ids))
+
+        files = numpy.array(files, dtype=numpy.int64)
+        authors = numpy.array(authors, dtype=numpy.int64)
+        bugs = numpy.array(bugs, dtype=numpy.bool_)
+        ranks = numpy.arange(num_rows, dtype=numpy.int64)
+
+        data = {'num_rows': num_rows,
+                'max_commit_size': TemporalCouplingModule.MAX_COMMIT_SIZE,
+                'file_names': _names(file_ids), 'author_names': _names(author_ids),
+                'dates': numpy.array(dates, dtype=numpy.int64)}
+
+        # Rows of each file, in rank order
+        order = numpy.argsort(files, kind='mergesort')
+        data['file_offsets'] = _offsets(files[order], len(file_ids))
+        data['file_keys'] = files[order] * num_rows + order
+        data['file_cum_loc'] = _segment_cumsum(
+            numpy.array(loc_deltas, dtype=numpy.int64)[order], data['file_offsets'])
+
+        # Bug fixing rows of each file
+        bug_order = order[bugs[order]]
+        data['bug_offsets'] = _offsets(files[bug_order], len(file_ids))
+        data['bug_keys'] = files[bug_order] * num_rows + bug_order
+
+        # Rows of each (file, author) group
+        order = numpy.lexsort((ranks, authors, files))
+        pair_ids = files[order] * max(len(author_ids), 1) + authors[order]
+        is_group_start = numpy.ones(num_rows, dtype=numpy.bool_)
+        is_group_start[1:] = pair_ids[1:] != pair_ids[:-1]
+        starts = numpy.flatnonzero(is_group_start)
+        groups = numpy.cumsum(is_group_start) - 1
+        data['group_offsets'] = numpy.append(starts, num_rows).astype(numpy.int64)
+        data['group_files'] = files[order][starts]
+        data['group_authors'] = authors[order][starts]
+        data['group_keys'] = groups * num_rows + order
+        data['group_cum_churn'] = _segment_cumsum(
+            numpy.array(churns, dtype=numpy.int64)[order], data['group_offsets'])
+
+        # Commits of each couple of files, and ignored commits
+        names = data['file_names']
+        couple_ids, couple_files, couple_ranks, couple_commits = {}, [], [], []
+        ignored_ranks = []
+        for first, last in commits:
+            if last - first >= TemporalCouplingModule.MAX_COMMIT_SIZE:
+                ignored_ranks.append(first)
+                continue
+            for pair in combinations(files[first:last].tolist(), 2):
+                # Couples are ordered by file name, like in TemporalCouplingModule
+                pair = tuple(sorted(pair, key=lambda file_id: names[file_id]))
+                couple_id = couple_ids.get(pair)
+                if couple_id is None:
+                    couple_id = couple_ids[pair] = len(couple_files)
+                    couple_files.append(pair)
+                couple_commits.append(couple_id)
+                couple_ranks.append(first)
+        couple_commits = numpy.array(couple_commits, dtype=numpy.int64)
+        order = numpy.argsort(couple_commits, kind='mergesort')
+        couple_files = numpy.array(couple_files, dtype=numpy.int64).reshape(-1, 2)
+        data['couple_offsets'] = _offsets(couple_commits[order], len(couple_files))
+        data['couple_firsts'] = couple_files[:, 0].copy()
+        data['couple_seconds'] = couple_files[:, 1].copy()
+        data['couple_keys'] = (couple_commits[order] * num_rows
+                               + numpy.array(couple_ranks, dtype=numpy.int64)[order])
+        data['ignored_ranks'] = numpy.array(ignored_ranks, dtype=numpy.int64)
+
+        log.info("Finished building prefix sums with %s couples.", len(couple_files))
+        return cls(data)
+
+    def reclassify(self, bug_flags):
+        """
+        Returns an engine where the bug fixes are replaced by bug_flags, ie after
+        the bug classifier of the project changed. Only the bug fix arrays are
+        rebuilt, from the rows of each file.
+
+        :param bug_flags: The bug flag of every file modification, sorted by
+            (date, seq) like in from_file_history()
+        """
+        data = dict(self.data)
+        bugs = numpy.array(bug_flags, dtype=numpy.bool_)
+        num_rows = max(self.num_rows, 1)
+        bug_keys = data['file_keys'][bugs[data['file_keys'] % num_rows]]
+        data['bug_offsets'] = _offsets(bug_keys // num_rows, len(self.file_names))
+        data['bug_keys'] = bug_keys
+        self.log.info("Reclassified prefix sums with %s bug fixing rows", len(bug_keys))
+        return PrefixSumEngine(data)
+
+    def load_modules(self, modules, interval):
+        """
+        Sets the state of modules to their state after processing the file
+        modifications of interval, ready for post_process_data()
+
+        :param modules: Blank modules sharing the same working_data
+        :param interval: A [start, end] list of dates, in unix epoch
+        """
+        data = self.data
+        start, end = interval
+        lo = numpy.searchsorted(data['dates'], start, side='left')
+        hi = numpy.searchsorted(data['dates'], end, side='right')
+        self.log.debug("Loading modules for interval %s (ranks %s to %s)", interval, lo, hi)
+
+        file_counts_lo = self.__segment_counts('file', lo)
+        file_counts_hi = self.__segment_counts('file', hi)
+        bug_counts_lo = self.__segment_counts('bug', lo)
+        bug_counts_hi = self.__segment_counts('bug', hi)
+        file_starts = data['file_offsets'][:-1]
+        bug_starts = data['bug_offsets'][:-1]
+
+        working_data = modules[0].working_data
+        tc_module = self.__module(modules, TemporalCouplingModule)
+        for file_id in numpy.flatnonzero(file_counts_hi).tolist():
+            first = file_starts[file_id]
+            last = first + file_counts_hi[file_id] - 1
+            record = working_data.get_or_create(self.file_names[file_id])
+            file_info = record[FileInfoModule.MODULE_KEY] = FileInfoRecord(
+                int(data['dates'][data['file_keys'][first] % self.num_rows]))
+            file_info.last_modified = int(data['dates'][data['file_keys'][last] % self.num_rows])
+            file_info.loc = int(data['file_cum_loc'][last])
+            file_info.total_revisions = int(file_counts_hi[file_id])
+            bug_ranks = data['bug_keys'][bug_starts[file_id] + bug_counts_lo[file_id]:
+                                         bug_starts[file_id] + bug_counts_hi[file_id]] % self.num_rows
+            bug_info = record[BugModule.MODULE_KEY] = BugRecord()
+            bug_info.count = len(bug_ranks)
+            bug_info.bugs.extend(data['dates'][bug_ranks].tolist())
+            record[TemporalCouplingModule.MODULE_KEY] = CouplingRecord()
+            record[KnowledgeMapModule.MODULE_KEY] = KnowledgeRecord()
+
+            revisions = int(file_counts_hi[file_id] - file_counts_lo[file_id])
+            if revisions > 0:
+                tc_module.working_rev_counts[self.file_names[file_id]] = revisions
+
+        self.__load_author_churn(working_data, lo, hi)
+        self.__load_couples(tc_module, lo, hi)
+        self.log.debug("Loaded %s files from prefix sums", len(working_data))
+
+    def __load_author_churn(self, working_data, lo, hi):
+        data = self.data
+        group_counts_lo = self.__segment_counts('group', lo)
+        group_counts_hi = self.__segment_counts('group', hi)
+        churn_lo = self.__cumulative_at('group', 'group_cum_churn', group_counts_lo)
+        churn_hi = self.__cumulative_at('group', 'group_cum_churn', group_counts_hi)
+        for group in numpy.flatnonzero(group_counts_hi).tolist():
+            file_name = self.file_names[data['group_files'][group]]
+            author = self.author_names[data['group_authors'][group]]
+            top_authors = working_data[file_name][KnowledgeMapModule.MODULE_KEY]['top_authors']
+            top_authors[author] = int(churn_hi[group] - churn_lo[group])
+
+    def __load_couples(self, tc_module, lo, hi):
+        data = self.data
+        couple_counts = self.__segment_counts('couple', hi) - self.__segment_counts('couple', lo)
+        # Couples are counted exactly, so the module doesn't need to estimate them
+        tc_module.couple_sketch = None
+        tc_module.working_couples = defaultdict(int)
+        couples = numpy.flatnonzero(couple_counts)
+        if tc_module.coupling_engine is not None:
+            # Kept as a matrix of file ids, see SparseCouplingEngine
+            tc_module.coupling_engine = SparseCouplingEngine(
+                self.file_names, data['couple_firsts'][couples],
+                data['couple_seconds'][couples], couple_counts[couples])
+        else:
+            for couple in couples.tolist():
+                pair = (self.file_names[data['couple_firsts'][couple]],
+                        self.file_names[data['couple_seconds'][couple]])
+                tc_module.working_couples[pair] = int(couple_counts[couple])
+        tc_module.num_ignored_commits = int(
+            numpy.searchsorted(data['ignored_ranks'], hi) -
+            numpy.searchsorted(data['ignored_ranks'], lo))
+
+    def __segment_counts(self, segment, rank):
+        """
+        Returns the number of rows before rank of every segment of the given kind
+        """
+        offsets = self.data[segment + '_offsets']
+        num_segments = len(offsets) - 1
+        bounds = numpy.arange(num_segments, dtype=numpy.int64) * self.num_rows + rank
+        return numpy.searchsorted(self.data[segment + '_keys'], bounds) - offsets[:-1]
+
+    def __cumulative_at(self, segment, key, counts):
+        """
+        Returns the cumulative sums of every segment after counts of its rows
+        """
+        starts = self.data[segment + '_offsets'][:-1]
+        cumulative = self.data[key]
+        values = numpy.zeros(len(counts), dtype=cumulative.dtype)
+        nonzero = counts > 0
+        values[nonzero] = cumulative[starts[nonzero] + counts[nonzero] - 1]
+        return values
+
+    @staticmethod
+    def __module(modules, module_class):
+        return [m for m in modules if isinstance(m, module_class)][0]
+
+
+def _names(ids):
+    names = [None] * len(ids)
+    for name, index in ids.iteritems():
+        names[index] = name
+    return names
+
+def _offsets(sorted_segments, num_segments):
+    """
+    Returns the CSR offsets of sorted segment ids
+    """
+    counts = numpy.bincount(sorted_segments, minlength=num_segments)
+    return numpy.append(0, numpy.cumsum(counts)).astype(numpy.int64)
+
+def _segment_cumsum(values, offsets):
+    """
+    Returns the cumulative sums of values, restarting at every segment
+    """
+    cumulative = numpy.cumsum(values)
+    starts = offsets[:-1]
+    before = numpy.zeros(len(starts), dtype=cumulative.dtype)
+    nonempty = starts > 0
+    before[nonempty] = cumulative[starts[nonempty] - 1]
+    return cumulative - numpy.repeat(before, numpy.diff(offsets))
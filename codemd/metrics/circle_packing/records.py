@@ -0,0 +1,217 @@
+from array import array
+
+class Record(object):
+    """
+    Base class of the compact records holding the data of one circle packing
+    module for one file.
+
+    Fields are __slots__, so a record takes a fraction of the memory of a dict.
+    They can be read and written with dict syntax (ie record['loc']), and
+    unset fields behave like missing dict keys. Records are only converted to
+    dicts at the boundaries, see to_dict().
+    """
+    __slots__ = ()
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            raise KeyError(field)
+
+    def __setitem__(self, field, value):
+        setattr(self, field, value)
+
+    def __delitem__(self, field):
+        try:
+            delattr(self, field)
+        except AttributeError:
+            raise KeyError(field)
+
+    def __contains__(self, field):
+        return hasattr(self, field)
+
+    def get(self, field, default=None):
+        return getattr(self, field, default)
+
+    def keys(self):
+        return [field for field in self.__slots__ if hasattr(self, field)]
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.to_dict())
+
+    def to_dict(self):
+        """
+        Returns the set fields of the record as a dict
+        """
+        return dict((field, getattr(self, field)) for field in self.keys())
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Builds a record from a dict returned by to_dict(). Unknown fields are
+        ignored.
+        """
+        record = cls.__new__(cls)
+        for field, value in data.iteritems():
+            if field in cls.__slots__:
+                setattr(record, field, value)
+        return record
+
+
+class FileInfoRecord(Record):
+    __slots__ = ('creation_date', 'loc', 'total_revisions', 'last_modified')
+
+    def __init__(self, creation_date=None):
+        self.creation_date = creation_date
+        self.loc = 0
+        self.total_revisions = 0
+
+
+class BugRecord(Record):
+    __slots__ = ('count', 'score', 'opacity', 'bugs')
+
+    # Typecode of bugs, the typed array of bug fix dates sorted in ascending order
+    DATE_TYPE = 'l'
+
+    def __init__(self):
+        self.count = 0
+        self.score = 0
+        self.opacity = 0
+        self.bugs = array(self.DATE_TYPE)
+
+    def to_dict(self):
+        data = Record.to_dict(self)
+        if 'bugs' in data:
+            data['bugs'] = data['bugs'].tolist()
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        record = super(BugRecord, cls).from_dict(data)
+        if 'bugs' in record:
+            record.bugs = array(cls.DATE_TYPE, record.bugs)
+        return record
+
+
+class CouplingRecord(Record):
+    __slots__ = ('score', 'percent', 'color_opacity', 'coupled_module', 'num_revisions',
+                 'num_mutual_revisions', 'color', 'opacity')
+
+    def __init__(self):
+        self.score = 0
+        self.percent = 0
+        self.color_opacity = 0
+        self.coupled_module = None
+        self.num_revisions = 0
+        self.num_mutual_revisions = 0
+        self.color = None
+
+
+class KnowledgeRecord(Record):
+    __slots__ = ('author', 'color', 'top_authors')
+
+    def __init__(self):
+        self.author = None
+        self.color = None
+        self.top_authors = {}
+
+
+class FileRecord(Record):
+    """
+    The records of every module for one file, keyed by module key
+    """
+    __slots__ = ('file_info', 'bug_info', 'tc_info', 'knowledge_info')
+
+    RECORD_CLASSES = {'file_info': FileInfoRecord, 'bug_info': BugRecord,
+                      'tc_info': CouplingRecord, 'knowledge_info': KnowledgeRecord}
+
+    def to_dict(self, exclude=()):
+        """
+        :param exclude: The module keys of the records to leave out
+        """
+        return dict((key, getattr(self, key).to_dict()) for key in self.keys()
+                    if key not in exclude)
+
+    @classmethod
+    def from_dict(cls, data):
+        record = cls()
+        for key, value in data.iteritems():
+            if key in cls.RECORD_CLASSES:
+                setattr(record, key, cls.RECORD_CLASSES[key].from_dict(value))
+        return record
+
+
+class FileRecordStore(dict):
+    """
+    The working_data shared by the circle packing modules: a dict of file name
+    to FileRecord.
+
+    Only the memory of the records is reduced, by their slots: keys remain the
+    file name strings they were created with, so the store takes as much key
+    memory as a plain dict. File names are not interned to integer ids: the
+    module states (couples, revision counts), the prefix sums and the front
+    end all refer to files by name, and a per-project name table would have
+    to be stored and kept in sync with every checkpoint. The engines counting
+    couples and prefix sums map names to ids on their own, and checkpoints
+    store every name once (see CheckpointCodec). The store holds no state
+    besides its items, so checkpoints and copies of it only hold the records.
+
+    Use to_dicts() to get the {file: {module_key: {field: value}}} shape of
+    the front end. Checkpoints encode the records directly, see view().
+    """
+
+    def get_or_create(self, file_name):
+        """
+        Returns the FileRecord of file_name, creating it if necessary
+        """
+        record = self.get(file_name)
+        if record is None:
+            record = self[file_name] = FileRecord()
+        return record
+
+    def to_dicts(self, exclude=()):
+        """
+        Returns the records as a dict of file name to dicts of module data
+
+        :param exclude: The module keys of the records to leave out
+        """
+        return dict((file_name, record.to_dict(exclude))
+                    for file_name, record in self.iteritems())
+
+    @classmethod
+    def from_dicts(cls, data):
+        """
+        Builds a store from the dict returned by to_dicts()
+        """
+        return cls((file_name, FileRecord.from_dict(record))
+                   for file_name, record in data.iteritems())
+
+    def view(self, exclude=()):
+        """
+        Returns a view of the records, which CheckpointCodec encodes as it
+        would encode to_dicts(exclude) without converting the records to dicts
+
+        :param exclude: The module keys of the records to leave out
+        """
+        return FileRecordStoreView(self, exclude)
+
+
+class FileRecordStoreView(object):
+    """
+    The records of a FileRecordStore, leaving out the records of some modules
+    """
+
+    def __init__(self, store, exclude=()):
+        self.store = store
+        self.exclude = frozenset(exclude)
+
+    def to_dicts(self):
+        return self.store.to_dicts(self.exclude)
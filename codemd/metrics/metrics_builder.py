@@ -1,6 +1,8 @@
-import re
 import logging
 import json
+import threading
+from collections import defaultdict, OrderedDict
+from operator import itemgetter
 from codemd.data_managers.s3_handler import S3Handler
 from codemd.data_managers.db_handler import DBHandler
 
@@ -18,27 +20,39 @@ class MetricsBuilder(object):
     Docstring
     """
 
+    # Number of projects whose parsed full history file tree is kept in memory,
+    # to serve level of detail requests without loading it from S3 again
+    FULL_TREE_CACHE_SIZE = 4
+
+    # Number of interval file trees kept in memory, so the collapsed directories
+    # of a level of detail are expanded without computing the interval again
+    INTERVAL_TREE_CACHE_SIZE = 8
+
+    # Project name : (status update time, full history file tree)
+    __full_trees = OrderedDict()
+    # (project name, intervals) : (status update time, interval file tree)
+    __interval_trees = OrderedDict()
+    __trees_lock = threading.Lock()
+
     def __init__(self, project_name):
         self.project_name = project_name
         self.log = logging.getLogger('codemd.MetricsBuilder')
-        self.regex = re.compile(r'\b(fix(es|ed)?|close(s|d)?)\b')
         self.db_handler = DBHandler(project_name)
 
-    def commits(self):
+    def commits(self, start_date=None, total_insertions=0, total_deletions=0):
         """
         TODO -- Add docstring
         """
         self.log.info("Fetching commits info from db...")
-        cursor = self.db_handler.fetch_commits()
+        cursor = self.db_handler.fetch_commits(start_date=start_date)
         self.log.info("Finished fetching commits. Building revisions list /w appropriate"
                         "metrics...")
 
         docs = []
-        total_insertions, total_deletions = 0, 0
         for doc in cursor:
             total_insertions += doc['insertions']
             total_deletions += doc['deletions']
-            docs.append({'bug': self.is_bug(doc['message']),
+            docs.append({'bug': doc['bug'],
                          'date': doc['date'], 'author': doc['author'],
                          'insertions': doc['insertions'], 'total_insertions': total_insertions,
                          'deletions': doc['deletions'], 'total_deletions': total_deletions })
@@ -52,20 +66,98 @@ class MetricsBuilder(object):
         handler = S3Handler(self.project_name)
         handler.save_dashboard_data(docs)
 
+    def update_commits(self, since_date):
+        """
+        Extends the saved dashboard data with the commits on or after since_date,
+        keeping the already computed rows before it.
+
+        :param since_date: The earliest date (in unix epoch) of the new commits
+        """
+        saved_data = self.load_commits()
+        if saved_data is None:
+            self.log.info("No dashboard data found for project %s, saving all commits...",
+                          self.project_name)
+            self.save_commits()
+            return
+
+        kept_docs = [doc for doc in json.loads(saved_data) if doc['date'] < since_date]
+        total_insertions, total_deletions = 0, 0
+        if len(kept_docs) > 0:
+            total_insertions = kept_docs[-1]['total_insertions']
+            total_deletions = kept_docs[-1]['total_deletions']
+
+        docs = kept_docs + self.commits(start_date=since_date,
+                                        total_insertions=total_insertions,
+                                        total_deletions=total_deletions)
+        self.log.info("Saving updated commits data for project: %s (%s rows kept)",
+                      self.project_name, len(kept_docs))
+        handler = S3Handler(self.project_name)
+        handler.save_dashboard_data(docs)
+
     def load_commits(self):
         handler = S3Handler(self.project_name)
         commits_data = handler.load_dashboard_data()
         return commits_data
 
+    def save_prefix_sums(self):
+        """
+        Saves the prefix sums used to compute circle packing data for any interval
+        """
+        packing_metrics = CirclePackingMetrics(self.project_name)
+        packing_metrics.create_prefix_sums()
+
+    def reclassify_prefix_sums(self):
+        """
+        Updates the bug fixes of the saved prefix sums from the stored bug flags
+        """
+        packing_metrics = CirclePackingMetrics(self.project_name)
+        packing_metrics.reclassify_prefix_sums()
+
     def save_circle_packing_data(self):
         packing_metrics = CirclePackingMetrics(self.project_name)
         packing_metrics.create_checkpoints()
+        self.__save_full_circle_packing(packing_metrics)
+
+    def update_circle_packing_data(self, since_date):
+        """
+        Extends the circle packing checkpoints with the commits on or after
+        since_date and refreshes the saved full history file tree.
+
+        :param since_date: The earliest date (in unix epoch) of the new commits
+        """
+        packing_metrics = CirclePackingMetrics(self.project_name)
+        packing_metrics.update_checkpoints(since_date)
+        self.__save_full_circle_packing(packing_metrics)
+
+    def resume_circle_packing_data(self):
+        """
+        Persists the circle packing checkpoints missing after the latest complete
+        one (ie after an interrupted ingest) and saves the full history file tree.
+        """
+        packing_metrics = CirclePackingMetrics(self.project_name)
+        packing_metrics.resume_checkpoints()
+        self.__save_full_circle_packing(packing_metrics)
+
+    def reclassify_circle_packing_data(self, since_date):
+        """
+        Recomputes the bug records of the circle packing checkpoints on or after
+        since_date from the stored bug flags and refreshes the saved full
+        history file tree.
+
+        :param since_date: The earliest date (in unix epoch) of the commits whose
+            bug flag changed
+        """
+        packing_metrics = CirclePackingMetrics(self.project_name)
+        packing_metrics.reclassify_checkpoints(since_date)
+        self.__save_full_circle_packing(packing_metrics)
+
+    def __save_full_circle_packing(self, packing_metrics):
         full_metrics = packing_metrics.compute_file_hierarchy()[0]
         file_tree = self.__build_filetree(full_metrics)
         handler = S3Handler(self.project_name)
         handler.save_cp_data(file_tree)
 
-    def circle_packing(self, intervals):
+    def circle_packing(self, intervals, max_depth=None, min_loc=None, path=None):
         """
         Calculates temporal frequency, bug score,
         knowledge map, and code age for use in circle packing viz.
@@ -73,14 +165,69 @@ class MetricsBuilder(object):
         All dates are assumed to be in unix epoch format (parse them in the
                                                            view controllers)
 
-        TODO -- params, docstring, refactor, ect
+        If any of max_depth, min_loc or path is specified, only a level of detail
+        of the file tree is returned (see __level_of_detail), so large projects
+        are drawn without sending or laying out every file. Collapsed directories
+        are then expanded by requesting their path, from the tree of the interval
+        kept in memory (see __interval_tree).
+
+        :param max_depth: If specified, the directories this many levels below the
+            root of the returned tree are collapsed
+        :param min_loc: If specified, the directories with fewer lines of code are
+            collapsed
+        :param path: If specified, only the subtree of the directory at this path
+            is returned
+        :returns: The JSON of the file tree, or None if path is not a directory
+
+        TODO -- refactor, ect
         """
+        level_of_detail = (max_depth is not None or min_loc is not None or path is not None)
         if ((intervals is None) or (intervals == [[None, None],[None, None]])):
+            if level_of_detail:
+                file_tree = self.__full_history_tree()
+                if file_tree is None:
+                    return None
+                return self.__level_of_detail_json(file_tree, max_depth, min_loc, path)
             self.log.debug("Full project history requested, loading data from json...")
             handler = S3Handler(self.project_name)
             data = handler.load_cp_data()
             return data
 
+        file_tree = self.__interval_tree(intervals)
+        if level_of_detail:
+            return self.__level_of_detail_json(file_tree, max_depth, min_loc, path)
+        return json.dumps(file_tree)
+
+    def __full_history_tree(self):
+        """
+        Returns the saved full history file tree of the project, from memory if it
+        was loaded since the project status last changed (ie by an ingest)
+        """
+        updated = (DBHandler.ingest_status(self.project_name) or {}).get('updated')
+        file_tree = self.__cached_tree(self.__full_trees, self.project_name, updated)
+        if file_tree is not None:
+            return file_tree
+
+        self.log.debug("Full project history requested, loading data from json...")
+        data = S3Handler(self.project_name).load_cp_data()
+        if data is None:
+            return None
+        file_tree = json.loads(data)
+        self.__cache_tree(self.__full_trees, self.project_name, updated, file_tree,
+                          self.FULL_TREE_CACHE_SIZE)
+        return file_tree
+
+    def __interval_tree(self, intervals):
+        """
+        Returns the file tree of intervals, from memory if it was built since the
+        project status last changed (ie by an ingest or a reclassification)
+        """
+        updated = (DBHandler.ingest_status(self.project_name) or {}).get('updated')
+        key = (self.project_name, tuple(tuple(interval) for interval in intervals))
+        file_tree = self.__cached_tree(self.__interval_trees, key, updated)
+        if file_tree is not None:
+            return file_tree
+
         self.log.debug("Building circle packing metrics with interval: %s", intervals)
 
         packing_metrics = CirclePackingMetrics(self.project_name, intervals)
@@ -89,7 +236,95 @@ class MetricsBuilder(object):
         self.log.debug("Finished circle packing building process...")
 
         # TODO -- handle multiple intervals with build_filetree
-        return json.dumps(self.__build_filetree(file_heirarchy[0]))
+        file_tree = self.__build_filetree(file_heirarchy[0])
+        self.__cache_tree(self.__interval_trees, key, updated, file_tree,
+                          self.INTERVAL_TREE_CACHE_SIZE)
+        return file_tree
+
+    def __cached_tree(self, cache, key, updated):
+        """
+        Returns the file tree of cache at key if it was cached at status update
+        time updated, or None
+        """
+        with self.__trees_lock:
+            cached = cache.get(key)
+            if cached is None or cached[0] != updated:
+                return None
+            cache[key] = cache.pop(key)
+            return cached[1]
+
+    def __cache_tree(self, cache, key, updated, file_tree, cache_size):
+        """
+        Caches file_tree at key, evicting the least recently used trees of cache
+        beyond cache_size
+        """
+        with self.__trees_lock:
+            cache.pop(key, None)
+            cache[key] = (updated, file_tree)
+            while len(cache) > cache_size:
+                cache.popitem(last=False)
+
+    def __level_of_detail_json(self, file_tree, max_depth, min_loc, path):
+        file_tree = self.__level_of_detail(file_tree, max_depth, min_loc, path)
+        if file_tree is None:
+            return None
+        return json.dumps(file_tree)
+
+    def __level_of_detail(self, file_tree, max_depth, min_loc, path, component_delim="/"):
+        """
+        Returns the subtree of file_tree at path (or the whole tree if path is
+        None), with the directories max_depth levels below it or with fewer than
+        min_loc lines of code collapsed into aggregate nodes. A collapsed directory
+        has no children, keeps its 'dir_info' roll-ups, and has 'collapsed' set and
+        the 'path' to request its subtree with. The nodes of file_tree are not
+        modified.
+
+        :returns: The subtree, or None if path is not a directory of file_tree
+        """
+        if 'dir_info' not in file_tree and (max_depth is not None or min_loc is not None):
+            # Trees saved before directories were rolled up can't be collapsed
+            self.log.warning("File tree of project %s has no directory roll-ups, "
+                             + "returning it without collapsing directories",
+                             self.project_name)
+            max_depth, min_loc = None, None
+
+        node = file_tree
+        components = path.split(component_delim) if path else []
+        for component in components:
+            node = next((child for child in node['children'] if child['name'] == component
+                         and self.__is_directory(child)), None)
+            if node is None or node.get('collapsed'):
+                return None
+
+        subtree = self.__collapse(node, path or "", 0, max_depth, min_loc, component_delim)
+        if path:
+            subtree['path'] = path
+        return subtree
+
+    def __collapse(self, node, node_path, depth, max_depth, min_loc, component_delim):
+        children = []
+        for child in node['children']:
+            if not self.__is_directory(child):
+                children.append(child)
+                continue
+            child_path = child['name']
+            if node_path:
+                child_path = node_path + component_delim + child['name']
+            if ((max_depth is not None and depth + 1 >= max_depth)
+                    or (min_loc is not None and child['dir_info']['loc'] < min_loc)):
+                children.append({'name': child['name'], 'children': [],
+                                 'dir_info': child['dir_info'], 'collapsed': True,
+                                 'path': child_path})
+            else:
+                children.append(self.__collapse(child, child_path, depth + 1, max_depth,
+                                                min_loc, component_delim))
+        collapsed_node = dict(node)
+        collapsed_node['children'] = children
+        return collapsed_node
+
+    @staticmethod
+    def __is_directory(node):
+        return FileInfoModule.MODULE_KEY not in node
 
     def __build_filetree(self, files, component_delim="/"):
         """
@@ -99,54 +334,82 @@ class MetricsBuilder(object):
 
         Every node has keys 'name' and 'children'.
         Each leaf i also has whatever properties from files.values()[i]
-        which are specified in the attributes parameter
+        which are specified in the attributes parameter, and each directory (ie
+        every other node, including the root) has a 'dir_info' dictionary rolling
+        up its files:
+            {'loc': <sum of the loc>, 'num_files': <number of files>,
+             'bug_score': <max bug score>, 'top_author': <author with the most
+             changes among the top authors of the files>}
 
-        This algorithm is general enough for any number of nested components. It works
-        by splitting file's name into path components, traversing the tree top-down,
-        keeping a pointer to the current layer, and creating a node for each
-        component that does not exist yet. When it gets to the terminal node
-        (bottom-most layer) it will add the attributes indicated in the attributes parameter
+        The tree is built as a trie in a single pass over the files: each file's
+        name is split into path components, and the directory of each component
+        is found (or created) through a dictionary of the subdirectories of the
+        current directory by name, while adding the file to the roll-ups of every
+        directory on its path. Building the tree is then linear in the number of files,
+        whatever the width of the directories.
 
-        TODO -- Add docstring params and returns
+        :param files: Dictionary of file path to the data of every module
+        :param component_delim: The separator of path components
+        :returns: The root node of the tree
         """
-        tree = []
-        file_tree = {"name": "root", "children":tree}
         attributes = [FileInfoModule.MODULE_KEY, BugModule.MODULE_KEY,
                       TemporalCouplingModule.MODULE_KEY,
                       KnowledgeMapModule.MODULE_KEY]
+        root = self.__new_directory("root")
+        directories = [root]
 
         self.log.debug("Starting object tree algorithm...")
         for filename, file_info in files.iteritems():
             components = filename.split(component_delim)
-            current_node = tree
-            # Traverse through components, building nodes as necessary
-            for component in components:
-                wanted_node = component
-                last_node = current_node
-                for node in current_node:
-                    if node['name'] == wanted_node:
-                        current_node = node['children']
-                        break
-                # If I couldn't find item in list of children, create one
-                if last_node == current_node:
-                    new_node = {'name': wanted_node}
-                    new_node['children'] = []
-                    # If this is the terminal node, add the info. Otherwise add children
-                    if wanted_node == components[-1]:
-                        for attr in attributes:
-                            new_node[attr] = file_info[attr]
-                        current_node.append(new_node)
-                    else:
-                        current_node.append(new_node)
-                        current_node = new_node['children']
+            loc = file_info[FileInfoModule.MODULE_KEY]['loc']
+            bug_score = file_info[BugModule.MODULE_KEY]['score']
+            top_authors = file_info[KnowledgeMapModule.MODULE_KEY]['top_authors']
+
+            directory = root
+            for component in components[:-1]:
+                self.__roll_up(directory, loc, bug_score, top_authors)
+                node, subdirectories, _ = directory
+                subdirectory = subdirectories.get(component)
+                if subdirectory is None:
+                    subdirectory = subdirectories[component] = self.__new_directory(component)
+                    node['children'].append(subdirectory[0])
+                    directories.append(subdirectory)
+                directory = subdirectory
+            self.__roll_up(directory, loc, bug_score, top_authors)
+
+            new_node = {'name': components[-1], 'children': []}
+            for attr in attributes:
+                new_node[attr] = file_info[attr]
+            directory[0]['children'].append(new_node)
+
+        for node, _, author_changes in directories:
+            if len(author_changes) > 0:
+                node['dir_info']['top_author'] = max(author_changes.iteritems(),
+                                                     key=itemgetter(1))[0]
         self.log.debug("Finished building object tree")
         # FOR DEBUGING (verbose af)
         # self.log.debug("Object tree: \n%s ... ", json.dumps(tree[0:2], indent=2))
-        return file_tree
+        return root[0]
 
-    def is_bug(self, message):
+    def __new_directory(self, name):
         """
-        Uses a regular expression to check if commit message indicates a defect
-        was fixed
+        Returns a directory of the tree being built, as a tuple of its node, a
+        dictionary of its subdirectories by name and the changes of the authors
+        of its files
         """
-        return self.regex.match(message) != None
+        node = {'name': name, 'children': [],
+                'dir_info': {'loc': 0, 'num_files': 0, 'bug_score': 0, 'top_author': None}}
+        return node, {}, defaultdict(int)
+
+    def __roll_up(self, directory, loc, bug_score, top_authors):
+        """
+        Adds a file to the roll-ups of a directory of the tree being built
+        """
+        node, _, author_changes = directory
+        dir_info = node['dir_info']
+        dir_info['loc'] += loc
+        dir_info['num_files'] += 1
+        dir_info['bug_score'] = max(dir_info['bug_score'], bug_score)
+        for author, changes in top_authors.iteritems():
+            author_changes[author] += changes
+
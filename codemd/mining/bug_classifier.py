@@ -0,0 +1,86 @@
+import re
+
+class BugClassifier(object):
+    """
+    Decides which commits fix a bug from the words of their commit message.
+
+    Messages are tokenized once when commits are mined: the distinct words of a
+    message are stored in the 'tokens' field of the commit document, and the
+    word it starts with (if any) in 'first_token'. Both fields are indexed, the
+    tokens index being multikey, so together they are an inverted index of the
+    messages. A classifier is then evaluated over every commit of a project with
+    a single indexed query (see query()), without reading any message.
+
+    A commit fixes a bug if its message starts with one of first_tokens, or
+    contains any of tokens. Words are case sensitive. The default classifier
+    matches the messages starting with fix(es|ed) or close(s|d), like the regex
+    \\b(fix(es|ed)?|close(s|d)?)\\b matched at the start of the message.
+
+    The classifier of a project is stored in its status as the dict returned by
+    to_config(), see DBHandler.bug_classifier().
+
+    :param first_tokens: Words a bug fix message can start with. Defaults to
+        DEFAULT_FIRST_TOKENS
+    :param tokens: Words a bug fix message can contain anywhere, ie "bug" or the
+        key of a JIRA project
+    """
+
+    # Words of a commit message. Like \b, \w only matches ascii word characters
+    TOKEN_REGEX = re.compile(r'\w+')
+
+    DEFAULT_FIRST_TOKENS = ['fix', 'fixes', 'fixed', 'close', 'closes', 'closed']
+
+    def __init__(self, first_tokens=None, tokens=None):
+        if first_tokens is None:
+            first_tokens = self.DEFAULT_FIRST_TOKENS
+        if tokens is None:
+            tokens = []
+        self.first_tokens = frozenset(first_tokens)
+        self.tokens = frozenset(tokens)
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Builds a classifier from the dict returned by to_config(), or the default
+        classifier if config is None
+
+        :raises ValueError: If first_tokens or tokens is set and is not a list of
+            strings
+        """
+        if config is None:
+            return cls()
+        for key in ('first_tokens', 'tokens'):
+            words = config.get(key)
+            if words is not None and not (isinstance(words, list) and
+                                          all(isinstance(w, basestring) for w in words)):
+                raise ValueError("%s must be a list of strings, got %r" % (key, words))
+        return cls(config.get('first_tokens'), config.get('tokens'))
+
+    def to_config(self):
+        return {'first_tokens': sorted(self.first_tokens), 'tokens': sorted(self.tokens)}
+
+    @classmethod
+    def tokenize(cls, message):
+        """
+        Returns a tuple (first_token, tokens) where first_token is the word
+        message starts with, or None if it starts with any other character, and
+        tokens the sorted list of the distinct words of message
+        """
+        first_token = cls.TOKEN_REGEX.match(message)
+        if first_token is not None:
+            first_token = first_token.group()
+        return first_token, sorted(set(cls.TOKEN_REGEX.findall(message)))
+
+    def is_bug_fix(self, first_token, tokens):
+        """
+        Checks if the commit message with the given tokens (see tokenize())
+        indicates a defect was fixed
+        """
+        return first_token in self.first_tokens or not self.tokens.isdisjoint(tokens)
+
+    def query(self):
+        """
+        Returns the mongodb filter matching the commit documents which fix a bug
+        """
+        return {'$or': [{'first_token': {'$in': sorted(self.first_tokens)}},
+                        {'tokens': {'$in': sorted(self.tokens)}}]}
@@ -0,0 +1,151 @@
+import logging
+import subprocess
+import tempfile
+
+from git.exc import GitCommandError
+
+class GitLogStream(object):
+    """
+    Iterates over the commits of a local repository by parsing the output of a
+    single long lived `git log --numstat` process, rather than spawning a git
+    process (or diff) per commit. Commits are parsed incrementally as the output
+    is streamed, so memory usage stays flat regardless of the repository size.
+
+    Each commit is yielded as a dictionary:
+        {'revision_id': ..., 'date': ..., 'commiter': ..., 'author': ...,
+         'message': ..., 'files': [(filename, insertions, deletions), ...]}
+
+    Merge commits are skipped, as all their info is contained upstream.
+
+    :param repo_path: Path to the local git repository
+    :param revision: The revision (or revision range) to walk, ie "master" or
+        "<sha>..master"
+    :param paths: Optional list of pathspecs to limit the walk to. Ex: "lib/*"
+    :param revisions: Optional list of commit ids to extract instead of walking
+        revision. The commits are yielded in the given order.
+    :raises git.exc.GitCommandError: Once the output is read, if git failed (ie
+        on an unknown revision)
+    """
+
+    # Control characters delimiting commits and header fields in the log output
+    COMMIT_MARKER = '\x1e'
+    FIELD_SEP = '\x1f'
+
+    # Hash, committer date, committer name, author name and raw message. Every
+    # field is terminated by FIELD_SEP since messages span multiple lines
+    LOG_FORMAT = '%x1e%H%x1f%ct%x1f%cn%x1f%an%x1f%B%x1f'
+    NUM_FIELDS = 5
+
+    def __init__(self, repo_path, revision, paths=None, revisions=None):
+        self.log = logging.getLogger('codemd.GitLogStream')
+        self.repo_path = repo_path
+        self.revision = revision
+        self.paths = paths if paths is not None else []
+        self.revisions = revisions
+
+    def command(self):
+        """
+        Returns the git log command (as an argument list) for this stream
+        """
+        command = ['git', '-c', 'core.quotepath=off', 'log', '--no-merges', '--numstat',
+                   '--format=' + self.LOG_FORMAT]
+        if self.revisions is not None:
+            # Read the commits from stdin and show them as is, without walking
+            command += ['--no-walk=unsorted', '--stdin']
+        else:
+            command.append(self.revision)
+        return command + ['--'] + list(self.paths)
+
+    def __iter__(self):
+        self.log.debug("Starting git log stream: %s", self.command())
+        stdin = subprocess.PIPE if self.revisions is not None else None
+        # Errors go to a file rather than a pipe, which could fill up and block
+        # git while its output is being read
+        stderr = tempfile.TemporaryFile()
+        process = subprocess.Popen(self.command(), cwd=self.repo_path,
+                                   stdin=stdin, stdout=subprocess.PIPE, stderr=stderr)
+        completed = False
+        try:
+            if self.revisions is not None:
+                # git reads all of stdin before producing any output
+                try:
+                    process.stdin.write(
+                        ''.join(rev + '\n' for rev in self.revisions).encode('ascii'))
+                    process.stdin.close()
+                except IOError:
+                    # git exited early, ie on an unknown revision, which its
+                    # exit status reports below
+                    pass
+            for commit in self.parse(iter(process.stdout.readline, b'')):
+                yield commit
+            completed = True
+        finally:
+            process.stdout.close()
+            if not completed and process.poll() is None:
+                # The stream was closed before its end
+                process.kill()
+            process.wait()
+            stderr.seek(0)
+            error = stderr.read()
+            stderr.close()
+        # Reached only when the whole output was read, so a failure (ie a bad
+        # revision, which outputs no commits) isn't mistaken for an empty range
+        if process.returncode != 0:
+            self.log.error("!!! git log exited with status %s: %s", process.returncode,
+                           error.strip())
+            raise GitCommandError(self.command(), process.returncode, error)
+
+    @classmethod
+    def parse(cls, lines):
+        """
+        Parses the lines of a `git log --numstat --format=<LOG_FORMAT>` output
+        into commit dictionaries.
+
+        :param lines: An iterable of raw (byte string) output lines
+        :return: A generator of commit dictionaries
+        """
+        commit, header = None, None
+        for line in lines:
+            line = line.decode('utf-8', 'replace')
+            if line.startswith(cls.COMMIT_MARKER):
+                if commit is not None:
+                    yield commit
+                commit, header = None, line[1:]
+            elif header is not None:
+                header += line
+            elif commit is not None:
+                file_stats = cls.__parse_numstat(line)
+                if file_stats is not None:
+                    commit['files'].append(file_stats)
+                continue
+            else:
+                continue
+
+            # Keep buffering the header until every field was terminated
+            if header.count(cls.FIELD_SEP) >= cls.NUM_FIELDS:
+                commit = cls.__parse_header(header)
+                header = None
+
+        if commit is not None:
+            yield commit
+
+    @classmethod
+    def __parse_header(cls, header):
+        revision_id, date, commiter, author, message = \
+            header.split(cls.FIELD_SEP, cls.NUM_FIELDS)[0:cls.NUM_FIELDS]
+        return {'revision_id': revision_id, 'date': int(date), 'commiter': commiter,
+                'author': author, 'message': message, 'files': []}
+
+    @staticmethod
+    def __parse_numstat(line):
+        """
+        Parses a numstat line ("<insertions>\t<deletions>\t<filename>") into a
+        tuple. Binary files report '-' for both counts, which are treated as 0.
+        """
+        components = line.rstrip('\n').split('\t', 2)
+        if len(components) != 3:
+            return None
+        insertions, deletions, file_name = components
+        insertions = 0 if insertions == '-' else int(insertions)
+        deletions = 0 if deletions == '-' else int(deletions)
+        return (file_name, insertions, deletions)
@@ -0,0 +1,134 @@
+import logging
+import hashlib
+import fcntl
+import shutil
+import os
+from git import Repo
+
+from codemd import app
+from codemd.utils import private_directory
+
+class MirrorCache(object):
+    """
+    Persistent, size bounded store of bare git mirrors keyed by git URL.
+
+    The first ingest of a repository clones a bare mirror (no working tree is
+    checked out, since only commit metadata and numstats are mined), and every
+    repeat ingest runs `git fetch` on the existing mirror instead of cloning again.
+    When the store grows over MAX_SIZE bytes, the least recently used mirrors
+    are evicted.
+
+    Mirrors are guarded by lock files, so a mirror is never evicted or fetched
+    into while another process is mining it. The root directory is private to
+    the user running codemd (see utils.private_directory()), so no other local
+    user can plant a repository or lock file in it.
+
+    :param root: Directory holding the mirrors. Defaults to the DIRECTORY_NAME
+        directory of the DATA_DIR of the app config
+    :param max_size: Maximum total size of the mirrors in bytes. Defaults to MAX_SIZE
+    """
+
+    DIRECTORY_NAME = 'mirrors'
+
+    MAX_SIZE = 20 * 1024 ** 3
+
+    def __init__(self, root=None, max_size=None):
+        self.log = logging.getLogger('codemd.MirrorCache')
+        if root is None:
+            root = os.path.join(app.config['DATA_DIR'], self.DIRECTORY_NAME)
+        self.root = private_directory(root)
+        self.max_size = max_size if max_size is not None else self.MAX_SIZE
+
+    def mirror_path(self, git_url):
+        """
+        Returns the path of the mirror for git_url, ie <root>/<short name>-<url hash>.git
+        """
+        short_name = git_url.rstrip('/').split('/')[-1]
+        if short_name.endswith('.git'):
+            short_name = short_name[0:-4]
+        url_hash = hashlib.sha1(git_url.encode('utf-8')).hexdigest()[0:12]
+        return os.path.join(self.root, short_name + '-' + url_hash + '.git')
+
+    def acquire(self, git_url):
+        """
+        Returns an up to date mirror of git_url, cloning it if it isn't cached yet
+        or fetching new commits otherwise. The mirror stays locked against eviction
+        until the returned lock is passed to release().
+
+        :return: A tuple (repo, lock) with the git.Repo of the mirror and its lock
+        """
+        path = self.mirror_path(git_url)
+        lock = open(path + '.lock', 'a')
+        # Exclusive while cloning/fetching, shared while mining
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if os.path.exists(path):
+                self.log.info("Fetching into cached mirror of %s at %s...", git_url, path)
+                repo = Repo(path)
+                repo.git.fetch('origin', prune=True)
+            else:
+                self.log.info("Cloning mirror of %s into %s...", git_url, path)
+                # Clone next to the final location so a failed clone is never
+                # mistaken for a cached mirror
+                clone_path = path + '.tmp'
+                if os.path.exists(clone_path):
+                    shutil.rmtree(clone_path)
+                Repo.clone_from(git_url, clone_path, mirror=True)
+                os.rename(clone_path, path)
+                repo = Repo(path)
+            # Directory mtime marks the mirror as most recently used
+            os.utime(path, None)
+        except Exception:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            lock.close()
+            raise
+        fcntl.flock(lock, fcntl.LOCK_SH)
+
+        self.evict(keep=path)
+        return repo, lock
+
+    def release(self, lock):
+        """
+        Releases a lock returned by acquire()
+        """
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        lock.close()
+
+    def evict(self, keep=None):
+        """
+        Removes the least recently used mirrors until the total size of the store
+        is under self.max_size. Mirrors locked by other processes are skipped.
+
+        :param keep: Path of a mirror which should never be evicted
+        """
+        mirrors = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.endswith('.git') and os.path.isdir(path):
+                mirrors.append((os.path.getmtime(path), self.__size(path), path))
+        total_size = sum(size for _, size, _ in mirrors)
+
+        for _, size, path in sorted(mirrors):
+            if total_size <= self.max_size:
+                break
+            if path == keep:
+                continue
+            lock = open(path + '.lock', 'a')
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                self.log.debug("Mirror %s is in use, skipping eviction", path)
+                lock.close()
+                continue
+            self.log.info("Evicting mirror %s (%s bytes)", path, size)
+            shutil.rmtree(path)
+            total_size -= size
+            self.release(lock)
+
+    @staticmethod
+    def __size(path):
+        total = 0
+        for dir_path, _, file_names in os.walk(path):
+            for file_name in file_names:
+                total += os.path.getsize(os.path.join(dir_path, file_name))
+        return total
@@ -0,0 +1,61 @@
+import fnmatch
+import os
+import re
+
+class PathFilter(object):
+    """
+    Decides which file paths are included in the extraction, given lists of
+    include and exclude glob patterns (same semantics as fnmatch.fnmatch).
+
+    A path is accepted if it matches none of the exclude patterns, and matches
+    at least one include pattern (or no include patterns were given).
+
+    Each list of patterns is compiled once into a single regular expression, and
+    the decision is cached per distinct path since the same paths recur across
+    thousands of commits.
+
+    :param include_paths: List of file paths to be included. Ex: "module1/*"
+    :param exclude_paths: List of file paths to exclude. Ex: "*.md"
+    """
+
+    def __init__(self, include_paths, exclude_paths):
+        self.include_paths = list(include_paths)
+        self.exclude_paths = list(exclude_paths)
+        self.include_regex = self.__compile(self.include_paths)
+        self.exclude_regex = self.__compile(self.exclude_paths)
+        self.cache = {}
+
+    def accepts(self, path):
+        """
+        Returns True if path should be included in the extraction
+        """
+        accepted = self.cache.get(path)
+        if accepted is None:
+            name = os.path.normcase(path)
+            accepted = (((self.exclude_regex is None) or (self.exclude_regex.match(name) is None))
+                        and ((self.include_regex is None) or (self.include_regex.match(name) is not None)))
+            self.cache[path] = accepted
+        return accepted
+
+    def filter(self, files):
+        """
+        Filters a list of file names, keeping their order
+
+        :param files: List of file names
+        :return: List of accepted file names
+        """
+        return [f for f in files if self.accepts(f)]
+
+    @staticmethod
+    def __compile(patterns):
+        """
+        Combines glob patterns into a single regular expression matching any of
+        them, or returns None if there are no patterns.
+        """
+        if len(patterns) == 0:
+            return None
+        # Python 2 appends the inline flags to each translated pattern, which is
+        # only allowed once at the start of the combined expression
+        regexes = [fnmatch.translate(os.path.normcase(p)).replace('(?ms)', '')
+                   for p in patterns]
+        return re.compile('(?ms)(?:' + '|'.join(regexes) + ')')
@@ -3,9 +3,16 @@ import tempfile
 import sys
 import os
 import shutil
-import fnmatch
+import itertools
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from git import Repo
 from codemd.data_managers.db_handler import DBHandler
+from codemd.mining.log_stream import GitLogStream
+from codemd.mining.path_filter import PathFilter
+from codemd.mining.bug_classifier import BugClassifier
+from codemd.mining.mirror_cache import MirrorCache
 
 # Dictionary of hard-coded paths to include/exclude for known projects
 paths = {"scikit-learn": {"include":["sklearn/*"], "exclude":['README', '*.md', '*.txt', '*.yml']},
@@ -51,9 +58,24 @@ class RepoAnalyser(object):
     :return:
     """
 
+    # Extract commits with a single streamed `git log --numstat` process instead
+    # of GitPython's per commit stats (which spawn a git process per commit)
+    USE_LOG_STREAM = True
+
+    # Number of worker processes mining the history in parallel (log stream only)
+    NUM_WORKERS = multiprocessing.cpu_count()
+
+    # Number of commits mined by a worker process at a time
+    SHARD_SIZE = 1024
+
+    # Mine from a persistent bare mirror (fetched on repeat ingests) instead of
+    # a fresh temporary clone
+    USE_MIRROR_CACHE = True
+
     def __init__(self, git_url, full_name=None, description="", include_paths=[], exclude_paths=[]):
         self.log = logging.getLogger('codemd.RepoAnalyser')
         self.project_name = self.short_name(git_url)
+        self.git_url = git_url
         self.include_paths = include_paths
         self.exclude_paths = exclude_paths
         if full_name is None:
@@ -68,20 +90,29 @@ class RepoAnalyser(object):
             self.exclude_paths = project_paths["exclude"]
 
         self.exclude_paths = list(set(self.exclude_paths + always_exclude))
+        self.path_filter = PathFilter(self.include_paths, self.exclude_paths)
 
-        self.log.info('cloning repository url: %s into a temporary location...', git_url)
         self.log.debug('Included paths: %s', self.include_paths)
         self.log.debug('Excluded paths: %s', self.exclude_paths)
 
-        self.repo_path = tempfile.mkdtemp()
-        self.repo = Repo.clone_from(git_url, self.repo_path)
+        self.mirror_cache, self.mirror_lock = None, None
+        if self.USE_MIRROR_CACHE:
+            self.mirror_cache = MirrorCache()
+            self.repo, self.mirror_lock = self.mirror_cache.acquire(git_url)
+            self.repo_path = self.repo.git_dir
+            # The mirror's HEAD points to the remote's default branch
+            self.branch = self.repo.head.reference.name
+        else:
+            self.log.info('cloning repository url: %s into a temporary location...', git_url)
+            self.repo_path = tempfile.mkdtemp()
+            self.repo = Repo.clone_from(git_url, self.repo_path)
+            # Get local branch name (usually "master" or "develop")
+            self.branch = list(self.repo.branches)[0].name
 
         self.log.info('Repository [%s] instantiated at directory: %s',
                        self.project_name, self.repo_path)
 
-        # Get local branch name (usually "master" or "develop")
         local_branches = list(self.repo.branches)
-        self.branch = local_branches[0].name
 
         self.log.debug('Repository [%s] has local branches: %s\nUsing branch %s',
                       self.project_name, local_branches, self.branch )
@@ -89,10 +120,15 @@ class RepoAnalyser(object):
 
     def __del__(self):
         """
-        On delete, clean up any temporary repositories still hanging around
+        On delete, release the cached mirror or clean up any temporary repositories
+        still hanging around
         :return:
         """
-        if os.path.exists(self.repo_path):
+        # Attributes are missing if __init__ failed before setting them
+        if getattr(self, 'mirror_lock', None) is not None:
+            self.mirror_cache.release(self.mirror_lock)
+            self.mirror_lock = None
+        elif getattr(self, 'repo_path', None) is not None and os.path.exists(self.repo_path):
             shutil.rmtree(self.repo_path)
 
     def persist_meta_data(self):
@@ -103,15 +139,44 @@ class RepoAnalyser(object):
         """
         self.log.info("Persisting meta data for project %s", self.full_name)
         db_handler = DBHandler(self.project_name)
-        db_handler.persist_meta_data(self.full_name, self.description)
+        db_handler.persist_meta_data(self.full_name, self.description, self.git_url)
 
-    def persist_commits_data(self):
+    def persist_commits_data(self, since_revision=None, head_revision=None, resume=False,
+                             progress_callback=None):
         """
         Scans the specified repository, and adds an entry into the
-        <repo short name> collection for each commit.
-
-        :return: List of dictionaries (one element for each commit)
+        <repo short name> collection for each commit. Entries are stamped with
+        head_revision ('ingest_head'), so the commits stored by this run can be
+        found again (see DBHandler.persist_file_modifications).
+
+        :param since_revision: If specified, only commits reachable from the branch
+        but not from since_revision are scanned (ie since_revision..branch)
+        :param head_revision: The revision to scan up to. Defaults to the branch head
+        :param resume: If True, commits already stored (ie by an interrupted run)
+        are skipped
+        :param progress_callback: Optional callable invoked with the number of
+        commits written so far
+        :return: The earliest commit date (unix epoch) among the persisted commits,
+        or None if no commits were persisted
         """
+        self.earliest_date = None
+        if head_revision is None:
+            head_revision = self.head_revision()
+        db_handler = DBHandler(self.project_name)
+        bug_classifier = db_handler.bug_classifier()
+
+        stored_dates = None
+        if resume:
+            stored_dates = db_handler.stored_revision_dates()
+            self.log.info("Resuming commits mining, skipping %s stored commits",
+                          len(stored_dates))
+            if since_revision is not None:
+                # Commits of the range stored by the interrupted run count as new
+                for revision_id in self.range_revisions(since_revision, head_revision):
+                    date = stored_dates.get(revision_id)
+                    if date is not None and (self.earliest_date is None or date < self.earliest_date):
+                        self.earliest_date = date
+
         def gen_commit_docs():
             """
             Define generator so commits do not have to be built in memory.
@@ -121,40 +186,70 @@ class RepoAnalyser(object):
             INCREMENT = 1024
             count = 0
             self.log.info("Starting iteration over commits...")
-            for c in self.commits_iterator():
-                # Ignoring merges, as all the info will be contained in upstream
-                if len(c.parents) > 1:
-                    continue
-
+            for commit_data in self.commit_docs_iterator(since_revision, head_revision,
+                                                         exclude_revisions=stored_dates,
+                                                         bug_classifier=bug_classifier):
                 # DEBUG CODE
                 count += 1
                 if count % INCREMENT == 0:
                     self.log.debug("# Commits processed so far: %s", count)
                 # END DEBUG
 
-                # Filter ignored files. Skip commit if none of the files are relevant
-                files_included = self.__check_file_paths(c.stats.files.keys())
-                if len(files_included) == 0:
-                    continue
-
-                files_modified = []
-                # Build file modifications list (list of dictionaries)
-                for file_name in files_included:
-                    file_mods = c.stats.files[file_name]
-                    files_modified.append({'filename': file_name, \
-                                         'insertions':file_mods['insertions'], \
-                                         'deletions':file_mods['deletions']})
-
-                # Build row which includes high level commit data and files modified
-                revision_id = c.name_rev.split()[0]
-                commit_data = {'revision_id': revision_id, 'date': c.committed_date, \
-                               'commiter': c.committer.name, 'author':c.author.name, \
-                               'message': c.message, 'files_modified': files_modified}
+                if self.earliest_date is None or commit_data['date'] < self.earliest_date:
+                    self.earliest_date = commit_data['date']
 
+                commit_data['ingest_head'] = head_revision
                 yield commit_data
 
-        db_handler = DBHandler(self.project_name)
-        db_handler.persist_documents_from_gen(gen_commit_docs())
+        db_handler.persist_documents_from_gen(gen_commit_docs(),
+                                              progress_callback=progress_callback)
+        db_handler.touch_date_updated(head_revision)
+        return self.earliest_date
+
+    def update_commits_data(self, progress_callback=None):
+        """
+        Incrementally updates an already mined project by scanning only the commits
+        added to the branch since the last stored revision.
+
+        :param progress_callback: Optional callable invoked with the number of
+        commits written so far
+        :return: The earliest commit date (unix epoch) among the new commits, or
+        None if the project is already up to date
+        """
+        since_revision = self.last_mined_revision()
+        self.log.info("Updating project %s from revision %s", self.project_name,
+                      since_revision)
+        earliest_date = self.persist_commits_data(since_revision=since_revision,
+                                                  progress_callback=progress_callback)
+        if earliest_date is None:
+            self.log.info("Project %s is already up to date", self.project_name)
+        return earliest_date
+
+    def head_revision(self):
+        """
+        Returns the revision id of the branch head
+        """
+        return self.repo.commit(self.branch).hexsha
+
+    def last_mined_revision(self):
+        """
+        Returns the revision id of the branch head the stored commits were mined
+        up to
+        """
+        since_revision = DBHandler(self.project_name).head_revision()
+        if since_revision is None:
+            # Projects mined before the head was recorded, fall back to the
+            # latest stored revision
+            since_revision = DBHandler.last_revision(self.project_name)['revision_id']
+        return since_revision
+
+    def range_revisions(self, since_revision=None, head_revision=None):
+        """
+        Returns the ids of the non merge commits in since_revision..head_revision
+        (limited to self.include_paths), newest first
+        """
+        rev_list_args = ['--no-merges', self.__revision_range(since_revision, head_revision), '--']
+        return self.repo.git.rev_list(*(rev_list_args + self.include_paths)).split()
 
 
     @staticmethod
@@ -176,42 +271,182 @@ class RepoAnalyser(object):
         return git_url.split('/')[-1][0:-4]
 
 
-    def commits_iterator(self):
+    def commits_iterator(self, since_revision=None, head_revision=None):
         """
         Return a pointer to iterator self.repo.iter_commits(...)
         This method is necessary because we should only specify the 'path' keyword
         arg if we have values in self.include_paths
+
+        :param since_revision: If specified, iterate over since_revision..branch only
+        :param head_revision: The revision to iterate up to. Defaults to the branch
         """
+        rev = self.__revision_range(since_revision, head_revision)
 
         if (self.include_paths == None or len(self.include_paths) == 0):
-            return self.repo.iter_commits(self.branch, max_count=sys.maxsize)
+            return self.repo.iter_commits(rev, max_count=sys.maxsize)
         else:
-            return self.repo.iter_commits(self.branch, paths=self.include_paths, max_count=sys.maxsize)
+            return self.repo.iter_commits(rev, paths=self.include_paths, max_count=sys.maxsize)
 
-
-    def __check_file_paths(self, files):
+    def commit_stats_iterator(self, since_revision=None, head_revision=None):
         """
-        Internal method to filter a list of file changes by extensions and paths.
-        If a file is NOT in the include path, we treat it as if it's in the ignore
-        path also.
+        Returns an iterator over the non merge commits of the branch, where each
+        commit is a dictionary holding the commit info and a 'files' list of
+        (filename, insertions, deletions) tuples.
 
-        :param files: List of filenames to filter by self.include_paths and self.exclude_paths
-        :return: List of filtered file names
-        """
+        Uses a single streamed `git log --numstat` process when USE_LOG_STREAM is
+        set, otherwise falls back to GitPython's per commit stats.
 
-        filtered_files = []
-        for f in files:
-            exclude_count, include_count = 0, 0
-            for path in self.exclude_paths:
-                if fnmatch.fnmatch(f, path):
-                    exclude_count += 1
-            if len(self.include_paths) == 0:
-                include_count = 1
-            else:
-                for path in self.include_paths:
-                    if fnmatch.fnmatch(f, path):
-                        include_count += 1
-            if exclude_count == 0 and include_count >= 1:
-                filtered_files.append(f)
+        :param since_revision: If specified, iterate over since_revision..branch only
+        :param head_revision: The revision to iterate up to. Defaults to the branch
+        """
+        if self.USE_LOG_STREAM:
+            return GitLogStream(self.repo_path,
+                                self.__revision_range(since_revision, head_revision),
+                                paths=self.include_paths)
+        return self.__gitpython_commit_stats(since_revision, head_revision)
+
+    def __gitpython_commit_stats(self, since_revision, head_revision):
+        for c in self.commits_iterator(since_revision, head_revision):
+            # Ignoring merges, as all the info will be contained in upstream
+            if len(c.parents) > 1:
+                continue
+            files = [(file_name, file_mods['insertions'], file_mods['deletions'])
+                     for file_name, file_mods in c.stats.files.iteritems()]
+            yield {'revision_id': c.name_rev.split()[0], 'date': c.committed_date,
+                   'commiter': c.committer.name, 'author': c.author.name,
+                   'message': c.message, 'files': files}
+
+    def __revision_range(self, since_revision, head_revision=None):
+        if head_revision is None:
+            head_revision = self.branch
+        if since_revision is None:
+            return head_revision
+        return since_revision + ".." + head_revision
+
+
+    def commit_docs_iterator(self, since_revision=None, head_revision=None,
+                             exclude_revisions=None, bug_classifier=None):
+        """
+        Returns an iterator over the commit documents to persist for the branch
+        (or since_revision..branch), skipping commits with no relevant files.
+
+        When using the log stream with more than one worker, the history is split
+        into shards of SHARD_SIZE commits which are mined in parallel by a pool of
+        NUM_WORKERS processes. Documents are yielded in the same order as the
+        serial walk either way.
+
+        :param since_revision: If specified, iterate over since_revision..branch only
+        :param head_revision: The revision to iterate up to. Defaults to the branch
+        :param exclude_revisions: Optional collection of revision ids to skip
+        :param bug_classifier: The BugClassifier of the project. Defaults to a
+            BugClassifier
+        """
+        if self.USE_LOG_STREAM and self.NUM_WORKERS > 1:
+            return self.__parallel_commit_docs(since_revision, head_revision,
+                                               exclude_revisions, bug_classifier)
+        return self.__serial_commit_docs(since_revision, head_revision, exclude_revisions,
+                                         bug_classifier)
+
+    def __serial_commit_docs(self, since_revision, head_revision, exclude_revisions,
+                             bug_classifier):
+        for c in self.commit_stats_iterator(since_revision, head_revision):
+            if exclude_revisions is not None and c['revision_id'] in exclude_revisions:
+                continue
+            commit_data = commit_document(c, self.path_filter, bug_classifier)
+            if commit_data is not None:
+                yield commit_data
 
-        return filtered_files
+    def __parallel_commit_docs(self, since_revision, head_revision, exclude_revisions,
+                               bug_classifier):
+        revisions = self.range_revisions(since_revision, head_revision)
+        if exclude_revisions is not None:
+            revisions = [r for r in revisions if r not in exclude_revisions]
+        shards = [revisions[i:i + self.SHARD_SIZE]
+                  for i in xrange(0, len(revisions), self.SHARD_SIZE)]
+        self.log.info("Mining %s commits in %s shards with %s worker processes...",
+                      len(revisions), len(shards), self.NUM_WORKERS)
+
+        # Only keep a bounded window of shards in flight, so finished shards
+        # don't pile up in memory while the consumer catches up
+        window_size = 2 * self.NUM_WORKERS
+        with ProcessPoolExecutor(max_workers=self.NUM_WORKERS) as executor:
+            pending = deque()
+            shards_iter = iter(shards)
+            for shard in itertools.islice(shards_iter, window_size):
+                pending.append(executor.submit(mine_revisions, self.repo_path, shard,
+                                               self.include_paths, self.exclude_paths,
+                                               bug_classifier))
+            while len(pending) > 0:
+                docs = pending.popleft().result()
+                for shard in itertools.islice(shards_iter, 1):
+                    pending.append(executor.submit(mine_revisions, self.repo_path, shard,
+                                                   self.include_paths, self.exclude_paths,
+                                                   bug_classifier))
+                for commit_data in docs:
+                    yield commit_data
+
+
+def commit_document(commit, path_filter, bug_classifier=None):
+    """
+    Builds the document persisted for a commit, which includes high level commit
+    data, the tokens of its message (see BugClassifier), whether it fixes a bug
+    and the modifications of the included files.
+
+    :param commit: A commit dictionary, as yielded by RepoAnalyser.commit_stats_iterator
+    :param path_filter: The PathFilter deciding which files are included
+    :type path_filter: PathFilter
+    :param bug_classifier: The BugClassifier deciding if the commit fixes a bug.
+        Defaults to a BugClassifier
+    :return: The commit document, or None if none of the files are relevant
+    """
+    # Filter ignored files. Skip commit if none of the files are relevant
+    files_stats = dict((f[0], f) for f in commit['files'])
+    files_included = path_filter.filter([f[0] for f in commit['files']])
+    if len(files_included) == 0:
+        return None
+    if bug_classifier is None:
+        bug_classifier = BugClassifier()
+    first_token, tokens = BugClassifier.tokenize(commit['message'])
+
+    files_modified = []
+    # Build file modifications list (list of dictionaries)
+    for file_name in files_included:
+        file_mods = files_stats[file_name]
+        files_modified.append({'filename': file_name, \
+                             'insertions':file_mods[1], \
+                             'deletions':file_mods[2]})
+
+    return {'revision_id': commit['revision_id'], 'date': commit['date'], \
+            'commiter': commit['commiter'], 'author':commit['author'], \
+            'message': commit['message'], 'files_modified': files_modified, \
+            'first_token': first_token, 'tokens': tokens, \
+            'bug': bug_classifier.is_bug_fix(first_token, tokens)}
+
+
+# Path filters of a mining worker process, keyed by (include paths, exclude paths)
+_worker_path_filters = {}
+
+
+def mine_revisions(repo_path, revisions, include_paths, exclude_paths, bug_classifier=None):
+    """
+    Worker entry point for parallel mining. Extracts the commit documents for a
+    shard of revisions with a GitLogStream. Defined at module level so it can be
+    pickled by the process pool.
+
+    :param repo_path: Path to the local git repository
+    :param revisions: List of commit ids in the shard
+    :param bug_classifier: The BugClassifier of the project
+    :return: List of commit documents, in the order of revisions
+    """
+    # Reuse the worker's path filter across shards so its cache stays warm
+    filter_key = (tuple(include_paths), tuple(exclude_paths))
+    if filter_key not in _worker_path_filters:
+        _worker_path_filters[filter_key] = PathFilter(include_paths, exclude_paths)
+    path_filter = _worker_path_filters[filter_key]
+
+    docs = []
+    for commit in GitLogStream(repo_path, None, paths=include_paths, revisions=revisions):
+        commit_data = commit_document(commit, path_filter, bug_classifier)
+        if commit_data is not None:
+            docs.append(commit_data)
+    return docs
@@ -11,6 +11,11 @@ var PACKING_MODULES = {
 };
 var mode = PACKING_MODULES.KNOWLEDGE_MAP;
 
+// Number of levels of directories requested at a time. Deeper directories come
+// collapsed, and are fetched from subtreeUrl when clicked (see expandNode)
+var MAX_DEPTH = 4;
+var subtreeUrl = null;
+
 var containerWidth = $("#packing-container").width();
 var containerHeight = Math.floor($(window).height() * 0.90);//$("#packing-container").height();
 
@@ -38,7 +43,7 @@ var pack = d3.layout.pack()
   .padding(2)
   .size([innerDiameter, innerDiameter])
   .value(function(d) {
-    return d.file_info.loc;
+    return d.collapsed ? d.dir_info.loc : d.file_info.loc;
   });
 
 var svg = d3.select("#packing-container").append("svg")
@@ -55,6 +60,14 @@ var tip = d3.tip()
   .html(function(d) {
     var baseHTML = "<strong style='font-size:18px'>" + d.name +
                    "</strong><br style='line-height:160%'/>"
+    // Directories come with their totals precomputed by the server
+    if (d.dir_info) {
+      return baseHTML + "<span>Lines of Code: " + d.dir_info.loc + "</span>"
+                      + "</br><span>Files: " + d.dir_info.num_files + "</span>"
+                      + "</br><span>Max Bug Score: </span><span style='color:red'>"
+                      + Math.round(d.dir_info.bug_score*100)/100 + "</span>"
+                      + "</br><span>Top Contributor: " + d.dir_info.top_author + "</span>";
+    }
     switch (mode) {
       case PACKING_MODULES.FILE_INFO:
         // Convert epoch times to dates
@@ -157,48 +170,53 @@ function drawLegend() {
   legendDrawn = true;
 }
 
+// Collapsed directories are drawn as leaves, but colored like directories
+function isDirectory(d) {
+  return d.children || d.collapsed;
+}
+
 function colorCircles() {
   $('#legend').hide();
   switch (mode) {
     case PACKING_MODULES.FILE_INFO:
       svg.selectAll("circle")
         .style("fill", function(d) {
-          return d.children ? color(d.depth) : "WhiteSmoke";
+          return isDirectory(d) ? color(d.depth) : "WhiteSmoke";
         })
         .style("fill-opacity", function(d) {
-          return d.children ? color(d.depth) : 1;
+          return isDirectory(d) ? color(d.depth) : 1;
         });
         break;
     case PACKING_MODULES.BUGS:
       svg.selectAll("circle")
         .style("fill", function(d) {
-          if (d.children) {
+          if (isDirectory(d)) {
             return color(d.depth);
           } else {
             return d.bug_info.score > 0.0 ? "darkred" : "WhiteSmoke";
           }
         })
         .style("fill-opacity", function(d) {
-          return d.children ? 1 : d.bug_info.opacity;
+          return isDirectory(d) ? 1 : d.bug_info.opacity;
         });
         break;
     case PACKING_MODULES.TEMPORAL_COUPLING:
       svg.selectAll("circle")
         .style("fill", function(d) {
-          if (d.children) {
+          if (isDirectory(d)) {
             return color(d.depth);
           } else {
             return d.tc_info.color === null ? "WhiteSmoke" : d3.rgb(d.tc_info.color);
           }
         })
         .style("fill-opacity", function(d) {
-          return d.children ? 1 : d.tc_info.color === null ? 0 : d.tc_info.opacity;
+          return isDirectory(d) ? 1 : d.tc_info.color === null ? 0 : d.tc_info.opacity;
         });
         break;
     case PACKING_MODULES.KNOWLEDGE_MAP:
       svg.selectAll("circle")
         .style("fill", function(d) {
-          if (d.children) {
+          if (isDirectory(d)) {
             return color(d.depth);
           } else {
             if ((d.knowledge_info.color in authorKey) && (authorKey[d.knowledge_info.color] != d.knowledge_info.author)) {
@@ -210,7 +228,7 @@ function colorCircles() {
           }
         })
         .style("fill-opacity", function(d) {
-          return d.children ? color(d.depth) : 1;
+          return isDirectory(d) ? color(d.depth) : 1;
         });
         // Reverse keys and values for D3 legend
         var reversed = {};
@@ -259,6 +277,10 @@ function adjustLabels(k) {
 }
 
 function zoom(d, i) {
+  if (d.collapsed) {
+    expandNode(d);
+    return;
+  }
   // Do not allow leafs to zoom
   if(!d.children) { d = d.parent; }
 
@@ -305,69 +327,97 @@ function zoom(d, i) {
   d3.event.stopPropagation();
 }
 
-function buildViz(requestUrl) {
-  d3.json(requestUrl, function(error, root) {
-    root = JSON.parse(root);
-    packingData = root;
-    focus = root,
-      nodes = pack.nodes(root);
-
-    // DEBUG
-    console.log(root);
-
-    svg.append("g").selectAll("circle")
-      .data(nodes)
-      .enter().append("circle")
-      .attr("class", function(d) {
-        return d.parent ? d.children ? "node" : "node node--leaf" : "node node--root";
-      })
-      .attr("transform", function(d) {
-        return "translate(" + d.x + "," + d.y + ")";
-      })
-      .attr("r", function(d) {
-        return d.r;
-      })
-      .on("click", function(d) {
-        return zoom(focus == d ? root : d);
-      });
-
-    svg.append("g").selectAll("text")
-      .data(nodes)
-      .enter().append("text")
-      .attr("class", "label")
-      .attr("transform", function(d) {
-        return "translate(" + d.x + "," + d.y + ")";
-      })
-      .style("fill-opacity", function(d) {
-        return d.parent === root ? 1 : 0;
-      })
-      .style("display", function(d) {
-        return d.parent === root ? null : "none";
-      })
-      .style("opacity", function(d) {
-        return d.r > 20 ? 1 : 0;
-      })
-      .style("font-weight", function(d) {
-        return d.children ? "bold" : "normal";
-      })
-      .text(function(d) {
-        return d.name;
-      });
-
-    svg.call(tip);
-
-    svg.selectAll(".node--leaf")
-      .on('mouseover', tip.show)
-      .on('mouseout', tip.hide);
-
-    colorCircles(mode);
-    $(".loader-mask").fadeOut(250);
-    $(".loader").fadeOut(500);
+function buildViz(requestUrl, expandUrl) {
+  subtreeUrl = expandUrl;
+  d3.json(requestUrl + "&max_depth=" + MAX_DEPTH, function(error, root) {
+    drawViz(JSON.parse(root));
   });
 
   d3.select(self.frameElement).style("height", outerDiameter + "px");
 }
 
+// Fetches the subtree of a collapsed directory, and redraws the tree with it
+function expandNode(d) {
+  $(".loader-mask").fadeIn(250);
+  $(".loader").fadeIn(250);
+  var url = subtreeUrl + "&max_depth=" + MAX_DEPTH + "&path=" + encodeURIComponent(d.path);
+  d3.json(url, function(error, subtree) {
+    if (error) {
+      // The directory is gone (ie the project was updated since the tree was
+      // drawn): leave it collapsed
+      console.log("Could not expand " + d.path + ": " + error.status + " " + error.statusText);
+      $(".loader-mask").fadeOut(250);
+      $(".loader").fadeOut(500);
+      return;
+    }
+    subtree = JSON.parse(subtree);
+    d.children = subtree.children;
+    delete d.collapsed;
+    tip.hide();
+    drawViz(packingData);
+  });
+  d3.event.stopPropagation();
+}
+
+function drawViz(root) {
+  svg.selectAll("*").remove();
+  packingData = root;
+  focus = root,
+    nodes = pack.nodes(root);
+
+  // DEBUG
+  console.log(root);
+
+  svg.append("g").selectAll("circle")
+    .data(nodes)
+    .enter().append("circle")
+    .attr("class", function(d) {
+      return d.parent ? d.children ? "node" : "node node--leaf" : "node node--root";
+    })
+    .attr("transform", function(d) {
+      return "translate(" + d.x + "," + d.y + ")";
+    })
+    .attr("r", function(d) {
+      return d.r;
+    })
+    .on("click", function(d) {
+      return zoom(focus == d ? root : d);
+    });
+
+  svg.append("g").selectAll("text")
+    .data(nodes)
+    .enter().append("text")
+    .attr("class", "label")
+    .attr("transform", function(d) {
+      return "translate(" + d.x + "," + d.y + ")";
+    })
+    .style("fill-opacity", function(d) {
+      return d.parent === root ? 1 : 0;
+    })
+    .style("display", function(d) {
+      return d.parent === root ? null : "none";
+    })
+    .style("opacity", function(d) {
+      return d.r > 20 ? 1 : 0;
+    })
+    .style("font-weight", function(d) {
+      return d.children ? "bold" : "normal";
+    })
+    .text(function(d) {
+      return d.name;
+    });
+
+  svg.call(tip);
+
+  svg.selectAll(".node--leaf, .node:not(.node--root)")
+    .on('mouseover', tip.show)
+    .on('mouseout', tip.hide);
+
+  colorCircles(mode);
+  $(".loader-mask").fadeOut(250);
+  $(".loader").fadeOut(500);
+}
+
 function bindButtons() {
   $('#temp-coup-btn').on('click', function(e) {
     mode = PACKING_MODULES.TEMPORAL_COUPLING;
@@ -1,3 +1,7 @@
+import errno
+import stat
+import os
+
 def extract_interval_params(request_args):
     """
     Take a url request object and extracts the associated intervals and returns
@@ -15,3 +19,47 @@ def extract_interval_params(request_args):
         intervals[1] = [int(start2), int(end2)]
 
     return intervals
+
+
+def extract_level_of_detail_params(request_args):
+    """
+    Take a url request object and extracts the level of detail of the requested
+    circle packing tree
+
+    params request_args: an instance of request.args
+    return: A list [max_depth, min_loc], where missing values are None
+    """
+    params = []
+    for name in ["max_depth", "min_loc"]:
+        value = request_args.get(name)
+        if value and value != 'null':
+            params.append(int(value))
+        else:
+            params.append(None)
+    return params
+
+
+def private_directory(path):
+    """
+    Creates the directory path (and its parents) readable and writable by the
+    current user only, or checks an existing one is. Files read back from it,
+    ie unpickled, can then only have been planted by the current user.
+
+    params path: Path of the directory
+    return: path
+    raises OSError: If the directory belongs to another user, or other users
+        can write to it
+    """
+    try:
+        os.makedirs(path, 0o700)
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
+    status = os.stat(path)
+    if not stat.S_ISDIR(status.st_mode):
+        raise OSError(errno.ENOTDIR, "Not a directory", path)
+    if status.st_uid != os.getuid():
+        raise OSError(errno.EPERM, "Directory belongs to another user", path)
+    if status.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise OSError(errno.EPERM, "Directory is writable by other users", path)
+    return path
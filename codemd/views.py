@@ -1,15 +1,18 @@
 from codemd import app
 
 from flask import request, session, redirect, url_for, \
-     render_template, jsonify, make_response
+     render_template, jsonify, make_response, Response
 from flask_s3 import create_all
 import logging
 from bson import json_util
 
 from codemd.mining.repo_analyser import RepoAnalyser
+from codemd.mining.bug_classifier import BugClassifier
 from codemd.metrics.metrics_builder import MetricsBuilder
 from codemd.data_managers.db_handler import DBHandler
-from codemd.utils import extract_interval_params
+from codemd.data_managers.job_store import JobStore
+from codemd.jobs.job_manager import JobManager
+from codemd.utils import extract_interval_params, extract_level_of_detail_params
 
 log = logging.getLogger('codemd')
 
@@ -53,9 +56,28 @@ def show_home():
     return render_template('show_home.html', projects_data=projects_data)
 
 
+def migration_job(project_name):
+    """
+    Queues the storage migration of a project ingested by an earlier version,
+    which isn't served until it is migrated (see DBHandler.needs_migration)
+
+    return: The migration job, or None if the project doesn't need one
+    """
+    if not DBHandler.needs_migration(project_name):
+        return None
+    job, created = JobManager.instance().submit_migration(project_name)
+    log.info("Migration job %s for project %s (newly queued: %s)", job['_id'],
+             project_name, created)
+    return job
+
+
 # Main page for circle packing visualizations
 @app.route("/dashboards/<project_name>")
 def show_viz(project_name):
+    job = migration_job(project_name)
+    if job is not None:
+        return redirect(url_for('show_job', job_id = str(job['_id'])))
+
     # TODO -- make below "first visit" checking code DRYer
     has_visited = request.cookies.get(DASHBOARD_VISTED_COOKIE)
     should_show = False
@@ -73,6 +95,10 @@ def show_viz(project_name):
 # Routes for circle packing viz
 @app.route("/circle_packing/<project_name>")
 def circle_packing(project_name):
+    job = migration_job(project_name)
+    if job is not None:
+        return redirect(url_for('show_job', job_id = str(job['_id'])))
+
     intervals = extract_interval_params(request.args)
     log.debug("Getting info for project name: %s\nwith intervals: %s",
               project_name, intervals)
@@ -94,35 +120,77 @@ def circle_packing(project_name):
 # Route to fetch necessary data from github
 @app.route("/fetchdata", methods = ['POST'])
 def fetchdata():
-    # POST from homepage form, extract data if necessary and redirect to viz
+    # POST from homepage form, queue a background job to extract/update the data
     git_url = request.form['inputUrl'] # TODO -- validate git url
     project_name = RepoAnalyser.short_name(git_url)
     full_name = request.form['inputProjectName']
     project_desc = request.form['inputDescription']
 
-    log.debug("url: %s\ninternal name: %s\nfull name: %s\ndesc: %s",
-                    git_url, project_name, full_name, project_desc)
+    job, created = JobManager.instance().submit_ingest(git_url, full_name, project_desc)
+    log.info("Ingest job %s for project %s (newly queued: %s)", job['_id'],
+             project_name, created)
 
-    # Check if we have the data on this repo already, if not clone and extract
-    if not DBHandler.project_exists(project_name):
-        log.info("Data for project " + project_name + " not found. Fetching data...")
-        repo = RepoAnalyser(git_url, full_name=full_name, description=project_desc)
-        repo.persist_commits_data()
-
-        # Save viz/circle packing data for fast loading times
-        metrics = MetricsBuilder(project_name)
-        log.debug("Saving dashboard data...")
-        metrics.save_commits()
-        log.debug("Saving checkpoint data...")
-        metrics.save_circle_packing_data()
-        log.debug("Done saving project data.")
-        log.debug("Persisting meta data.")
-        repo.persist_meta_data()
-        log.debug("Done mining and precomputing project data.")
+    # Ready projects keep being served while they are updated in the background
+    if DBHandler.project_ready(project_name):
+        return redirect(url_for('show_viz', project_name = project_name))
+    return redirect(url_for('show_job', job_id = str(job['_id'])))
+
+
+# Status page of an ingest job, polling it until the project is ready
+@app.route("/jobs/<job_id>")
+def show_job(job_id):
+    job = JobStore().find(job_id)
+    if job is None:
+        return redirect(url_for('show_home'))
+    return render_template("job_status.html", job_id=job_id,
+                           project_name=job['project_name'])
+
+
+# Return the status and progress of an ingest job
+@app.route("/api/jobs/<job_id>")
+def get_job(job_id):
+    job = JobStore().find(job_id)
+    if job is None:
+        return make_response(jsonify({'error': 'Job not found'}), 404)
+    return Response(json_util.dumps(job), mimetype='application/json')
+
+
+# Return the active (or else most recent) ingest job of a project
+@app.route("/api/jobs")
+def get_project_job():
+    project_name = request.args.get('project_name')
+    store = JobStore()
+    job = store.find_active(project_name)
+    if job is None:
+        job = store.find_latest(project_name)
+    if job is None:
+        return make_response(jsonify({'error': 'Job not found'}), 404)
+    return Response(json_util.dumps(job), mimetype='application/json')
+
+
+# Return the bug classifier of a project, or queue a job changing it and
+# recomputing the project's bug data. POSTed as JSON, ie
+# {"project_name": ..., "first_tokens": ["fix", ...], "tokens": ["bug"]}
+@app.route("/api/bug_classifier", methods = ['GET', 'POST'])
+def bug_classifier():
+    if request.method == 'GET':
+        project_name = request.args.get('project_name')
     else:
-        log.info("Data for git project " + project_name + " found.")
+        project_name = request.get_json()['project_name']
+    if not DBHandler.project_exists(project_name):
+        return make_response(jsonify({'error': 'Project not found'}), 404)
+    if request.method == 'GET':
+        return jsonify(DBHandler(project_name).bug_classifier().to_config())
 
-    return redirect(url_for('show_viz', project_name = project_name))
+    try:
+        classifier = BugClassifier.from_config(request.get_json())
+    except ValueError as e:
+        return make_response(jsonify({'error': str(e)}), 400)
+    job, created = JobManager.instance().submit_reclassify(project_name,
+                                                           classifier.to_config())
+    log.info("Reclassify job %s for project %s (newly queued: %s)", job['_id'],
+             project_name, created)
+    return Response(json_util.dumps(job), mimetype='application/json')
 
 
 # Return commits JSON for dashboards
@@ -130,8 +198,9 @@ def fetchdata():
 def get_commits():
     project_name = request.args.get('project_name')
 
-    # Safety check to make sure we have the data in mongo
-    if not DBHandler.project_exists(project_name):
+    # Safety check to make sure we have the complete data in mongo
+    if not DBHandler.project_ready(project_name):
+        migration_job(project_name)
         log.error("Data for project: %s not found. Go to homepage and \
                   enter git repo", project_name)
         return redirect(url_for('show_home'))
@@ -144,23 +213,49 @@ def get_commits():
     return jsonify(commits_data)
 
 
-# Return file tree with scores and complexity for circle_packing viz
+# Return file tree with scores and complexity for circle_packing viz. With
+# max_depth or min_loc, deep or small directories come collapsed (see
+# get_circle_packing_subtree)
 @app.route("/api/circle_packing")
 def get_circle_packing():
     project_name = request.args.get('project_name')
     intervals = extract_interval_params(request.args)
+    max_depth, min_loc = extract_level_of_detail_params(request.args)
 
     log.debug("(in api/circle_packing/...) intervals = " + str(intervals))
 
-    # Safety check to make sure we have the data in mongo
-    if not DBHandler.project_exists(project_name):
+    # Safety check to make sure we have the complete data in mongo
+    if not DBHandler.project_ready(project_name):
+        migration_job(project_name)
         log.error("Data for project: %s not found. Go to homepage and \
                   enter git repo", project_name)
         return redirect(url_for('show_home'))
 
     metrics = MetricsBuilder(project_name)
     #circle_packing_data = json_util.dumps(metrics.circle_packing(intervals))
-    circle_packing_data = metrics.circle_packing(intervals)
+    circle_packing_data = metrics.circle_packing(intervals, max_depth=max_depth,
+                                                 min_loc=min_loc)
 
     # log.info('circle_packing data: %s', circle_packing_data) # DEBUG LINE
     return jsonify(circle_packing_data)
+
+
+# Return the subtree of the directory at path, to expand a collapsed directory
+# of the circle_packing viz for the same interval
+@app.route("/api/circle_packing/subtree")
+def get_circle_packing_subtree():
+    project_name = request.args.get('project_name')
+    path = request.args.get('path')
+    intervals = extract_interval_params(request.args)
+    max_depth, min_loc = extract_level_of_detail_params(request.args)
+
+    if not DBHandler.project_ready(project_name):
+        migration_job(project_name)
+        return make_response(jsonify({'error': 'Project not found'}), 404)
+
+    metrics = MetricsBuilder(project_name)
+    subtree_data = metrics.circle_packing(intervals, max_depth=max_depth, min_loc=min_loc,
+                                          path=path or "")
+    if subtree_data is None:
+        return make_response(jsonify({'error': 'Directory not found'}), 404)
+    return jsonify(subtree_data)
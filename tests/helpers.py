@@ -0,0 +1,102 @@
+"""
+Fixtures shared by the tests of the circle packing modules and metrics
+"""
+import random
+
+from codemd.mining.bug_classifier import BugClassifier
+from codemd.metrics.circle_packing.records import FileRecordStore
+from codemd.metrics.circle_packing.modules.file_info import FileInfoModule
+from codemd.metrics.circle_packing.modules.bugs import BugModule
+from codemd.metrics.circle_packing.modules.knowledge_map import KnowledgeMapModule
+from codemd.metrics.circle_packing.modules.temporal_coupling import TemporalCouplingModule
+
+MODULE_CLASSES = (FileInfoModule, BugModule, TemporalCouplingModule, KnowledgeMapModule)
+
+MESSAGES = ['fixes thing', 'add', 'closed x', 'refactor']
+
+def file_history(num_commits, files, commit_sizes=(1,), date_steps=(1,), start_date=1000,
+                 seed=1):
+    """
+    Returns a synthetic file history, as rows of the modifications collection
+
+    :param num_commits: Number of commits in the history
+    :param files: File names the commits modify
+    :param commit_sizes: Numbers of files a commit can modify
+    :param date_steps: Numbers of days there can be between 2 commits, with
+        0 for commits sharing dates
+    :param start_date: Date of the first commit
+    :param seed: Seed of the random generator
+    """
+    rng = random.Random(seed)
+    classifier = BugClassifier()
+    rows = []
+    date = start_date
+    for commit in xrange(num_commits):
+        message = rng.choice(MESSAGES)
+        author = rng.choice('abcd')
+        for file_name in rng.sample(files, rng.choice(commit_sizes)):
+            rows.append({'date': date, 'seq': len(rows), 'revision_id': 'r%s' % commit,
+                         'filename': file_name, 'insertions': rng.randint(0, 30),
+                         'deletions': rng.randint(0, 10), 'author': author,
+                         'bug': classifier.is_bug_fix(*classifier.tokenize(message))})
+        date += rng.choice(date_steps)
+    return rows
+
+
+def blank_modules(intervals, module_classes=MODULE_CLASSES):
+    """
+    Returns new modules of module_classes sharing a working_data
+    """
+    working_data = FileRecordStore()
+    return [module_class(working_data, intervals) for module_class in module_classes]
+
+
+def replay(rows, intervals, module_classes=MODULE_CLASSES):
+    """
+    Returns new modules of module_classes sharing a working_data, after
+    processing rows
+    """
+    modules = blank_modules(intervals, module_classes)
+    for row in rows:
+        for module in modules:
+            module.process_file(row)
+    for module in modules:
+        if isinstance(module, TemporalCouplingModule):
+            module.flush()
+    return modules
+
+
+def couples(tc):
+    """
+    Returns the couples of a temporal coupling module as {(file1, file2): count}
+    with sorted file names
+    """
+    if tc.coupling_engine is None or tc.couple_sketch is not None:
+        pairs = tc.working_couples.iteritems()
+    else:
+        names = tc.coupling_engine.file_names
+        pairs = (((names[first], names[second]), count) for first, second, count
+                 in zip(*[a.tolist() for a in tc.coupling_engine.couple_arrays()]))
+    return dict((tuple(sorted(pair)), count) for pair, count in pairs if count)
+
+
+def file_hierarchy(seed=1):
+    """
+    Returns the file hierarchy of a synthetic project, as computed by
+    CirclePackingMetrics, with a wide directory and deeply nested ones
+    """
+    rng = random.Random(seed)
+    paths = ['wide/f%s.py' % i for i in xrange(300)] + ['setup.py']
+    for i in xrange(200):
+        depth = rng.randint(1, 7)
+        directories = ['d%s' % rng.randint(0, 3) for _ in xrange(depth)]
+        paths.append('/'.join(directories + ['f%s.py' % i]))
+    result = {}
+    for path in paths:
+        authors = rng.sample('abcdefg', rng.randint(1, 3))
+        result[path] = {'file_info': {'loc': rng.randint(0, 500)},
+                        'bug_info': {'score': rng.random() * rng.choice([0, 1, 10])},
+                        'tc_info': {'score': 0},
+                        'knowledge_info': {'top_authors': dict(
+                            (author, rng.randint(1, 10 ** 6)) for author in authors)}}
+    return result
@@ -0,0 +1,58 @@
+import random
+import re
+import unittest
+
+from codemd.mining.bug_classifier import BugClassifier
+
+# The regex bug fixes were matched with before classifiers
+BUG_REGEX = re.compile(r'\b(fix(es|ed)?|close(s|d)?)\b')
+
+def messages(num_messages, seed=1):
+    """
+    Returns synthetic commit messages, mixing bug fix words with words they
+    prefix or are part of
+    """
+    rng = random.Random(seed)
+    words = ['fix', 'fixes', 'fixed', 'fixing', 'fixture', 'prefix', 'close', 'closes',
+             'closed', 'closer', 'enclosed', 'Fix', 'FIXED', 'bug', 'typo', 'fix_up',
+             'fix2', '2fix', 'x']
+    separators = [' ', ': ', '-', '.', ', ', '(', ')', '#', '\n', '_', "'"]
+    result = ['', 'fix', ' fix', 'fix:', '-fixes', '\nclosed']
+    for i in xrange(num_messages):
+        message = rng.choice(['', '', rng.choice(separators)])
+        for j in xrange(rng.randint(1, 5)):
+            message += rng.choice(words) + rng.choice(separators)
+        result.append(message)
+    return result
+
+
+class BugClassifierTest(unittest.TestCase):
+
+    def test_default_classifier_matches_regex(self):
+        classifier = BugClassifier()
+        for message in messages(2000):
+            self.assertEqual(classifier.is_bug_fix(*classifier.tokenize(message)),
+                             BUG_REGEX.match(message) is not None, message)
+
+    def test_tokens_match_anywhere(self):
+        classifier = BugClassifier(first_tokens=[], tokens=['bug', 'JIRA'])
+        self.assertTrue(classifier.is_bug_fix(*classifier.tokenize('Resolve a bug')))
+        self.assertTrue(classifier.is_bug_fix(*classifier.tokenize('JIRA-12: typo')))
+        self.assertFalse(classifier.is_bug_fix(*classifier.tokenize('debug logs')))
+        self.assertFalse(classifier.is_bug_fix(*classifier.tokenize('fix typo')))
+
+    def test_config_round_trip(self):
+        classifier = BugClassifier(first_tokens=['fix'], tokens=['bug'])
+        config = BugClassifier.from_config(classifier.to_config()).to_config()
+        self.assertEqual(config, {'first_tokens': ['fix'], 'tokens': ['bug']})
+        self.assertEqual(BugClassifier.from_config(None).to_config()['first_tokens'],
+                         sorted(BugClassifier.DEFAULT_FIRST_TOKENS))
+
+    def test_invalid_configs_are_rejected(self):
+        for config in ({'tokens': 'bug'}, {'tokens': ['bug', 1]},
+                       {'first_tokens': {'fix': 1}}, {'first_tokens': [None]}):
+            self.assertRaises(ValueError, BugClassifier.from_config, config)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import math
+import random
+import unittest
+
+import mock
+
+from codemd.metrics.circle_packing.modules import bugs
+from codemd.metrics.circle_packing.modules.bugs import BugModule
+from tests.helpers import file_history, replay
+
+INTERVAL = [[100, 5000]]
+
+def bug_module(rows):
+    return replay(rows, INTERVAL, (BugModule,))[0]
+
+
+def baseline_subtract(bug_dates, other_bug_dates):
+    """
+    The subtraction BugModule replaced, removing the dates one at a time
+    """
+    bug_dates = list(bug_dates)
+    for other_bug in other_bug_dates:
+        bug_dates.remove(other_bug)
+    return bug_dates
+
+
+def baseline_score(bug_dates, intervals=INTERVAL):
+    start_date, end_date = intervals[0]
+    score = 0
+    for fix_date in bug_dates:
+        norm_time = 1 - (float(end_date - fix_date) / (end_date - start_date))
+        score += 1 / (1 + math.exp(-12 * norm_time + 12))
+    return score
+
+
+class BugModuleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = file_history(3000, ['src/f%s.c' % i for i in xrange(51)], start_date=100)
+
+    def assertSubtracted(self, module, other):
+        expected = dict((name, baseline_subtract(module.working_data[name]['bug_info']['bugs'],
+                                                 other.working_data[name]['bug_info']['bugs']))
+                        for name in other.working_data)
+        module.subtract_module(other)
+        for name, bug_dates in expected.iteritems():
+            bug_info = module.working_data[name]['bug_info']
+            self.assertEqual(bug_info['bugs'].tolist(), bug_dates)
+            self.assertEqual(bug_info['count'], len(bug_dates))
+
+    def test_subtract_prefix(self):
+        self.assertSubtracted(bug_module(self.rows), bug_module(self.rows[:1000]))
+
+    def test_subtract_suffix(self):
+        self.assertSubtracted(bug_module(self.rows), bug_module(self.rows[1000:]))
+
+    def test_subtract_any_dates(self):
+        rng = random.Random(2)
+        self.assertSubtracted(bug_module(self.rows),
+                              bug_module([row for row in self.rows if rng.random() < 0.3]))
+
+    def test_scores_match_baseline(self):
+        expected = dict((name, baseline_score(record['bug_info']['bugs']))
+                        for name, record in bug_module(self.rows).working_data.iteritems())
+        for numpy in (bugs.numpy, None):
+            with mock.patch.object(bugs, 'numpy', numpy):
+                module = bug_module(self.rows)
+                module.post_process_data()
+            max_score = max(expected.itervalues())
+            for name, score in expected.iteritems():
+                bug_info = module.working_data[name]['bug_info']
+                self.assertAlmostEqual(bug_info['score'], score)
+                self.assertAlmostEqual(bug_info['opacity'], score / max_score)
+                self.assertNotIn('bugs', bug_info)
+
+
+if __name__ == '__main__':
+    unittest.main()
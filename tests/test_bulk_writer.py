@@ -0,0 +1,43 @@
+import unittest
+
+import mock
+from pymongo.errors import BulkWriteError
+
+from codemd.data_managers.bulk_writer import BulkWriter
+
+class BulkWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.closed = []
+
+    def docs(self, num_docs):
+        try:
+            for i in xrange(num_docs):
+                yield {'i': i}
+        finally:
+            self.closed.append(True)
+
+    def collection(self, fail=False):
+        collection = mock.Mock()
+        if fail:
+            collection.insert_many.side_effect = BulkWriteError(
+                {'nInserted': 0, 'writeErrors': [{'errmsg': 'duplicate key'}]})
+        else:
+            collection.insert_many.side_effect = lambda batch, ordered: mock.Mock(
+                inserted_ids=range(len(batch)))
+        return collection
+
+    def test_writes_every_document(self):
+        for threaded in (True, False):
+            writer = BulkWriter(self.collection(), batch_size=10, threaded=threaded)
+            self.assertEqual(writer.write(self.docs(95)), 95)
+
+    def test_failed_write_closes_documents(self):
+        writer = BulkWriter(self.collection(fail=True), batch_size=10)
+        writer.log = mock.Mock()
+        self.assertRaises(BulkWriteError, writer.write, self.docs(10 ** 6))
+        self.assertEqual(self.closed, [True])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import json
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from collections import defaultdict
+
+import mock
+import numpy
+
+from codemd.data_managers.checkpoint_cache import CheckpointCache
+from codemd.data_managers.checkpoint_codec import CheckpointCodec
+
+MAPPINGS = {'couples': defaultdict(int, {('a.py', 'b.py'): 3, ('a.py', 'c.py'): 1}),
+            'revisions': defaultdict(int, {'a.py': 4, 'b.py': 3})}
+
+@unittest.skipUnless(CheckpointCache.available(), "requires numpy")
+class CheckpointCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.cache = CheckpointCache(root=self.root)
+        self.data = CheckpointCodec.encode(MAPPINGS)
+
+    def store(self, date, module_key='tc', token='t1'):
+        self.cache.store('codemd', date, module_key, token, self.data)
+        return self.cache.path('codemd', date, module_key, token)
+
+    def test_round_trip(self):
+        self.store(100)
+        self.assertEqual(self.cache.load('codemd', 100, 'tc', 't1'), MAPPINGS)
+        self.assertIsNone(self.cache.load('codemd', 100, 'tc', 't2'))
+
+    def test_truncated_files_are_misses(self):
+        path = self.store(100)
+        with open(path, 'rb') as cache_file:
+            contents = cache_file.read()
+        for size in (0, 4, 20, len(contents) - 1):
+            with open(path, 'wb') as cache_file:
+                cache_file.write(contents[:size])
+            self.assertIsNone(self.cache.load('codemd', 100, 'tc', 't1'))
+
+    def test_corrupt_files_are_misses(self):
+        path = self.store(100)
+        with open(path, 'r+b') as cache_file:
+            cache_file.seek(24)
+            cache_file.write('\xff' * 16)
+        self.assertIsNone(self.cache.load('codemd', 100, 'tc', 't1'))
+        self.assertFalse(os.path.exists(path))
+
+    def test_remove_dates(self):
+        self.store(100)
+        kept = self.store(200)
+        self.cache.remove('codemd', [100, 300])
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'codemd', '100')))
+        self.assertTrue(os.path.exists(kept))
+
+    def test_evicts_least_recently_used(self):
+        oldest = self.store(100)
+        os.utime(oldest, (0, 0))
+        newer = self.store(200)
+        # Room for two files once evicted
+        self.cache.max_size = int(os.path.getsize(newer) * 2 / CheckpointCache.EVICTION_TARGET) + 1
+        newest = self.store(300)
+        self.assertFalse(os.path.exists(oldest))
+        self.assertTrue(os.path.exists(newer))
+        self.assertTrue(os.path.exists(newest))
+
+
+    def test_running_size(self):
+        first = self.store(100)
+        self.cache.evict()
+        size = os.path.getsize(first)
+        self.assertEqual(self.cache.size, size)
+        self.store(100, token='t2')
+        # The stale version was replaced
+        self.assertEqual(self.cache.size, size)
+        self.store(200)
+        self.assertEqual(self.cache.size, 2 * size)
+        self.cache.remove('codemd', [100])
+        self.assertEqual(self.cache.size, size)
+        with mock.patch('os.walk') as walk:
+            self.store(300)
+            self.assertFalse(walk.called)
+
+    def test_header_is_json(self):
+        path = self.store(100)
+        with open(path, 'rb') as cache_file:
+            magic, header_size = struct.unpack(CheckpointCache.HEADER_FORMAT, cache_file.read(
+                struct.calcsize(CheckpointCache.HEADER_FORMAT)))
+            header = json.loads(cache_file.read(header_size))
+        self.assertEqual(magic, CheckpointCache.MAGIC)
+        self.assertIn('d', header)
+
+    def test_python_objects_round_trip(self):
+        mappings = {'objects': {'a': [(1, 2.5), u'\xe9', '\xff', None, True],
+                                3: defaultdict(list, {'b': [1]})},
+                    'arrays': numpy.arange(5)}
+        self.cache.store('codemd', 100, 'other', 't1', CheckpointCodec.encode(mappings))
+        loaded = self.cache.load('codemd', 100, 'other', 't1')
+        self.assertEqual(loaded['objects'], mappings['objects'])
+        self.assertIs(type(loaded['objects'][3]), defaultdict)
+        self.assertEqual(loaded['arrays'].tolist(), range(5))
+
+    def test_unsupported_values_are_not_cached(self):
+        data = CheckpointCodec.encode({'value': set([1])})
+        self.assertFalse(self.cache.store('codemd', 100, 'other', 't1', data))
+        self.assertIsNone(self.cache.load('codemd', 100, 'other', 't1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
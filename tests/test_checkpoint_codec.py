@@ -0,0 +1,84 @@
+import pickle
+import random
+import unittest
+from collections import defaultdict
+
+import numpy
+
+from codemd.data_managers.checkpoint_codec import CheckpointCodec
+from codemd.metrics.circle_packing.records import FileRecordStore
+
+class CheckpointCodecTest(unittest.TestCase):
+
+    def setUp(self):
+        rand = random.Random(1)
+        self.files = [u'src/dir%d/file%d.py' % (i % 7, i) for i in range(200)] + ['str/name.py']
+        self.working_data = {}
+        for name in self.files:
+            top_authors = defaultdict(int)
+            top_authors[u'alice'] += 3
+            top_authors['bob'] += rand.randint(1, 9)
+            self.working_data[name] = {
+                'file_info': {'creation_date': rand.randint(0, 10 ** 6), 'loc': rand.randint(-5, 900),
+                              'total_revisions': 4, 'last_modified': 12345},
+                'bug_info': {'count': 2, 'score': 0.5, 'bugs': [1, 2, 3][:rand.randint(0, 3)]},
+                'tc_info': {'coupled_module': rand.choice([None, self.files[0]]), 'color': None},
+                'knowledge_info': {'author': None, 'top_authors': top_authors}}
+        del self.working_data[self.files[0]]['tc_info']
+        del self.working_data[self.files[1]]['file_info']['loc']
+        self.couples = defaultdict(int)
+        for _ in range(2000):
+            self.couples[(rand.choice(self.files), rand.choice(self.files))] += 1
+        self.rev_counts = defaultdict(int)
+        self.rev_counts[self.files[3]] = 5
+
+    def assertRoundTrip(self, mappings):
+        decoded = CheckpointCodec.decode(CheckpointCodec.encode(mappings))
+        # The baseline checkpoints were pickled mappings
+        self.assertEqual(decoded, pickle.loads(pickle.dumps(mappings, 2)))
+        for key, value in mappings.iteritems():
+            self.assertIs(type(decoded[key]), type(value))
+        return decoded
+
+    def test_records(self):
+        decoded = self.assertRoundTrip({'working_data': self.working_data})['working_data']
+        top_authors = decoded[self.files[2]]['knowledge_info']['top_authors']
+        self.assertIs(type(top_authors), defaultdict)
+        self.assertEqual(sorted((a, type(a)) for a in top_authors),
+                         [(u'alice', unicode), ('bob', str)])
+
+    def test_record_stores(self):
+        store = FileRecordStore.from_dicts(self.working_data)
+        for exclude in ((), ['bug_info'], ['bug_info', 'tc_info']):
+            encoded = CheckpointCodec.encode({'working_data': store.view(exclude)})
+            self.assertEqual(CheckpointCodec.decode(encoded)['working_data'],
+                             store.to_dicts(exclude))
+        decoded = CheckpointCodec.decode(CheckpointCodec.encode({'working_data': store}))
+        self.assertEqual(decoded['working_data'], self.working_data)
+        empty = CheckpointCodec.encode({'working_data': FileRecordStore().view(['bug_info'])})
+        self.assertEqual(CheckpointCodec.decode(empty), {'working_data': {}})
+
+    def test_pairs_and_counters(self):
+        self.assertRoundTrip({'working_couples': self.couples,
+                              'working_rev_counts': self.rev_counts,
+                              'num_ignored_commits': 7})
+
+    def test_ndarrays_and_objects(self):
+        self.assertRoundTrip({'x': defaultdict(list), 'empty': {}, 'name': 'project',
+                                        'mixed': {'a': 1, 'b': 'c'}})
+        self.assertEqual(CheckpointCodec.decode(CheckpointCodec.encode({})), {})
+        counts = numpy.arange(10, dtype=numpy.int32)
+        decoded = CheckpointCodec.decode(CheckpointCodec.encode({'counts': counts}))['counts']
+        self.assertEqual(decoded.dtype, counts.dtype)
+        self.assertEqual(decoded.tolist(), counts.tolist())
+
+    def test_mapped_arrays_decode(self):
+        mappings = {'working_data': self.working_data, 'working_couples': self.couples,
+                    'working_rev_counts': self.rev_counts}
+        payload = CheckpointCodec.load_payload(CheckpointCodec.encode(mappings))
+        CheckpointCodec.map_arrays(payload, lambda data: numpy.frombuffer(data, numpy.uint8))
+        self.assertEqual(CheckpointCodec.decode_payload(payload), mappings)
+
+
+if __name__ == '__main__':
+    unittest.main()
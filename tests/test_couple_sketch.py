@@ -0,0 +1,104 @@
+import random
+import unittest
+from collections import defaultdict
+
+import mock
+
+from codemd.metrics.circle_packing.coupling import CoupleSketch
+
+def couple_stream(num_couples, seed=1):
+    """
+    Returns a synthetic stream of couples, with skewed frequencies like the
+    couples of a project history
+    """
+    rng = random.Random(seed)
+    files = ['src/d%s/f%s.py' % (i % 13, i) for i in xrange(400)]
+    stream = []
+    for _ in xrange(num_couples):
+        first = files[min(int(rng.paretovariate(1.2)) - 1, len(files) - 1)]
+        second = rng.choice(files)
+        if first != second:
+            stream.append(tuple(sorted((first, second))))
+    return stream
+
+
+def exact_counts(stream):
+    counts = defaultdict(int)
+    for couple in stream:
+        counts[couple] += 1
+    return counts
+
+
+@unittest.skipUnless(CoupleSketch.available(), "requires numpy")
+class CoupleSketchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = couple_stream(50000)
+
+    def sketch_of(self, stream):
+        sketch = CoupleSketch()
+        for couple in stream:
+            sketch.add(couple)
+        return sketch
+
+    def assertWithinBound(self, sketch, counts):
+        bound = sketch.error_bound()
+        for couple, count in counts.iteritems():
+            estimate = sketch.estimate(couple)
+            self.assertGreaterEqual(estimate, count)
+            self.assertLessEqual(estimate - count, bound)
+
+    def test_estimates_within_error_bound(self):
+        sketch = self.sketch_of(self.stream)
+        self.assertEqual(sketch.total, len(self.stream))
+        self.assertLessEqual(sketch.error_bound(), CoupleSketch.ERROR_RATE * sketch.total)
+        self.assertWithinBound(sketch, exact_counts(self.stream))
+
+    def test_candidates_hold_heavy_hitters(self):
+        sketch = self.sketch_of(self.stream)
+        sketch.refresh()
+        counts = exact_counts(self.stream)
+        heaviest = sorted(counts, key=counts.get, reverse=True)[:20]
+        for couple in heaviest:
+            self.assertIn(couple, sketch.candidates)
+
+    def test_subtraction_matches_sketch_of_interval(self):
+        half = len(self.stream) // 2
+        sketch = self.sketch_of(self.stream).subtract(self.sketch_of(self.stream[:half]))
+        interval = self.sketch_of(self.stream[half:])
+        self.assertEqual(sketch.total, interval.total)
+        self.assertTrue((sketch.counts == interval.counts).all())
+        self.assertWithinBound(sketch, exact_counts(self.stream[half:]))
+
+    def test_subtracted_candidates_are_heavy_hitters_of_later_sketch(self):
+        with mock.patch.object(CoupleSketch, 'NUM_CANDIDATES', 16):
+            half = len(self.stream) // 2
+            later = self.sketch_of(self.stream)
+            later.refresh()
+            later_candidates = dict(later.candidates)
+            sketch = later.subtract(self.sketch_of(self.stream[:half]))
+        threshold = sorted(later_candidates.values(), reverse=True)[15]
+
+        self.assertLessEqual(set(sketch.candidates), set(later_candidates))
+        counts = exact_counts(self.stream[half:])
+        for couple, count in counts.iteritems():
+            if count > threshold:
+                self.assertIn(couple, sketch.candidates)
+        self.assertWithinBound(sketch, counts)
+
+    def test_counters_are_32_bit(self):
+        sketch = self.sketch_of(self.stream)
+        self.assertEqual(sketch.counts.nbytes, CoupleSketch.DEPTH * CoupleSketch.WIDTH * 4)
+        sketch.add(self.stream[0], 2 ** 31)
+        self.assertEqual(sketch.estimate(self.stream[0]),
+                         2 ** 31 + exact_counts(self.stream)[self.stream[0]])
+
+    def test_loads_wider_sketches(self):
+        with mock.patch.object(CoupleSketch, 'WIDTH', CoupleSketch.WIDTH * 8):
+            wide = self.sketch_of(self.stream).mappings()
+        loaded = CoupleSketch(wide['counts'], wide['candidates'], wide['total'])
+        self.assertTrue((loaded.counts == self.sketch_of(self.stream).counts).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
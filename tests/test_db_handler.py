@@ -0,0 +1,266 @@
+import random
+import unittest
+
+import mock
+from pymongo.errors import DuplicateKeyError
+
+from codemd.data_managers import db_handler
+from codemd.data_managers.db_handler import DBHandler
+from codemd.mining.bug_classifier import BugClassifier
+
+class StorageMigrationTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(db_handler, 'mongo')
+        self.mongo = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.collections = {}
+        self.mongo.db.__getitem__.side_effect = \
+            lambda name: self.collections.setdefault(name, mock.MagicMock(name=name))
+
+    def test_constructor_only_binds_collections(self):
+        handler = DBHandler('codemd')
+
+        self.assertIs(handler.collection, self.collections['codemd'])
+        for collection in self.collections.values():
+            self.assertEqual(collection.method_calls, [])
+        self.assertFalse(self.mongo.db.collection_names.called)
+
+    def test_legacy_project_is_migrated_once(self):
+        status = self.collections.setdefault(DBHandler.STATUS_COL_NAME, mock.MagicMock())
+        status.find_one.return_value = None
+        commits = self.collections.setdefault('codemd', mock.MagicMock())
+        commits.find_one.side_effect = lambda query, *args: (
+            {'date_updated': 0} if 'date_updated' in query else {'_id': 1})
+        handler = DBHandler('codemd')
+
+        with mock.patch.object(handler, 'index_commit_messages') as index_messages, \
+                mock.patch.object(handler, 'persist_file_modifications') as persist_mods, \
+                mock.patch.object(handler, 'update_summary'):
+            handler.migrate_storage()
+            self.assertTrue(index_messages.called)
+            persist_mods.assert_called_once_with()
+
+            status.find_one.return_value = {'storage_version': DBHandler.STORAGE_VERSION}
+            handler.migrate_storage()
+            self.assertEqual(index_messages.call_count, 1)
+            self.assertEqual(persist_mods.call_count, 1)
+
+    def test_unmigrated_projects_are_not_ready(self):
+        status = self.collections.setdefault(DBHandler.STATUS_COL_NAME, mock.MagicMock())
+        status.find_one.return_value = None
+        self.assertFalse(DBHandler.project_ready('codemd'))
+        status.find_one.return_value = {'ready': True}
+        self.assertFalse(DBHandler.project_ready('codemd'))
+        status.find_one.return_value = {'ready': True,
+                                        'storage_version': DBHandler.STORAGE_VERSION}
+        self.assertTrue(DBHandler.project_ready('codemd'))
+
+    def test_legacy_projects_need_migration(self):
+        status = self.collections.setdefault(DBHandler.STATUS_COL_NAME, mock.MagicMock())
+        meta_data = self.collections.setdefault(DBHandler.META_DATA_COL_NAME, mock.MagicMock())
+        meta_data.find.return_value = [{'short_name': 'legacy'}, {'short_name': 'migrated'},
+                                       {'short_name': 'empty'}]
+        status.find_one.side_effect = lambda query, *args: (
+            {'_id': 'migrated'} if query['_id'] == 'migrated' else None)
+        self.collections.setdefault('legacy', mock.MagicMock()).find_one.return_value = {'_id': 1}
+        self.collections.setdefault('empty', mock.MagicMock()).find_one.return_value = None
+
+        self.assertEqual(DBHandler.unmigrated_projects(), ['legacy'])
+        self.assertTrue(DBHandler.needs_migration('legacy'))
+        self.assertFalse(DBHandler.needs_migration('migrated'))
+
+
+class FakeModsCollection(object):
+    """
+    The queries of update_summary and reclassify_bug_fixes over a list of rows,
+    ie file modifications or commits
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def create_index(self, keys):
+        pass
+
+    def matching(self, query, rows=None):
+        def matches(row):
+            for field, condition in query.iteritems():
+                if field == '$or':
+                    if not any(self.matching(clause, [row]) for clause in condition):
+                        return False
+                    continue
+                if not isinstance(condition, dict):
+                    condition = {'$eq': condition}
+                for operator, value in condition.iteritems():
+                    if not {'$eq': lambda v: row.get(field) == v,
+                            # Lists match like multikey indexes
+                            '$in': lambda v: (not set(row[field]).isdisjoint(v)
+                                              if isinstance(row.get(field), list)
+                                              else row.get(field) in v),
+                            '$gt': lambda v: row[field] > v,
+                            '$lte': lambda v: row[field] <= v}[operator](value):
+                        return False
+            return True
+        return [row for row in (self.rows if rows is None else rows) if matches(row)]
+
+    def find(self, query, projection=None):
+        return [dict(row) for row in self.matching(query)]
+
+    def update_many(self, query, update):
+        for row in self.matching(query):
+            row.update(update['$set'])
+
+    def aggregate(self, pipeline, allowDiskUse=False):
+        rows = self.matching(pipeline[0]['$match'])
+        group = pipeline[1]['$group']
+        if group['_id'] is None:
+            if len(rows) == 0:
+                return []
+            dates = [row['date'] for row in rows]
+            return [{'_id': None, 'count': len(rows), 'first_date': min(dates),
+                     'last_date': max(dates)}]
+        field = group['_id'][1:]
+        return [{'_id': value} for value in set(row[field] for row in rows)]
+
+    def distinct(self, field, query):
+        return list(set(row[field] for row in self.matching(query)))
+
+
+class FakeStatusCollection(object):
+    """
+    The updates of update_summary on the status of a single project
+    """
+
+    def __init__(self):
+        self.status = None
+
+    def find_one(self, query, projection=None):
+        return self.status
+
+    def update_one(self, query, update, upsert=False):
+        summary = (self.status or {}).get('summary', {})
+        condition = query['summary.seq']
+        if isinstance(condition, dict):
+            matched = self.status is not None and 'seq' not in summary
+        else:
+            matched = summary.get('seq') == condition
+        if not matched:
+            if upsert and self.status is not None:
+                raise DuplicateKeyError('duplicate _id')
+            if not upsert:
+                return mock.Mock(matched_count=0, upserted_id=None)
+        self.status = self.status or {'_id': query['_id']}
+        if 'summary' in update['$set']:
+            self.status['summary'] = dict(update['$set']['summary'])
+            return mock.Mock(matched_count=1, upserted_id=None)
+        summary = self.status['summary']
+        summary['seq'] = update['$set']['summary.seq']
+        for key, value in update['$inc'].iteritems():
+            summary[key[len('summary.'):]] += value
+        for key, value in update.get('$min', {}).iteritems():
+            summary[key[len('summary.'):]] = min(summary[key[len('summary.'):]], value)
+        for key, value in update.get('$max', {}).iteritems():
+            summary[key[len('summary.'):]] = max(summary[key[len('summary.'):]], value)
+        return mock.Mock(matched_count=1, upserted_id=None)
+
+
+class ReclassifyBugFixesTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(2)
+        self.commits, self.rows = [], []
+        words = ['fix', 'fixes', 'closed', 'bug', 'typo', 'JIRA', 'add', 'docs']
+        for i in xrange(200):
+            message = ' '.join(rng.choice(words) for j in xrange(rng.randint(1, 4)))
+            first_token, tokens = BugClassifier.tokenize(message)
+            commit = {'revision_id': 'r%s' % i, 'date': 1000 + i, 'first_token': first_token,
+                      'tokens': tokens, 'message': message}
+            commit['bug'] = BugClassifier().is_bug_fix(first_token, tokens)
+            self.commits.append(commit)
+            for j in xrange(rng.randint(1, 3)):
+                self.rows.append({'revision_id': commit['revision_id'], 'date': commit['date'],
+                                  'filename': 'f%s' % j, 'bug': commit['bug']})
+        self.handler = DBHandler.__new__(DBHandler)
+        self.handler.log = mock.Mock()
+        self.handler.project_name = 'codemd'
+        self.handler.collection = FakeModsCollection(self.commits)
+        self.handler.mods_collection = FakeModsCollection(self.rows)
+
+    def test_flags_match_classifier(self):
+        classifier = BugClassifier(first_tokens=['fix'], tokens=['bug', 'JIRA'])
+        changed = [c['date'] for c in self.commits
+                   if c['bug'] != classifier.is_bug_fix(c['first_token'], c['tokens'])]
+
+        self.assertEqual(self.handler.reclassify_bug_fixes(classifier), min(changed))
+        flags = dict((c['revision_id'], classifier.is_bug_fix(c['first_token'], c['tokens']))
+                     for c in self.commits)
+        for document in self.commits + self.rows:
+            self.assertEqual(document['bug'], flags[document['revision_id']])
+
+        self.assertIsNone(self.handler.reclassify_bug_fixes(classifier))
+
+
+class UpdateSummaryTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(db_handler, 'mongo')
+        self.mongo = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.status = FakeStatusCollection()
+        self.mongo.db.__getitem__.return_value = self.status
+        self.handler = DBHandler.__new__(DBHandler)
+        self.handler.log = mock.Mock()
+        self.handler.project_name = 'codemd'
+        self.handler.collection = mock.Mock()
+        self.rows = []
+        self.handler.mods_collection = FakeModsCollection(self.rows)
+        self.rng = random.Random(1)
+
+    def ingest(self, num_commits):
+        """
+        Appends the rows of new commits, like an ingest run
+        """
+        for commit in xrange(num_commits):
+            revision_id = 'r%s' % self.rng.randint(0, 10 ** 9)
+            date = self.rng.randint(0, 10 ** 6)
+            author = self.rng.choice(['alice', 'bob', 'carol', 'dan', 'erin'][:2 + len(self.rows) // 50])
+            for file_id in self.rng.sample(xrange(len(self.rows) // 3 + 10), 3):
+                self.rows.append({'seq': len(self.rows), 'date': date, 'revision_id': revision_id,
+                                  'filename': 'f%s' % file_id, 'author': author})
+        self.handler.collection.find_one.return_value = {'mods_seq': len(self.rows) - 1}
+
+    def baseline_summary(self):
+        """
+        The summary update_summary used to recompute over every row
+        """
+        dates = [row['date'] for row in self.rows]
+        return {'first_date': min(dates), 'last_date': max(dates),
+                'commits': len(set(row['revision_id'] for row in self.rows)),
+                'file_modifications': len(self.rows),
+                'files': len(set(row['filename'] for row in self.rows)),
+                'authors': len(set(row['author'] for row in self.rows)),
+                'seq': len(self.rows) - 1}
+
+    def test_updates_match_recomputing(self):
+        for num_commits in (20, 5, 1, 30):
+            self.ingest(num_commits)
+            self.assertEqual(self.handler.update_summary(), self.baseline_summary())
+
+    def test_updates_are_applied_once(self):
+        self.ingest(20)
+        self.handler.update_summary()
+        self.ingest(10)
+        summary = self.handler.update_summary()
+        # ie an ingest resumed after updating the summary
+        self.assertEqual(self.handler.update_summary(), summary)
+        self.assertEqual(summary, self.baseline_summary())
+
+    def test_summaries_without_seq_are_recomputed(self):
+        self.ingest(20)
+        self.status.status = {'_id': 'codemd', 'summary': {'commits': 3}}
+        self.assertEqual(self.handler.update_summary(), self.baseline_summary())
+
+
+if __name__ == '__main__':
+    unittest.main()
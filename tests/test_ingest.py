@@ -0,0 +1,48 @@
+import unittest
+
+import mock
+
+from codemd.jobs import ingest
+from codemd.data_managers.db_handler import DBHandler
+
+class UpdateIngestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = mock.Mock()
+        for name in ('RepoAnalyser', 'DBHandler', 'MetricsBuilder'):
+            patcher = mock.patch.object(ingest, name)
+            setattr(self.calls, name, patcher.start())
+            self.addCleanup(patcher.stop)
+        self.calls.RepoAnalyser.short_name.return_value = 'codemd'
+        repo = self.calls.RepoAnalyser.return_value
+        repo.last_mined_revision.return_value = 'a'
+        repo.head_revision.return_value = 'b'
+        repo.persist_commits_data.return_value = 100
+        self.calls.DBHandler.UPDATE_INGEST = DBHandler.UPDATE_INGEST
+        self.calls.DBHandler.ingest_status.return_value = None
+        self.calls.DBHandler.project_exists.return_value = True
+        self.db_handler = self.calls.DBHandler.return_value
+        self.db_handler.start_ingest.side_effect = lambda kind, **values: dict(
+            values, kind=kind, stages_done=[])
+
+    def db_calls(self):
+        return [call[0] for call in self.db_handler.method_calls]
+
+    def test_project_is_not_ready_while_checkpoints_are_rebuilt(self):
+        metrics = self.calls.MetricsBuilder.return_value
+        metrics.resume_circle_packing_data.side_effect = \
+            lambda: self.assertIn('mark_not_ready', self.db_calls())
+        ingest.ingest_project('https://github.com/a/codemd', 'a/codemd', '')
+
+        calls = self.db_calls()
+        self.assertTrue(metrics.resume_circle_packing_data.called)
+        self.assertLess(calls.index('mark_not_ready'), calls.index('remove_checkpoints'))
+        self.assertLess(calls.index('mark_stage_done'), calls.index('mark_not_ready'))
+        self.assertEqual(calls[-1], 'finish_ingest')
+
+    def test_project_stays_ready_without_new_modifications(self):
+        self.calls.RepoAnalyser.return_value.persist_commits_data.return_value = None
+        ingest.ingest_project('https://github.com/a/codemd', 'a/codemd', '')
+
+        self.assertNotIn('mark_not_ready', self.db_calls())
+        self.assertNotIn('remove_checkpoints', self.db_calls())
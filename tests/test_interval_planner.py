@@ -0,0 +1,96 @@
+import bisect
+import random
+import unittest
+
+import mock
+
+from codemd.metrics.circle_packing.interval_planner import IntervalPlanner, IntervalPlan
+
+class FakeDBHandler(object):
+    """
+    The checkpoint and file modification queries of a DBHandler, over a list
+    of file modification dates
+    """
+
+    def __init__(self, dates, checkpoints):
+        self.dates = sorted(dates)
+        self.checkpoints = sorted(checkpoints)
+
+    def find_closest_checkpoint(self, date, before=True):
+        if before:
+            candidates = [c for c in self.checkpoints if c <= date]
+            return max(candidates) if candidates else None
+        candidates = [c for c in self.checkpoints if c >= date]
+        return min(candidates) if candidates else None
+
+    def file_history_count_until(self, date):
+        if date is None:
+            return 0
+        return bisect.bisect_right(self.dates, date)
+
+
+class IntervalPlannerTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(2)
+        self.dates = sorted(rng.randint(0, 10000) for _ in xrange(5000))
+        self.db_handler = FakeDBHandler(self.dates, rng.sample(self.dates, 12))
+
+    def cheapest_cost(self, start, end, load_cost):
+        """
+        Returns the cost of the cheapest way of loading [start, end], trying
+        every checkpoint
+        """
+        count = self.db_handler.file_history_count_until
+        checkpoints = [None] + self.db_handler.checkpoints
+        cost = lambda checkpoint: load_cost if checkpoint is not None else 0
+        uppers = [cost(c) + count(end) - count(c) for c in checkpoints
+                  if c is None or c <= end]
+        lowers = [cost(c) + abs(count(start - 1) - count(c)) for c in checkpoints
+                  if c is None or c <= end]
+        return min(uppers) + min(lowers)
+
+    def assertValidPlan(self, plan, start, end, load_cost):
+        count = self.db_handler.file_history_count_until
+        self.assertTrue(plan.upper_checkpoint is None or plan.upper_checkpoint <= end)
+        self.assertEqual(plan.upper_rows, count(end) - count(plan.upper_checkpoint))
+        if plan.lower_direction == IntervalPlan.FORWARD:
+            self.assertTrue(plan.lower_checkpoint is None or plan.lower_checkpoint < start)
+            self.assertEqual(plan.lower_rows, count(start - 1) - count(plan.lower_checkpoint))
+        else:
+            self.assertTrue(start <= plan.lower_checkpoint <= end)
+            self.assertEqual(plan.lower_rows, count(plan.lower_checkpoint) - count(start - 1))
+        loads = len([c for c in (plan.upper_checkpoint, plan.lower_checkpoint) if c is not None])
+        self.assertEqual(plan.cost, plan.upper_rows + plan.lower_rows + loads * load_cost)
+        self.assertEqual(plan.has_lower(), plan.lower_checkpoint is not None or count(start - 1) > 0)
+
+    def test_plans_are_cheapest(self):
+        rng = random.Random(3)
+        for load_cost in (0, 100, 1000, IntervalPlanner.CHECKPOINT_LOAD_COST, 10 ** 6):
+            with mock.patch.object(IntervalPlanner, 'CHECKPOINT_LOAD_COST', load_cost):
+                planner = IntervalPlanner(self.db_handler)
+                for _ in xrange(50):
+                    start = rng.randint(-10, 10010)
+                    end = rng.randint(start, 10020)
+                    plan = planner.plan(start, end)
+                    self.assertValidPlan(plan, start, end, load_cost)
+                    self.assertEqual(plan.cost, self.cheapest_cost(start, end, load_cost))
+
+    def test_expensive_checkpoints_are_not_loaded(self):
+        with mock.patch.object(IntervalPlanner, 'CHECKPOINT_LOAD_COST', 10 ** 6):
+            plan = IntervalPlanner(self.db_handler).plan(5000, 6000)
+        self.assertIsNone(plan.upper_checkpoint)
+        self.assertIsNone(plan.lower_checkpoint)
+        self.assertEqual(plan.upper_rows, self.db_handler.file_history_count_until(6000))
+
+    def test_counts_are_cached(self):
+        self.db_handler.file_history_count_until = mock.Mock(
+            side_effect=FakeDBHandler.file_history_count_until.__get__(self.db_handler))
+        planner = IntervalPlanner(self.db_handler)
+        planner.plan(5000, 6000)
+        dates = [args[0] for args, _ in self.db_handler.file_history_count_until.call_args_list]
+        self.assertEqual(len(dates), len(set(dates)))
+
+
+if __name__ == '__main__':
+    unittest.main()
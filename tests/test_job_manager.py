@@ -0,0 +1,100 @@
+import os
+import socket
+import unittest
+
+import mock
+
+from codemd import app, mongo
+from codemd.jobs import job_manager
+from codemd.jobs.job_manager import JobManager, run_job
+
+DEAD_PID = 2 ** 22 + 1 # Above the maximum pid of linux
+
+class RequeueOrphanedJobsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = JobManager.__new__(JobManager)
+        self.manager.log = mock.Mock()
+        self.manager.store = mock.Mock()
+        self.host = socket.gethostname()
+
+    def requeued(self, *jobs):
+        self.manager.store.running_jobs.return_value = list(jobs)
+        self.manager._JobManager__requeue_orphaned_jobs()
+        return [call[0][0] for call in self.manager.store.requeue.call_args_list]
+
+    def test_running_worker_of_dead_web_process_is_not_requeued(self):
+        job = {'_id': 'a', 'worker_id': '%s:%s' % (self.host, DEAD_PID),
+               'worker_pid': os.getpid()}
+        self.assertEqual(self.requeued(job), [])
+
+    def test_dead_worker_is_requeued(self):
+        job = {'_id': 'a', 'worker_id': '%s:%s' % (self.host, os.getpid()),
+               'worker_pid': DEAD_PID}
+        self.assertEqual(self.requeued(job), ['a'])
+
+    def test_web_pid_is_checked_without_worker_pid(self):
+        dead = {'_id': 'a', 'worker_id': '%s:%s' % (self.host, DEAD_PID), 'worker_pid': None}
+        alive = {'_id': 'b', 'worker_id': '%s:%s' % (self.host, os.getpid())}
+        self.assertEqual(self.requeued(dead, alive), ['a'])
+
+    def test_jobs_of_other_hosts_are_ignored(self):
+        job = {'_id': 'a', 'worker_id': 'other-%s:%s' % (self.host, DEAD_PID),
+               'worker_pid': DEAD_PID}
+        self.assertEqual(self.requeued(job), [])
+
+
+class QueueMigrationsTest(unittest.TestCase):
+
+    @mock.patch.object(job_manager, 'DBHandler')
+    def test_unmigrated_projects_are_queued(self, db_handler):
+        manager = JobManager.__new__(JobManager)
+        manager.log = mock.Mock()
+        manager.store = mock.Mock()
+        manager.store.submit.return_value = ({'_id': 'a'}, True)
+        db_handler.unmigrated_projects.return_value = ['legacy1', 'legacy2']
+
+        manager._JobManager__queue_migrations()
+
+        self.assertEqual(manager.store.submit.call_args_list,
+                         [mock.call('legacy1', {'kind': JobManager.MIGRATE_JOB}),
+                          mock.call('legacy2', {'kind': JobManager.MIGRATE_JOB})])
+
+
+class RunJobTest(unittest.TestCase):
+
+    @mock.patch.object(job_manager, 'ingest_project')
+    @mock.patch.object(job_manager, 'JobStore')
+    def test_worker_opens_its_own_client(self, job_store, ingest_project):
+        # run_job replaces the client of the app, which other tests share
+        clients = app.extensions['pymongo']
+        self.addCleanup(clients.__setitem__, mongo.config_prefix, clients[mongo.config_prefix])
+        job_store.return_value.find.return_value = {
+            'project_name': 'codemd',
+            'params': {'git_url': 'https://github.com/dhaba/codemd',
+                       'full_name': 'dhaba/codemd', 'description': ''}}
+        inherited = app.extensions['pymongo'][mongo.config_prefix][0]
+
+        run_job('job')
+
+        client = app.extensions['pymongo'][mongo.config_prefix][0]
+        self.assertIsNot(client, inherited)
+        job_store.return_value.set_worker_pid.assert_called_once_with('job', os.getpid())
+        self.assertTrue(ingest_project.called)
+        job_store.return_value.finish.assert_called_once_with('job')
+
+    @mock.patch.object(job_manager, 'migrate_project')
+    @mock.patch.object(job_manager, 'open_mongo_client')
+    @mock.patch.object(job_manager, 'JobStore')
+    def test_migration_jobs(self, job_store, open_mongo_client, migrate_project):
+        job_store.return_value.find.return_value = {
+            'project_name': 'legacy', 'params': {'kind': JobManager.MIGRATE_JOB}}
+
+        run_job('job')
+
+        self.assertEqual(migrate_project.call_args[0], ('legacy',))
+        job_store.return_value.finish.assert_called_once_with('job')
+
+
+if __name__ == '__main__':
+    unittest.main()
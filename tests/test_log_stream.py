@@ -0,0 +1,109 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from git import Repo
+from git.exc import GitCommandError
+
+from codemd.mining.log_stream import GitLogStream
+
+def header(revision_id, date, message, commiter='Carol', author='Alice'):
+    return ('\x1e%s\x1f%s\x1f%s\x1f%s\x1f%s\x1f\n' % (revision_id, date, commiter, author,
+                                                      message)).encode('utf-8')
+
+
+class ParseTest(unittest.TestCase):
+
+    def test_parses_framed_commits(self):
+        lines = [header('a' * 40, 100, 'Fix parser'), b'\n',
+                 b'3\t1\tsrc/a.py\n', b'-\t-\tdocs/logo.png\n',
+                 header('b' * 40, 50, 'Empty commit')]
+        commits = list(GitLogStream.parse(lines))
+        self.assertEqual(commits, [
+            {'revision_id': 'a' * 40, 'date': 100, 'commiter': 'Carol', 'author': 'Alice',
+             'message': 'Fix parser', 'files': [('src/a.py', 3, 1), ('docs/logo.png', 0, 0)]},
+            {'revision_id': 'b' * 40, 'date': 50, 'commiter': 'Carol', 'author': 'Alice',
+             'message': 'Empty commit', 'files': []}])
+
+    def test_messages_span_lines(self):
+        lines = header('a' * 40, 100, 'Subject\n\n1\t2\tnot/a/file\n').splitlines(True)
+        lines += [b'\n', b'1\t0\treal/file.py\n']
+        commit, = GitLogStream.parse(lines)
+        self.assertEqual(commit['message'], 'Subject\n\n1\t2\tnot/a/file\n')
+        self.assertEqual(commit['files'], [('real/file.py', 1, 0)])
+
+    def test_file_names_keep_tabs(self):
+        lines = [header('a' * 40, 100, 'Tabs'), b'1\t1\tdir/with\ttab.py\n']
+        commit, = GitLogStream.parse(lines)
+        self.assertEqual(commit['files'], [('dir/with\ttab.py', 1, 1)])
+
+
+class GitRepositoryTest(unittest.TestCase):
+    """
+    Compares the stream with the commit stats of GitPython, which extracted
+    commits before the stream
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.git('init', '-q')
+        self.commit({'src/a.py': 'a\n' * 10, 'README.md': 'readme\n'}, 'Initial commit')
+        self.commit({'src/a.py': 'a\n' * 7 + 'b\n', 'logo.png': b'\x89PNG\x00\x01\x02'},
+                    'Add logo\n\nWith a body spanning\nseveral lines')
+        self.commit({'src/b.py': 'b\n' * 4, 'README.md': 'readme\nmore\n'}, 'fixes #1')
+
+    def git(self, *args):
+        env = dict(os.environ, GIT_AUTHOR_NAME='Alice', GIT_AUTHOR_EMAIL='a@example.com',
+                   GIT_COMMITTER_NAME='Carol', GIT_COMMITTER_EMAIL='c@example.com')
+        subprocess.check_call(['git'] + list(args), cwd=self.path, env=env)
+
+    def commit(self, files, message):
+        for name, contents in files.iteritems():
+            path = os.path.join(self.path, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as source:
+                source.write(contents)
+        self.git('add', '-A')
+        self.git('commit', '-q', '-m', message)
+
+    def test_matches_git_python(self):
+        expected = []
+        for commit in Repo(self.path).iter_commits('HEAD', no_merges=True):
+            expected.append({'revision_id': commit.hexsha, 'date': commit.committed_date,
+                             'commiter': commit.committer.name, 'author': commit.author.name,
+                             'message': commit.message,
+                             'files': sorted((name, stats['insertions'], stats['deletions'])
+                                             for name, stats in commit.stats.files.iteritems())})
+        commits = list(GitLogStream(self.path, 'HEAD'))
+        for commit in commits:
+            commit['files'].sort()
+        self.assertEqual(commits, expected)
+
+    def test_revisions_are_yielded_in_order(self):
+        revisions = [c.hexsha for c in Repo(self.path).iter_commits('HEAD')]
+        revisions = [revisions[1], revisions[2], revisions[0]]
+        commits = list(GitLogStream(self.path, None, revisions=revisions))
+        self.assertEqual([c['revision_id'] for c in commits], revisions)
+
+    def test_unknown_revisions_raise(self):
+        head = Repo(self.path).head.commit.hexsha
+        unknown = 'f' * 40
+        streams = [GitLogStream(self.path, unknown + '..' + head),
+                   GitLogStream(self.path, None, revisions=[head, unknown])]
+        for stream in streams:
+            with self.assertRaises(GitCommandError) as context:
+                list(stream)
+            self.assertIn(unknown, context.exception.stderr)
+
+    def test_closed_streams_dont_raise(self):
+        commits = iter(GitLogStream(self.path, 'HEAD'))
+        next(commits)
+        commits.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
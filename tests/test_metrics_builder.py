@@ -0,0 +1,236 @@
+import copy
+import json
+import logging
+import unittest
+from collections import defaultdict, OrderedDict
+
+import mock
+
+from codemd.metrics import metrics_builder
+from codemd.metrics.metrics_builder import MetricsBuilder
+from tests.helpers import file_hierarchy
+
+MODULE_KEYS = ['file_info', 'bug_info', 'tc_info', 'knowledge_info']
+
+def baseline_filetree(files, component_delim="/"):
+    """
+    The file tree MetricsBuilder built before directories were rolled up,
+    finding the node of every path component by scanning its siblings
+    """
+    tree = []
+    file_tree = {"name": "root", "children": tree}
+    for filename, file_info in files.iteritems():
+        components = filename.split(component_delim)
+        current_node = tree
+        for component in components:
+            last_node = current_node
+            for node in current_node:
+                if node['name'] == component:
+                    current_node = node['children']
+                    break
+            if last_node == current_node:
+                new_node = {'name': component, 'children': []}
+                if component == components[-1]:
+                    for attr in MODULE_KEYS:
+                        new_node[attr] = file_info[attr]
+                    current_node.append(new_node)
+                else:
+                    current_node.append(new_node)
+                    current_node = new_node['children']
+    return file_tree
+
+
+def without_roll_ups(node):
+    node = dict(node)
+    node.pop('dir_info', None)
+    node['children'] = [without_roll_ups(child) for child in node['children']]
+    return node
+
+
+def new_metrics_builder():
+    builder = MetricsBuilder.__new__(MetricsBuilder)
+    builder.project_name = 'codemd'
+    builder.log = logging.getLogger('codemd.MetricsBuilder')
+    return builder
+
+
+class FileTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.files = file_hierarchy()
+        self.tree = new_metrics_builder()._MetricsBuilder__build_filetree(self.files)
+
+    def directories(self, node, path=()):
+        yield path, node
+        for child in node['children']:
+            if 'dir_info' in child:
+                for directory in self.directories(child, path + (child['name'],)):
+                    yield directory
+
+    def test_tree_matches_baseline(self):
+        self.assertEqual(without_roll_ups(self.tree), baseline_filetree(self.files))
+
+    def test_directories_roll_up_their_files(self):
+        num_directories = 0
+        for path, node in self.directories(self.tree):
+            num_directories += 1
+            prefix = '/'.join(path + ('',)) if path else ''
+            dir_files = [info for name, info in self.files.iteritems()
+                         if name.startswith(prefix)]
+            dir_info = node['dir_info']
+            self.assertEqual(dir_info['num_files'], len(dir_files))
+            self.assertEqual(dir_info['loc'], sum(info['file_info']['loc']
+                                                  for info in dir_files))
+            self.assertEqual(dir_info['bug_score'], max(info['bug_info']['score']
+                                                        for info in dir_files))
+            author_changes = defaultdict(int)
+            for info in dir_files:
+                for author, changes in info['knowledge_info']['top_authors'].iteritems():
+                    author_changes[author] += changes
+            self.assertEqual(author_changes[dir_info['top_author']],
+                             max(author_changes.itervalues()))
+        # The wide directory, the root and the nested directories
+        self.assertGreater(num_directories, 50)
+        self.assertEqual(len(dict(self.directories(self.tree))[('wide',)]['children']), 300)
+
+    def test_empty_hierarchy(self):
+        tree = new_metrics_builder()._MetricsBuilder__build_filetree({})
+        self.assertEqual(tree['children'], [])
+        self.assertEqual(tree['dir_info']['num_files'], 0)
+        self.assertIsNone(tree['dir_info']['top_author'])
+
+
+class LevelOfDetailTest(unittest.TestCase):
+
+    def setUp(self):
+        self.builder = new_metrics_builder()
+        self.tree = self.builder._MetricsBuilder__build_filetree(file_hierarchy())
+        self.original_tree = copy.deepcopy(self.tree)
+
+    def tearDown(self):
+        self.assertEqual(self.tree, self.original_tree)
+
+    def level_of_detail(self, max_depth=None, min_loc=None, path=None, file_tree=None):
+        return self.builder._MetricsBuilder__level_of_detail(file_tree or self.tree, max_depth,
+                                                              min_loc, path)
+
+    def nodes(self, node, depth=0):
+        yield depth, node
+        for child in node['children']:
+            for descendant in self.nodes(child, depth + 1):
+                yield descendant
+
+    def assertCollapsed(self, node, path, original_tree):
+        self.assertEqual(node['children'], [])
+        self.assertTrue(node['collapsed'])
+        self.assertEqual(node['path'], path)
+        original = original_tree
+        for component in path.split('/'):
+            original = next(child for child in original['children']
+                            if child['name'] == component)
+        self.assertEqual(node['dir_info'], original['dir_info'])
+        self.assertGreater(len(original['children']), 0)
+
+    def test_max_depth_collapses_deep_directories(self):
+        tree = self.level_of_detail(max_depth=2)
+        self.assertNotIn('collapsed', tree)
+        num_collapsed = 0
+        for depth, node in self.nodes(tree):
+            self.assertLessEqual(depth, 3)
+            if node.get('collapsed'):
+                num_collapsed += 1
+                self.assertEqual(depth, 2)
+            elif depth == 2 and 'dir_info' in node:
+                self.fail("%s is not collapsed" % node['name'])
+        self.assertGreater(num_collapsed, 0)
+        d0 = next(child for child in tree['children'] if child['name'] == 'd0')
+        for child in d0['children']:
+            if 'dir_info' in child:
+                self.assertCollapsed(child, 'd0/' + child['name'], self.tree)
+        wide = next(child for child in tree['children'] if child['name'] == 'wide')
+        self.assertEqual(len(wide['children']), 300)
+
+    def test_min_loc_collapses_small_directories(self):
+        min_loc = 2000
+        tree = self.level_of_detail(min_loc=min_loc)
+        num_collapsed = 0
+        for depth, node in self.nodes(tree):
+            if depth == 0 or 'dir_info' not in node:
+                continue
+            if node.get('collapsed'):
+                num_collapsed += 1
+                self.assertLess(node['dir_info']['loc'], min_loc)
+                self.assertCollapsed(node, node['path'], self.tree)
+            else:
+                self.assertGreaterEqual(node['dir_info']['loc'], min_loc)
+        self.assertGreater(num_collapsed, 0)
+
+    def test_subtree_of_path(self):
+        subtree = self.level_of_detail(max_depth=1, path='d0/d1')
+        self.assertEqual(subtree['name'], 'd1')
+        self.assertEqual(subtree['path'], 'd0/d1')
+        for child in subtree['children']:
+            if 'dir_info' in child:
+                self.assertCollapsed(child, 'd0/d1/' + child['name'], self.tree)
+            else:
+                self.assertIn('file_info', child)
+
+    def test_missing_directories(self):
+        for path in ('nope', 'd0/nope', 'wide/f0.py', 'setup.py'):
+            self.assertIsNone(self.level_of_detail(max_depth=1, path=path), path)
+
+    def test_trees_without_roll_ups_are_not_collapsed(self):
+        tree = without_roll_ups(self.tree)
+        self.assertEqual(self.level_of_detail(max_depth=1, file_tree=tree), tree)
+
+
+class IntervalTreeCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        for name in ('CirclePackingMetrics', 'DBHandler'):
+            patcher = mock.patch.object(metrics_builder, name)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(MetricsBuilder, '_MetricsBuilder__interval_trees',
+                                    OrderedDict())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.DBHandler.ingest_status.return_value = {'updated': 1}
+        self.CirclePackingMetrics.return_value.compute_file_hierarchy.side_effect = \
+            lambda: [file_hierarchy()]
+
+    def circle_packing(self, intervals, path=None):
+        return MetricsBuilder('codemd').circle_packing(intervals, max_depth=2, path=path)
+
+    def test_subtrees_are_expanded_from_the_cached_tree(self):
+        intervals = [[1000, 2000], [None, None]]
+        tree = self.circle_packing(intervals)
+        subtree = self.circle_packing(intervals, path='d0/d1')
+        self.assertEqual(self.CirclePackingMetrics.call_count, 1)
+
+        self.CirclePackingMetrics.return_value.compute_file_hierarchy.side_effect = \
+            AssertionError("tree was built again")
+        self.assertEqual(self.circle_packing([[1000, 2000], [None, None]]), tree)
+        self.assertEqual(json.loads(subtree)['path'], 'd0/d1')
+
+    def test_trees_are_built_again_when_the_project_changes(self):
+        intervals = [[1000, 2000], [None, None]]
+        self.circle_packing(intervals)
+        self.circle_packing([[1000, 3000], [None, None]])
+        self.assertEqual(self.CirclePackingMetrics.call_count, 2)
+
+        self.DBHandler.ingest_status.return_value = {'updated': 2}
+        self.circle_packing(intervals)
+        self.assertEqual(self.CirclePackingMetrics.call_count, 3)
+
+    def test_least_recently_used_trees_are_evicted(self):
+        with mock.patch.object(MetricsBuilder, 'INTERVAL_TREE_CACHE_SIZE', 2):
+            for end in (2000, 3000, 2000, 4000, 2000):
+                self.circle_packing([[1000, end], [None, None]])
+            self.assertEqual(self.CirclePackingMetrics.call_count, 3)
+            self.circle_packing([[1000, 3000], [None, None]])
+            self.assertEqual(self.CirclePackingMetrics.call_count, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
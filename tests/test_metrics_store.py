@@ -0,0 +1,291 @@
+import random
+import unittest
+from collections import defaultdict
+
+import mock
+
+from codemd.data_managers.checkpoint_codec import CheckpointCodec
+from codemd.metrics.circle_packing.metrics_store import CirclePackingMetricsStore
+from codemd.metrics.circle_packing.modules.temporal_coupling import TemporalCouplingModule
+from tests.helpers import file_history
+
+FILES = ['f%s.c' % i for i in xrange(30)]
+
+class FakeCheckpointDB(object):
+    """
+    The checkpoint queries of CirclePackingMetricsStore over a list of file
+    modification rows and a dict of encoded checkpoint documents
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.docs = {} # (date, module_key): {'index', 'level', 'data'}
+        self.large_commit_docs = {}
+        self.large_commit_saves = {}
+        self.level = None
+        self.num_saves = 0
+        self.max_checkpoints = 0
+
+    def file_history_count(self):
+        return len(self.rows)
+
+    def file_history(self, start_date=None, end_date=None):
+        return [row for row in self.rows
+                if (start_date is None or row['date'] >= start_date)
+                and (end_date is None or row['date'] <= end_date)]
+
+    def bug_fix_history(self, start_date=None, end_date=None):
+        return [row for row in self.file_history(start_date, end_date) if row['bug']]
+
+    def file_history_count_until(self, date):
+        return len(self.file_history(end_date=date)) if date is not None else 0
+
+    def persist_large_commits(self, large_commits):
+        for revision_id, commit in large_commits.iteritems():
+            self.large_commit_saves[revision_id] = self.large_commit_saves.get(revision_id, 0) + 1
+            self.large_commit_docs[revision_id] = dict(commit)
+
+    def large_commits(self, start_date, end_date):
+        return dict((revision_id, commit)
+                    for revision_id, commit in self.large_commit_docs.iteritems()
+                    if start_date <= commit['date'] <= end_date)
+
+    def checkpoint_level(self, default):
+        return default if self.level is None else self.level
+
+    def set_checkpoint_level(self, level):
+        self.level = level
+
+    def persist_packing_data(self, date, module_key, data, index=None, level=None):
+        encoded = CheckpointCodec.encode(data)
+        self.docs[(date, module_key)] = {'index': index, 'level': level, 'data': encoded}
+        self.num_saves += 1
+        self.max_checkpoints = max(self.max_checkpoints, len(self.checkpoint_dates()))
+        return len(encoded)
+
+    def checkpoint_sizes_by_level(self):
+        sizes = defaultdict(int)
+        for doc in self.docs.itervalues():
+            sizes[doc['level']] += len(doc['data'])
+        return sizes
+
+    def replace_packing_data(self, date, module_key, data):
+        doc = self.docs[(date, module_key)]
+        self.persist_packing_data(date, module_key, data, doc['index'], doc['level'])
+
+    def remove_checkpoint_levels(self, level):
+        for key, doc in self.docs.items():
+            if doc['level'] >= level:
+                del self.docs[key]
+
+    def checkpoint_dates(self, start_date=None):
+        return sorted(set(date for date, module_key in self.docs
+                          if start_date is None or date >= start_date))
+
+    def find_closest_checkpoint(self, date, before=True):
+        dates = [d for d in self.checkpoint_dates() if (d <= date if before else d >= date)]
+        if len(dates) == 0:
+            return None
+        return dates[-1] if before else dates[0]
+
+    def fetch_checkpoint_data(self, date):
+        for (doc_date, module_key) in sorted(self.docs, key=lambda key: key[1]):
+            if doc_date == date:
+                yield {'date': date, 'module_key': module_key,
+                       'data': CheckpointCodec.decode(self.docs[(date, module_key)]['data'])}
+
+
+def checkpoint_store(rows):
+    """
+    Returns a CirclePackingMetricsStore of rows persisting checkpoints to a
+    FakeCheckpointDB
+    """
+    store = CirclePackingMetricsStore.__new__(CirclePackingMetricsStore)
+    store.log = mock.Mock()
+    store.db_handler = FakeCheckpointDB(rows)
+    store.metrics = mock.Mock()
+    store.intervals = [[rows[0]['date'], rows[-1]['date']]]
+    store.checkpoint_index = 0
+    store.checkpoint_level = None
+    store.checkpoint_bytes = defaultdict(int)
+    store.reset_modules()
+    return store
+
+
+class WidenSpacingTest(unittest.TestCase):
+
+    def store(self, checkpoints, level=CirclePackingMetricsStore.MAX_CHECKPOINT_LEVEL,
+              checkpoint_bytes=()):
+        store = CirclePackingMetricsStore.__new__(CirclePackingMetricsStore)
+        store.log = mock.Mock()
+        store.db_handler = mock.Mock()
+        store.checkpoint_index = checkpoints
+        store.checkpoint_level = level
+        store.checkpoint_bytes = defaultdict(int, checkpoint_bytes)
+        store._CirclePackingMetricsStore__widen_spacing()
+        return store
+
+    def kept(self, store, checkpoints, level):
+        return len([i for i in xrange(checkpoints) if store.checkpoint_level_of(i) <= level])
+
+    def test_short_histories_keep_every_checkpoint(self):
+        store = self.store(CirclePackingMetricsStore.MAX_CHECKPOINTS)
+        self.assertEqual(store.checkpoint_level, CirclePackingMetricsStore.MAX_CHECKPOINT_LEVEL)
+        self.assertFalse(store.db_handler.remove_checkpoint_levels.called)
+
+    def test_spacing_widens_with_history(self):
+        max_checkpoints = CirclePackingMetricsStore.MAX_CHECKPOINTS
+        for checkpoints in (max_checkpoints + 1, 3 * max_checkpoints, 100 * max_checkpoints):
+            store = self.store(checkpoints)
+            level = store.checkpoint_level
+            self.assertLessEqual(self.kept(store, checkpoints, level), max_checkpoints)
+            # The next finer level would keep too many checkpoints
+            self.assertGreater(self.kept(store, checkpoints, level + 1), max_checkpoints)
+            store.db_handler.remove_checkpoint_levels.assert_called_once_with(
+                store.checkpoint_level + 1)
+
+    def test_level_only_depends_on_history_length(self):
+        checkpoints = 5 * CirclePackingMetricsStore.MAX_CHECKPOINTS
+        widened = self.store(checkpoints)
+        resumed = self.store(checkpoints, level=widened.checkpoint_level + 1)
+        self.assertEqual(resumed.checkpoint_level, widened.checkpoint_level)
+
+    def test_byte_budget_drops_levels(self):
+        max_level = CirclePackingMetricsStore.MAX_CHECKPOINT_LEVEL
+        budget = CirclePackingMetricsStore.MAX_CHECKPOINT_BYTES
+        checkpoint_bytes = {0: budget // 4, max_level - 1: budget // 2, max_level: budget // 2}
+        store = self.store(8, checkpoint_bytes=checkpoint_bytes)
+        self.assertEqual(store.checkpoint_level, max_level - 1)
+        store.db_handler.remove_checkpoint_levels.assert_called_once_with(max_level)
+        self.assertEqual(dict(store.checkpoint_bytes),
+                         {0: budget // 4, max_level - 1: budget // 2})
+
+        # Checkpoints of level 0 are kept whatever their size
+        store = self.store(8, checkpoint_bytes={0: 2 * budget, 3: 1})
+        self.assertEqual(store.checkpoint_level, 0)
+
+
+class PersistCheckpointsTest(unittest.TestCase):
+
+    def setUp(self):
+        for name, value in (('CHECKPOINT_SPACING', 8), ('MAX_CHECKPOINTS', 6)):
+            patcher = mock.patch.object(CirclePackingMetricsStore, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.rows = file_history(400, FILES, commit_sizes=(1, 2, 3, 4), date_steps=(1,))
+
+    def test_levels_are_dropped_while_saving(self):
+        store = checkpoint_store(self.rows)
+        store.persist_checkpoints()
+        db = store.db_handler
+        num_modules = len(store.metrics.modules)
+
+        max_checkpoints = CirclePackingMetricsStore.MAX_CHECKPOINTS
+        self.assertLessEqual(len(db.checkpoint_dates()), max_checkpoints)
+        self.assertLessEqual(db.max_checkpoints, max_checkpoints + 1)
+        # Checkpoints of the levels dropped so far were never saved
+        self.assertGreater(store.checkpoint_index, 3 * max_checkpoints)
+        self.assertLess(db.num_saves, store.checkpoint_index * num_modules / 2)
+        self.assertEqual(db.level, store.checkpoint_level)
+        self.assertEqual(dict(store.checkpoint_bytes),
+                         dict((level, size) for level, size
+                              in db.checkpoint_sizes_by_level().iteritems()))
+
+    def test_byte_budget_is_kept(self):
+        store = checkpoint_store(self.rows)
+        store.persist_checkpoints()
+        sizes = store.db_handler.checkpoint_sizes_by_level()
+        budget = sum(sizes.itervalues()) // 2
+
+        with mock.patch.object(CirclePackingMetricsStore, 'MAX_CHECKPOINT_BYTES', budget):
+            store = checkpoint_store(self.rows)
+            store.persist_checkpoints()
+        sizes = store.db_handler.checkpoint_sizes_by_level()
+        self.assertGreater(store.checkpoint_level, 0)
+        # The last checkpoint is kept whatever its level, to resume from
+        self.assertLessEqual(sum(size for level, size in sizes.iteritems()
+                                 if level <= store.checkpoint_level), budget)
+        self.assertGreater(len(store.db_handler.checkpoint_dates()), 1)
+
+
+class ReclassifyCheckpointsTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(CirclePackingMetricsStore, 'CHECKPOINT_SPACING', 64)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def checkpoint_data(self, store, date):
+        modules = store._CirclePackingMetricsStore__checkpoint_modules(date)
+        return modules[0].working_data.to_dicts()
+
+    def test_only_bug_records_are_recomputed(self):
+        rows = file_history(300, FILES, commit_sizes=(1, 2, 3, 4), date_steps=(0, 1, 3))
+        store = checkpoint_store(rows)
+        store.persist_checkpoints()
+        dates = store.db_handler.checkpoint_dates()
+        self.assertGreater(len(dates), 4)
+
+        since_date = dates[len(dates) // 2] - 1
+        rng = random.Random(1)
+        for row in rows:
+            if row['date'] >= since_date:
+                row['bug'] = rng.random() < 0.5
+        other_docs = dict((key, doc['data']) for key, doc in store.db_handler.docs.iteritems()
+                          if key[1] != 'bug_info')
+        store.reclassify_checkpoints(since_date)
+
+        rebuilt = checkpoint_store(rows)
+        rebuilt.persist_checkpoints()
+        self.assertEqual(rebuilt.db_handler.checkpoint_dates(), dates)
+        for date in dates:
+            self.assertEqual(self.checkpoint_data(store, date),
+                             self.checkpoint_data(rebuilt, date))
+        for key, data in other_docs.iteritems():
+            self.assertIs(store.db_handler.docs[key]['data'], data)
+
+
+class LargeCommitsTest(unittest.TestCase):
+
+    def setUp(self):
+        for name, value in (('MAX_COMMIT_SIZE', 3), ('USE_MINHASH', True)):
+            patcher = mock.patch.object(TemporalCouplingModule, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(CirclePackingMetricsStore, 'CHECKPOINT_SPACING', 64)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def expected_large_commits(self, rows, start, end):
+        commits = {}
+        for row in rows:
+            if start <= row['date'] <= end:
+                commit = commits.setdefault(row['revision_id'], {'date': row['date'],
+                                                                 'files': []})
+                commit['files'].append(row['filename'])
+        return dict((revision_id, commit) for revision_id, commit in commits.iteritems()
+                    if len(commit['files']) >= TemporalCouplingModule.MAX_COMMIT_SIZE)
+
+    def test_large_commits_are_stored_once(self):
+        rows = file_history(300, FILES, commit_sizes=(1, 2, 3, 4), date_steps=(0, 1, 3))
+        store = checkpoint_store(rows)
+        store.persist_checkpoints()
+        db = store.db_handler
+
+        self.assertEqual(db.large_commit_docs,
+                         self.expected_large_commits(rows, 0, rows[-1]['date']))
+        self.assertEqual(set(db.large_commit_saves.values()), set([1]))
+        for (date, module_key), doc in db.docs.iteritems():
+            if module_key == TemporalCouplingModule.MODULE_KEY:
+                self.assertNotIn('large_commits', CheckpointCodec.decode(doc['data']))
+
+        for start, end in ((1100, rows[-1]['date']), (1200, 1300)):
+            store.intervals = store.metrics.intervals = [[start, end]]
+            store.load_interval()
+            tc = [mod for mod in store.metrics.modules
+                  if isinstance(mod, TemporalCouplingModule)][0]
+            self.assertEqual(tc.large_commits, self.expected_large_commits(rows, start, end))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import random
+import unittest
+from collections import defaultdict
+from itertools import combinations
+
+from codemd.metrics.circle_packing.coupling import MinHashCoupling
+
+def large_commits(num_commits, seed=4):
+    """
+    Returns synthetic large commits, most of them modifying one of a few groups
+    of files that change together, plus random files
+    """
+    rng = random.Random(seed)
+    files = ['src/d%s/f%s.c' % (i % 17, i) for i in xrange(5000)]
+    groups = [rng.sample(files, 20) for _ in xrange(20)]
+    commits = []
+    for _ in xrange(num_commits):
+        group = rng.choice(groups)
+        commits.append([f for f in group if rng.random() < 0.95]
+                       + rng.sample(files, rng.randint(5, 100)))
+    return commits, groups
+
+
+@unittest.skipUnless(MinHashCoupling.available(), "requires numpy")
+class MinHashCouplingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.commits, self.groups = large_commits(600)
+        # The pairwise counting MinHash replaces
+        self.file_commits = defaultdict(set)
+        for commit_id, files in enumerate(self.commits):
+            for file_name in files:
+                self.file_commits[file_name].add(commit_id)
+        self.couples = MinHashCoupling(self.commits).couples()
+
+    def jaccard(self, first, second):
+        first, second = self.file_commits[first], self.file_commits[second]
+        return len(first & second) / float(len(first | second))
+
+    def test_counts_are_exact(self):
+        self.assertGreater(len(self.couples), 0)
+        for (first, second), count in self.couples.iteritems():
+            self.assertLess(first, second)
+            self.assertEqual(count, len(self.file_commits[first] & self.file_commits[second]))
+
+    def test_similar_couples_are_found(self):
+        similar = set()
+        for group in self.groups:
+            similar.update(couple for couple in combinations(sorted(group), 2)
+                           if self.jaccard(*couple) >= 0.5)
+        self.assertGreater(len(similar), 0)
+        # A couple of similarity s is found with probability
+        # 1 - (1 - s ^ ROWS_PER_BAND) ^ NUM_BANDS, about 0.64 for s = 0.5
+        found = len(similar.intersection(self.couples))
+        self.assertGreaterEqual(found, 0.5 * len(similar))
+        very_similar = [couple for couple in similar if self.jaccard(*couple) >= 0.8]
+        self.assertEqual([c for c in very_similar if c not in self.couples], [])
+
+    def test_few_files(self):
+        self.assertEqual(MinHashCoupling([]).couples(), {})
+        self.assertEqual(MinHashCoupling([['a'], ['a']]).couples(), {})
+        self.assertEqual(MinHashCoupling([['a', 'b'], ['b', 'a']]).couples(), {('a', 'b'): 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
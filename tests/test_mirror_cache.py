@@ -0,0 +1,41 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from codemd import app
+from codemd.mining.mirror_cache import MirrorCache
+from codemd.mining.repo_analyser import RepoAnalyser
+
+class MirrorCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+
+    def test_root_is_private_directory_of_data_dir(self):
+        with mock.patch.dict(app.config, DATA_DIR=self.data_dir):
+            cache = MirrorCache()
+        self.assertEqual(cache.root, os.path.join(self.data_dir, MirrorCache.DIRECTORY_NAME))
+        self.assertEqual(os.stat(cache.root).st_mode & 0o077, 0)
+
+    def test_mirror_paths(self):
+        cache = MirrorCache(root=self.data_dir)
+        path = cache.mirror_path('https://github.com/dhaba/codemd.git')
+        self.assertEqual(os.path.dirname(path), self.data_dir)
+        self.assertTrue(os.path.basename(path).startswith('codemd-'))
+        self.assertNotEqual(path, cache.mirror_path('https://example.com/codemd.git'))
+
+
+class RepoAnalyserTest(unittest.TestCase):
+
+    def test_partially_initialized_analyser_is_deleted(self):
+        analyser = RepoAnalyser.__new__(RepoAnalyser)
+        # ie MirrorCache() raised in __init__
+        analyser.__del__()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import fnmatch
+import random
+import unittest
+
+from codemd.mining.path_filter import PathFilter
+
+def baseline_filter(files, include_paths, exclude_paths):
+    """
+    The filter PathFilter replaced, which ran fnmatch.fnmatch on every pattern
+    """
+    accepted = []
+    for f in files:
+        excluded = any(fnmatch.fnmatch(f, p) for p in exclude_paths)
+        included = len(include_paths) == 0 or any(fnmatch.fnmatch(f, p) for p in include_paths)
+        if included and not excluded:
+            accepted.append(f)
+    return accepted
+
+
+class PathFilterTest(unittest.TestCase):
+
+    EXCLUDE_PATHS = ["*.md", "*.yml", "MIT-LICENSE", "*.gemspec", "Gemfile", ".bower", "*.json",
+                     "*.gitignore", ".git", ".png", "README.*", "LICENSE", "numpy/doc/*",
+                     "*.txt, *.yml", "[ab]*.c", "x?y", "[!l]*/*.h"]
+
+    INCLUDE_PATHS = [[], ["lib/*", "src/*"], ["*"], ["numpy/*", "tools/*"], ["*.[ch]"]]
+
+    PARTS = ['lib', 'src', 'numpy', 'doc', 'tools', 'README', 'x', 'a', 'b', '.git', 'foo.md',
+             'bar.json', 'Gemfile', 'LICENSE', 'y.c', 'a.c', 'z.h', 'xzy', 'q.txt, r.yml',
+             'wei rd\nname', 'ma$ks+(re)']
+
+    def setUp(self):
+        rand = random.Random(1)
+        self.files = ['/'.join(rand.choice(self.PARTS) for _ in range(rand.randint(1, 4)))
+                      for _ in range(3000)]
+
+    def test_matches_fnmatch(self):
+        for include_paths in self.INCLUDE_PATHS:
+            path_filter = PathFilter(include_paths, self.EXCLUDE_PATHS)
+            expected = baseline_filter(self.files, include_paths, self.EXCLUDE_PATHS)
+            self.assertEqual(path_filter.filter(self.files), expected)
+            # Cached decisions
+            self.assertEqual(path_filter.filter(self.files), expected)
+
+    def test_no_patterns_accepts_everything(self):
+        self.assertEqual(PathFilter([], []).filter(self.files), self.files)
+
+    def test_accepts(self):
+        path_filter = PathFilter(["src/*"], ["*.md"])
+        self.assertTrue(path_filter.accepts("src/a/b.py"))
+        self.assertFalse(path_filter.accepts("src/README.md"))
+        self.assertFalse(path_filter.accepts("lib/b.py"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import random
+import unittest
+
+from codemd.data_managers.checkpoint_codec import CheckpointCodec
+from codemd.metrics.circle_packing.prefix_sums import PrefixSumEngine
+from codemd.metrics.circle_packing.modules.knowledge_map import KnowledgeMapModule
+from tests.helpers import blank_modules, couples, file_history, replay
+
+FILES = ['d%s/f%s.c' % (i % 4, i) for i in xrange(40)]
+
+class PrefixSumEngineTest(unittest.TestCase):
+    """
+    Loading the modules from prefix sums must give the state of replaying the
+    file modifications of the interval through them
+    """
+
+    def setUp(self):
+        self.rows = file_history(600, FILES, commit_sizes=(1, 1, 2, 3, 5, 9),
+                                 date_steps=(0, 0, 1, 5), seed=3)
+        engine = PrefixSumEngine.from_file_history(self.rows)
+        # As loaded from the db
+        self.engine = PrefixSumEngine(CheckpointCodec.decode(CheckpointCodec.encode(engine.data)))
+
+    def replay(self, interval):
+        modules = replay([row for row in self.rows if row['date'] <= interval[1]], [interval])
+        # The knowledge map isn't scoped: the churn of an interval is the
+        # difference of the churns up to its end and before its start
+        earlier = replay([row for row in self.rows if row['date'] < interval[0]], [interval],
+                         (KnowledgeMapModule,))
+        modules[3].subtract_module(earlier[0])
+        return modules
+
+    def assertModulesEqual(self, modules, loaded):
+        working_data, loaded_data = modules[0].working_data, loaded[0].working_data
+        self.assertEqual(set(working_data), set(loaded_data))
+        for name in working_data:
+            record, loaded_record = working_data[name], loaded_data[name]
+            for key in ('file_info', 'bug_info', 'tc_info'):
+                self.assertEqual(dict(record[key]), dict(loaded_record[key]))
+            self.assertEqual(dict(record['knowledge_info']['top_authors']),
+                             dict(loaded_record['knowledge_info']['top_authors']))
+        tc, loaded_tc = modules[2], loaded[2]
+        self.assertEqual(couples(tc), couples(loaded_tc))
+        self.assertEqual(dict(tc.working_rev_counts), dict(loaded_tc.working_rev_counts))
+        self.assertEqual(tc.num_ignored_commits, loaded_tc.num_ignored_commits)
+
+    def test_intervals_match_replay(self):
+        rng = random.Random(5)
+        last_date = self.rows[-1]['date']
+        intervals = [[0, last_date], [last_date, last_date], [0, 999]]
+        for _ in xrange(20):
+            start = rng.randint(900, last_date)
+            intervals.append([start, rng.randint(start, last_date + 10)])
+        for interval in intervals:
+            loaded = blank_modules([interval])
+            self.engine.load_modules(loaded, interval)
+            self.assertModulesEqual(self.replay(interval), loaded)
+            for module in loaded:
+                module.post_process_data()
+
+    def test_reclassify_matches_rebuild(self):
+        rng = random.Random(7)
+        rows = [dict(row, bug=rng.random() < 0.2) for row in self.rows]
+        engine = self.engine.reclassify([row['bug'] for row in rows])
+        rebuilt = PrefixSumEngine.from_file_history(rows)
+        for key in ('bug_offsets', 'bug_keys', 'file_keys', 'couple_keys'):
+            self.assertEqual(engine.data[key].tolist(), rebuilt.data[key].tolist())
+
+        self.rows = rows
+        last_date = rows[-1]['date']
+        for interval in ([0, last_date], [1100, last_date - 50]):
+            loaded = blank_modules([interval])
+            engine.load_modules(loaded, interval)
+            self.assertModulesEqual(self.replay(interval), loaded)
+
+    def test_empty_history(self):
+        engine = PrefixSumEngine.from_file_history([])
+        modules = blank_modules([[0, 1]])
+        engine.load_modules(modules, [0, 1])
+        self.assertEqual(len(modules[0].working_data), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+import mock
+
+from codemd.jobs import reclassify
+from codemd.data_managers.db_handler import DBHandler
+
+class ReclassifyBugsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.patchers = {}
+        for name in ('BugClassifier', 'DBHandler', 'MetricsBuilder'):
+            patcher = mock.patch.object(reclassify, name)
+            self.patchers[name] = patcher.start()
+            self.addCleanup(patcher.stop)
+        db_handler_class = self.patchers['DBHandler']
+        db_handler_class.RECLASSIFY_INGEST = DBHandler.RECLASSIFY_INGEST
+        db_handler_class.ingest_status.return_value = None
+        self.db_handler = db_handler_class.return_value
+        self.db_handler.start_ingest.side_effect = lambda kind, **values: dict(
+            values, kind=kind, stages_done=[])
+        self.db_handler.reclassify_bug_fixes.return_value = 1500
+        self.metrics = self.patchers['MetricsBuilder'].return_value
+
+    def test_only_bug_data_is_recomputed(self):
+        reclassify.reclassify_bugs('codemd', {'tokens': ['bug']})
+
+        self.metrics.update_commits.assert_called_once_with(1500)
+        self.metrics.reclassify_prefix_sums.assert_called_once_with()
+        self.metrics.reclassify_circle_packing_data.assert_called_once_with(1500)
+        self.assertFalse(self.metrics.save_prefix_sums.called)
+        self.assertFalse(self.metrics.resume_circle_packing_data.called)
+        self.assertFalse(self.db_handler.remove_checkpoints.called)
+        self.assertEqual(self.db_handler.method_calls[-1][0], 'finish_ingest')
+
+    def test_runs_without_changed_flags_stop_early(self):
+        self.db_handler.reclassify_bug_fixes.return_value = None
+        reclassify.reclassify_bugs('codemd', {'tokens': ['bug']})
+
+        self.assertFalse(self.patchers['MetricsBuilder'].called)
+        self.db_handler.finish_ingest.assert_called_once_with()
+
+    def test_interrupted_runs_resume(self):
+        reclassify.DBHandler.ingest_status.return_value = {'pending': {
+            'kind': DBHandler.RECLASSIFY_INGEST, 'bug_classifier': {}, 'since_date': 1200,
+            'stages_done': ['bug_flags', 'dashboard', 'prefix_sums']}}
+        reclassify.reclassify_bugs('codemd', {'tokens': ['bug']})
+
+        self.assertFalse(self.db_handler.reclassify_bug_fixes.called)
+        self.assertFalse(self.metrics.reclassify_prefix_sums.called)
+        self.metrics.reclassify_circle_packing_data.assert_called_once_with(1200)
+
+
+if __name__ == '__main__':
+    unittest.main()
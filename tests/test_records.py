@@ -0,0 +1,36 @@
+import pickle
+import unittest
+
+from codemd.metrics.circle_packing.records import FileRecordStore, FileRecord
+
+class FileRecordStoreTest(unittest.TestCase):
+
+    def store(self):
+        store = FileRecordStore()
+        record = store.get_or_create('src/a.py')
+        record['file_info'] = FileRecord.RECORD_CLASSES['file_info'](creation_date=10)
+        record['file_info']['loc'] = 42
+        record['knowledge_info'] = FileRecord.RECORD_CLASSES['knowledge_info']()
+        record['knowledge_info']['top_authors'] = {'alice': 3}
+        return store
+
+    def test_get_or_create_returns_the_stored_record(self):
+        store = self.store()
+        self.assertIs(store.get_or_create('src/a.py'), store['src/a.py'])
+        self.assertEqual(len(store), 1)
+
+    def test_dicts_round_trip(self):
+        store = self.store()
+        loaded = FileRecordStore.from_dicts(store.to_dicts())
+        self.assertIsInstance(loaded, FileRecordStore)
+        self.assertEqual(loaded.to_dicts(), store.to_dicts())
+
+    def test_store_only_holds_its_records(self):
+        store = self.store()
+        self.assertEqual(vars(store), {})
+        self.assertEqual(vars(FileRecordStore.from_dicts(store.to_dicts())), {})
+        self.assertEqual(pickle.loads(pickle.dumps(store, 2)).to_dicts(), store.to_dicts())
+
+
+if __name__ == '__main__':
+    unittest.main()
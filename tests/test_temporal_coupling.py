@@ -0,0 +1,204 @@
+import random
+import unittest
+from collections import defaultdict
+from operator import itemgetter
+
+import mock
+
+from codemd.data_managers.checkpoint_codec import CheckpointCodec
+from codemd.metrics.circle_packing.coupling import SparseCouplingEngine
+from codemd.metrics.circle_packing.modules.file_info import FileInfoModule
+from codemd.metrics.circle_packing.modules.temporal_coupling import TemporalCouplingModule
+from codemd.metrics.circle_packing.records import FileRecordStore
+from tests.helpers import couples, file_history, replay
+
+UNSCOPED = [[0, 10 ** 9]]
+
+# Test files and C headers, so the filters of the module are exercised
+FILES = (['src/d%s/f%s.c' % (i % 5, i) for i in xrange(60)]
+         + ['src/d%s/f%s.h' % (i % 5, i) for i in xrange(20)]
+         + ['tests/test_f%s.py' % i for i in xrange(10)])
+
+def coupling_modules(rows, intervals=UNSCOPED):
+    return replay(rows, intervals, (FileInfoModule, TemporalCouplingModule))
+
+
+def baseline_coloring(scored_couples, num_top, clique_colors, rev_counts):
+    """
+    Returns the temporal coupling data of every file, assigned the way the
+    module did before cliques were tracked with a union-find structure
+    """
+    sorted_couples = sorted(scored_couples, key=itemgetter(0), reverse=True)
+    couples, other_couples = sorted_couples[:num_top], sorted_couples[num_top:]
+    max_score = couples[0][0]
+    result = {}
+
+    def add_temporal_data(couple, color):
+        score, pair, count, avg_revs = couple
+        for mod in pair:
+            if result.get(mod, {'score': 0})['score'] < score:
+                result[mod] = {'score': score, 'opacity': score/max_score,
+                               'coupled_module': [x for x in pair if x is not mod][0],
+                               'num_revisions': rev_counts[mod],
+                               'num_mutual_revisions': count, 'color': color,
+                               'percent': count/avg_revs}
+
+    adj_list = defaultdict(set)
+    for couple in couples:
+        adj_list[couple[1][0]].add(couple[1][1])
+        adj_list[couple[1][1]].add(couple[1][0])
+    cliques = []
+    for vertex, neighbors in adj_list.iteritems():
+        if any(vertex in clique for clique in cliques):
+            continue
+        stack = list(neighbors)
+        clique = set([vertex])
+        while len(stack) > 0:
+            current = stack.pop()
+            clique.add(current)
+            stack += [v for v in adj_list[current] if v not in clique]
+        cliques.append(clique)
+
+    colors = dict((color, set()) for color in clique_colors)
+    for couple in couples:
+        mod1 = couple[1][0]
+        found = [color for color in colors if mod1 in colors[color]]
+        if found:
+            add_temporal_data(couple, found[0])
+            continue
+        empty_colors = [color for color in clique_colors if len(colors[color]) == 0]
+        if empty_colors:
+            add_temporal_data(couple, empty_colors[0])
+            colors[empty_colors[0]] = [clique for clique in cliques if mod1 in clique][0]
+
+    for couple in other_couples:
+        add_temporal_data(couple, None)
+    return result
+
+
+def scored(file_info, tc):
+    file_info.post_process_data()
+    tc.post_process_data()
+    return dict((name, dict(record[TemporalCouplingModule.MODULE_KEY].to_dict()))
+                for name, record in tc.working_data.iteritems())
+
+
+@unittest.skipUnless(SparseCouplingEngine.available(), "requires numpy and scipy")
+class CoupleMatrixTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = file_history(600, FILES, commit_sizes=(1, 2, 2, 3, 5, 9), start_date=0)
+
+    def baseline(self, rows, intervals=UNSCOPED):
+        with mock.patch.object(TemporalCouplingModule, 'USE_SPARSE_ENGINE', False):
+            return coupling_modules(rows, intervals)
+
+    def assertScoresEqual(self, first, second):
+        self.assertEqual(sorted(first), sorted(second))
+        for name in first:
+            for field, value in first[name].iteritems():
+                if field in ('color', 'coupled_module'):
+                    # Cliques and best couples depend on the order of the
+                    # couples with equal scores
+                    continue
+                if isinstance(value, float):
+                    self.assertAlmostEqual(value, second[name][field], places=9)
+                else:
+                    self.assertEqual(value, second[name][field], (name, field))
+
+    def test_couples_are_kept_as_a_matrix(self):
+        _, tc = coupling_modules(self.rows)
+        self.assertEqual(len(tc.working_couples), 0)
+        self.assertEqual(couples(tc), couples(self.baseline(self.rows)[1]))
+
+    def test_scores_match_dict_implementation(self):
+        self.assertScoresEqual(scored(*coupling_modules(self.rows)),
+                               scored(*self.baseline(self.rows)))
+
+    def test_subtraction_matches_dict_implementation(self):
+        lower_rows = [row for row in self.rows if row['date'] < 250]
+        _, tc = coupling_modules(self.rows)
+        _, lower_tc = coupling_modules(list(reversed(lower_rows)))
+        _, baseline = self.baseline(self.rows)
+        _, lower_baseline = self.baseline(lower_rows)
+        tc.subtract_module(lower_tc)
+        baseline.subtract_module(lower_baseline)
+        self.assertEqual(couples(tc), couples(baseline))
+
+        interval_rows = [row for row in self.rows if row['date'] >= 250]
+        self.assertEqual(couples(tc), couples(self.baseline(interval_rows)[1]))
+
+    def test_top_couples_match_walk_by_score(self):
+        _, tc = coupling_modules(self.rows)
+        score = tc._TemporalCouplingModule__score_couple_matrix
+        with mock.patch.object(TemporalCouplingModule, 'NUM_TOP_COUPLES', 10 ** 9):
+            all_couples = score()
+        # Filtered couples (C headers, tests) are never scored
+        self.assertLess(len(all_couples), len(couples(tc)))
+
+        for num_top in (1, 5, 64):
+            # The top couples, then the highest scored couple of every file
+            expected, scored_files = [], set()
+            for couple in all_couples:
+                if len(expected) < num_top or not scored_files.issuperset(couple[1]):
+                    expected.append(couple)
+                    scored_files.update(couple[1])
+            with mock.patch.object(TemporalCouplingModule, 'NUM_TOP_COUPLES', num_top):
+                self.assertEqual(score(), expected)
+
+    def test_checkpoint_round_trip(self):
+        _, tc = coupling_modules(self.rows)
+        data = CheckpointCodec.decode(CheckpointCodec.encode(tc.persist_mappings()))
+        self.assertNotIn('working_couples', data)
+
+        loaded = TemporalCouplingModule(FileRecordStore(), UNSCOPED)
+        loaded.load_data(dict(data))
+        self.assertEqual(couples(loaded), couples(tc))
+
+        with mock.patch.object(TemporalCouplingModule, 'USE_SPARSE_ENGINE', False):
+            loaded = TemporalCouplingModule(FileRecordStore(), UNSCOPED)
+        loaded.load_data(dict(data))
+        self.assertEqual(couples(loaded), couples(tc))
+
+    def test_loads_checkpoints_of_dict_implementation(self):
+        _, baseline = self.baseline(self.rows)
+        data = CheckpointCodec.decode(CheckpointCodec.encode(baseline.persist_mappings()))
+        loaded = TemporalCouplingModule(FileRecordStore(), UNSCOPED)
+        loaded.load_data(data)
+        self.assertEqual(couples(loaded), couples(baseline))
+
+
+class CliqueColoringTest(unittest.TestCase):
+
+    def scored_couples(self, seed):
+        rng = random.Random(seed)
+        files = ['f%s' % i for i in xrange(40)]
+        pairs = set(tuple(sorted(rng.sample(files, 2))) for _ in xrange(150))
+        # Few distinct scores, so that ties are broken as in a stable sort
+        return [(float(rng.randint(1, 6)), pair, rng.randint(1, 5), rng.randint(5, 9) / 2.0)
+                for pair in pairs]
+
+    def test_matches_clique_coloring_of_adjacency_lists(self):
+        for seed in xrange(10):
+            scored_couples = self.scored_couples(seed)
+            rev_counts = dict(('f%s' % i, i + 1) for i in xrange(40))
+            tc = TemporalCouplingModule(FileRecordStore(), UNSCOPED)
+            tc.working_rev_counts.update(rev_counts)
+            colors = TemporalCouplingModule.CLIQUE_COLORS[:3]
+            with mock.patch.multiple(TemporalCouplingModule, NUM_TOP_COUPLES=12,
+                                     CLIQUE_COLORS=colors):
+                tc._TemporalCouplingModule__augment_working_data(scored_couples)
+
+            expected = baseline_coloring(scored_couples, 12, colors, rev_counts)
+            actual = dict((name, record[TemporalCouplingModule.MODULE_KEY].to_dict())
+                          for name, record in tc.working_data.iteritems())
+            self.assertEqual(sorted(actual), sorted(expected))
+            for name in expected:
+                self.assertEqual(dict((field, actual[name][field]) for field in expected[name]),
+                                 expected[name], name)
+            self.assertTrue(set(info['color'] for info in expected.itervalues())
+                            .issuperset(colors))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from codemd.utils import private_directory
+
+class PrivateDirectoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def test_creates_private_directories(self):
+        path = os.path.join(self.root, 'data', 'checkpoints')
+        self.assertEqual(private_directory(path), path)
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode) & 0o077, 0)
+        # Existing directories are checked
+        self.assertEqual(private_directory(path), path)
+
+    def test_rejects_directories_writable_by_others(self):
+        path = os.path.join(self.root, 'shared')
+        os.mkdir(path)
+        os.chmod(path, 0o777)
+        self.assertRaises(OSError, private_directory, path)
+
+    def test_rejects_files(self):
+        path = os.path.join(self.root, 'file')
+        open(path, 'w').close()
+        self.assertRaises(OSError, private_directory, path)
+
+
+if __name__ == '__main__':
+    unittest.main()
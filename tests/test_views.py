@@ -0,0 +1,152 @@
+import json
+import unittest
+from collections import OrderedDict
+
+import mock
+
+from codemd import app
+from codemd import views
+from codemd.metrics import metrics_builder
+from codemd.metrics.metrics_builder import MetricsBuilder
+from codemd.mining.bug_classifier import BugClassifier
+from tests.helpers import file_hierarchy
+
+class FetchDataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app.test_client()
+        self.form = {'inputUrl': 'https://github.com/dhaba/codemd.git',
+                     'inputProjectName': 'codemd', 'inputDescription': ''}
+
+    @mock.patch.object(views, 'DBHandler')
+    @mock.patch.object(views, 'JobManager')
+    def test_new_project_redirects_to_job_status_page(self, job_manager, db_handler):
+        job_manager.instance.return_value.submit_ingest.return_value = (
+            {'_id': '5a0000000000000000000001'}, True)
+        db_handler.project_ready.return_value = False
+
+        response = self.client.post('/fetchdata', data=self.form)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.location.endswith('/jobs/5a0000000000000000000001'))
+
+    @mock.patch.object(views, 'JobStore')
+    def test_job_status_page_polls_job(self, job_store):
+        job_store.return_value.find.return_value = {'project_name': 'codemd'}
+
+        response = self.client.get('/jobs/5a0000000000000000000001')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'/api/jobs/5a0000000000000000000001', response.data)
+        self.assertIn(b'/dashboards/codemd', response.data)
+
+
+class LegacyProjectTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    @mock.patch.object(views, 'DBHandler')
+    @mock.patch.object(views, 'JobManager')
+    def test_legacy_project_redirects_to_migration_job(self, job_manager, db_handler):
+        job_manager.instance.return_value.submit_migration.return_value = (
+            {'_id': '5a0000000000000000000002'}, True)
+        db_handler.needs_migration.return_value = True
+
+        for url in ('/dashboards/legacy', '/circle_packing/legacy'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 302)
+            self.assertTrue(response.location.endswith('/jobs/5a0000000000000000000002'))
+        job_manager.instance.return_value.submit_migration.assert_called_with('legacy')
+
+    @mock.patch.object(views, 'DBHandler')
+    @mock.patch.object(views, 'JobManager')
+    def test_migrated_project_is_served(self, job_manager, db_handler):
+        db_handler.needs_migration.return_value = False
+
+        response = self.client.get('/dashboards/codemd')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(job_manager.instance.called)
+
+
+class BugClassifierTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def post(self, config):
+        return self.client.post('/api/bug_classifier', data=json.dumps(config),
+                                content_type='application/json')
+
+    @mock.patch.object(views, 'DBHandler')
+    @mock.patch.object(views, 'JobManager')
+    def test_invalid_tokens_are_rejected(self, job_manager, db_handler):
+        db_handler.project_exists.return_value = True
+        for config in ({'tokens': 'bug'}, {'tokens': [1]}, {'first_tokens': [['fix']]}):
+            config['project_name'] = 'codemd'
+            self.assertEqual(self.post(config).status_code, 400)
+        self.assertFalse(job_manager.instance.called)
+
+    @mock.patch.object(views, 'DBHandler')
+    @mock.patch.object(views, 'JobManager')
+    def test_classifier_is_reclassified_in_a_job(self, job_manager, db_handler):
+        db_handler.project_exists.return_value = True
+        submit = job_manager.instance.return_value.submit_reclassify
+        submit.return_value = ({'_id': '5a0000000000000000000003'}, True)
+
+        response = self.post({'project_name': 'codemd', 'tokens': ['bug']})
+
+        self.assertEqual(response.status_code, 200)
+        submit.assert_called_once_with(
+            'codemd', {'first_tokens': sorted(BugClassifier.DEFAULT_FIRST_TOKENS),
+                       'tokens': ['bug']})
+
+
+class CirclePackingSubtreeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app.test_client()
+        patchers = [mock.patch.object(views, 'DBHandler'),
+                    mock.patch.object(metrics_builder, 'DBHandler'),
+                    mock.patch.object(metrics_builder, 'CirclePackingMetrics'),
+                    mock.patch.object(MetricsBuilder, '_MetricsBuilder__interval_trees',
+                                      OrderedDict())]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        views.DBHandler.project_ready.return_value = True
+        metrics_builder.DBHandler.ingest_status.return_value = {'updated': 1}
+        metrics_builder.CirclePackingMetrics.return_value.compute_file_hierarchy.side_effect = \
+            lambda: [file_hierarchy()]
+
+    def get(self, url, path=None):
+        query = {'project_name': 'codemd', 'start1': 1000, 'end1': 2000, 'max_depth': 1}
+        if path is not None:
+            query['path'] = path
+        response = self.client.get(url, query_string=query)
+        if response.status_code != 200:
+            return response.status_code, None
+        return response.status_code, json.loads(json.loads(response.data))
+
+    def test_collapsed_directories_are_expanded(self):
+        status, tree = self.get('/api/circle_packing')
+        self.assertEqual(status, 200)
+        d0 = next(child for child in tree['children'] if child['name'] == 'd0')
+        self.assertTrue(d0['collapsed'])
+
+        status, subtree = self.get('/api/circle_packing/subtree', d0['path'])
+        self.assertEqual(status, 200)
+        self.assertEqual(subtree['path'], 'd0')
+        self.assertEqual(subtree['dir_info'], d0['dir_info'])
+        self.assertGreater(len(subtree['children']), 0)
+        self.assertEqual(metrics_builder.CirclePackingMetrics.call_count, 1)
+
+    def test_missing_directories_are_not_found(self):
+        for path in ('nope', 'wide/f0.py'):
+            status, _ = self.get('/api/circle_packing/subtree', path)
+            self.assertEqual(status, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()